@@ -10,7 +10,10 @@ setup(
         'console_scripts': [
             'strainchoosr = strainchoosr.strainchoosr:main',
             'strainchoosr_gui = strainchoosr.strainchoosr_gui:main',
-            'strainchoosr_drawimage = strainchoosr.strainchoosr_gui:draw_image_wrapper'
+            'strainchoosr_drawimage = strainchoosr.strainchoosr_gui:draw_image_wrapper',
+            'strainchoosr_benchmark = strainchoosr.benchmark:main',
+            'strainchoosr_compare_engines = strainchoosr.differential:main',
+            'strainchoosr_batch = strainchoosr.batch:main'
         ],
     },
     author='Andrew Low',
@@ -20,6 +23,7 @@ setup(
     tests_require=['pytest'],
     install_requires=['pytest',
                       'ete3',
+                      'numpy',
                       'PyQt5==5.11.3',  # Apparently required by ete3 for visualisation, but not listed in that setup.py...
                       ]
 )
@@ -0,0 +1,191 @@
+import os
+import json
+import asyncio
+import hashlib
+import functools
+import threading
+import multiprocessing
+import concurrent.futures
+import ete3
+from strainchoosr import strainchoosr
+
+
+def _read_newick(tree):
+    # Trees get passed to workers as newick text, which is cheap to send to another process and easy to hash.
+    if not isinstance(tree, ete3.TreeNode):
+        if not os.path.isfile(tree):
+            return tree
+        text = strainchoosr.read_tree_text(tree)
+        # Plain newick (compressed or not) can go as is - NEXUS and PhyloXML get parsed and written back out.
+        if text.lstrip()[:1] not in ('#', '<'):
+            return text
+        tree = strainchoosr.parse_trees(text)[0]
+    # ete3 only writes 6 significant digits by default, which is enough to change which strains get picked.
+    return tree.write(format=1, dist_formatter='%r')
+
+
+def _choose_job(newick, numbers, options, cancel):
+    return strainchoosr.choose(newick, numbers, cancel=cancel, **options)
+
+
+def _evaluate_job(newick, sets, weights):
+    tree = strainchoosr.load_tree(newick)
+    if weights is not None:
+        tree = strainchoosr.modify_tree_with_weights(tree, weights)
+    return strainchoosr.phylogenetic_diversity(tree, sets).tolist()
+
+
+def _render_job(newick, results, output_dir, mode, color):
+    strainchoosr.render_results(newick, results, output_dir, mode=mode, color=color)
+    return results
+
+
+class AsyncStrainChoosr:
+    """
+
+    Runs strain picking, evaluation and rendering from asyncio code without blocking the event loop. The work gets
+    done in an executor (threads or processes), and cancelling the task that's waiting on a selection stops it
+    between picks. Identical requests (same tree and same options) that come in while one is already running share
+    it instead of each doing the work again.
+
+    Use it as an async context manager, or call close when done, so that any executor it made gets shut down.
+
+    Drawing always happens in another process, since Qt can't be used from threads it didn't start. With a thread
+    executor, a separate single-process executor gets made for it the first time something gets rendered.
+
+    :param executor: A concurrent.futures executor to run work in. If not given, one gets made.
+    :param kind: thread or process - the kind of executor to make if one isn't given. Processes get around the GIL,
+    threads skip sending trees and results between processes.
+    :param max_workers: Number of workers for the executor that gets made.
+    """
+    def __init__(self, executor=None, kind='thread', max_workers=None):
+        if kind not in ('thread', 'process'):
+            raise ValueError('Unknown executor kind {}, choose from thread or process.'.format(kind))
+        if executor is None:
+            if kind == 'thread':
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+            else:
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+            self._owns_executor = True
+        else:
+            self._owns_executor = False
+            kind = 'process' if isinstance(executor, concurrent.futures.ProcessPoolExecutor) else 'thread'
+        self.executor = executor
+        self.kind = kind
+        self._manager = None
+        self._render_executor = None
+        self._in_flight = dict()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+
+        Shuts down the executor (if it was made here) and anything used to send cancellations to other processes.
+        """
+        if self._owns_executor:
+            self.executor.shutdown(wait=True)
+        if self._render_executor is not None:
+            self._render_executor.shutdown(wait=True)
+            self._render_executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+    def _cancel_event(self):
+        if self.kind == 'thread':
+            return threading.Event()
+        # A plain threading.Event can't be seen from another process, so those go through a manager.
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        return self._manager.Event()
+
+    async def _run(self, function, *args, executor=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor or self.executor, functools.partial(function, *args))
+
+    def _renderer(self):
+        if self.kind == 'process':
+            return self.executor
+        if self._render_executor is None:
+            # Spawned rather than forked, so the drawing process doesn't inherit this one's threads.
+            self._render_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        return self._render_executor
+
+    async def _newick(self, tree):
+        # Reading the tree happens in the event loop's default thread pool, so ete3.Tree objects never have to be
+        # sent to another process.
+        return await asyncio.get_running_loop().run_in_executor(None, _read_newick, tree)
+
+    async def choose(self, tree, numbers, **options):
+        """
+
+        Async version of strainchoosr.choose. If the same request is already running, waits on that one instead of
+        starting another. Cancelling this coroutine stops the selection between picks, unless some other request is
+        still waiting on it.
+
+        :param tree: An ete3.Tree object, a path to a newick treefile, or a newick string.
+        :param numbers: Number of strains wanted, or a list of them.
+        :param options: Any other options for strainchoosr.choose (starting_strains, weights, exclude, engine,
+        collapse_threshold, coverage).
+        :return: List of StrainChoosrResult objects. Requests that share a selection get the same list.
+        """
+        newick = await self._newick(tree)
+        key = (hashlib.sha256(newick.encode('utf-8')).hexdigest(),
+               json.dumps([numbers, options], sort_keys=True, default=str))
+        entry = self._in_flight.get(key)
+        if entry is None:
+            cancel = self._cancel_event()
+            future = asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(
+                _choose_job, newick, numbers, options, cancel))
+            # Nobody might be left waiting on a cancelled selection, so make sure its error counts as seen.
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+            entry = {'future': future, 'cancel': cancel, 'waiting': 0}
+            self._in_flight[key] = entry
+        entry['waiting'] += 1
+        try:
+            return await asyncio.shield(entry['future'])
+        finally:
+            entry['waiting'] -= 1
+            if entry['waiting'] == 0:
+                if self._in_flight.get(key) is entry:
+                    del self._in_flight[key]
+                if not entry['future'].done():
+                    entry['cancel'].set()
+
+    async def evaluate(self, tree, sets, weights=None):
+        """
+
+        Async version of strainchoosr.phylogenetic_diversity.
+
+        :param tree: An ete3.Tree object, a path to a newick treefile, or a newick string.
+        :param sets: List of sets, where each set is a list of leaf names.
+        :param weights: Optional dictionary of weights (see read_weights_file) to apply to the tree first.
+        :return: List with the phylogenetic diversity of each set.
+        """
+        newick = await self._newick(tree)
+        return await self._run(_evaluate_job, newick, sets, weights)
+
+    async def render(self, tree, results, output_dir, mode='r', color='red'):
+        """
+
+        Async version of strainchoosr.render_results. Drawing uses Qt, which only works in the thread that started
+        it, so images always get drawn in another process - see AsyncStrainChoosr.
+
+        :param tree: An ete3.Tree object, a path to a newick treefile, or a newick string.
+        :param results: List of results from choose.
+        :param output_dir: Directory to put images in.
+        :param mode: r for rectangular or c for circular.
+        :param color: Color to highlight picked strains with.
+        :return: List of paths to the images. Each result's image gets set too.
+        """
+        newick = await self._newick(tree)
+        rendered = await self._run(_render_job, newick, results, output_dir, mode, color, executor=self._renderer())
+        for result, rendered_result in zip(results, rendered):
+            result.image = rendered_result.image
+        return [result.image for result in results]
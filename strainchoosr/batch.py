@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+from strainchoosr import strainchoosr
+
+JOB_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]+$')
+
+
+def read_manifest(manifest_file):
+    """
+
+    Reads a batch manifest - a file with one job per line, where each job is a JSON object of keyword arguments for
+    run_strainchoosr (treefile, number_representatives and so on). Each job can have a job_id, which names its
+    results. Jobs without one are named by line number. Blank lines and lines starting with # are skipped.
+
+    :param manifest_file: Path to the manifest.
+    :return: List of job dictionaries, each with a job_id.
+    """
+    jobs = list()
+    seen = set()
+    with open(manifest_file) as f:
+        for line_number, line in enumerate(f, start=1):
+            stripped_line = line.strip()
+            if stripped_line == '' or stripped_line.startswith('#'):
+                continue
+            try:
+                job = json.loads(stripped_line)
+            except ValueError:
+                raise ValueError('Line {} of your manifest ({}) is not valid JSON: {}'
+                                 .format(line_number, manifest_file, stripped_line))
+            if not isinstance(job, dict):
+                raise ValueError('Line {} of your manifest ({}) should be a JSON object of options for '
+                                 'run_strainchoosr.'.format(line_number, manifest_file))
+            job_id = str(job.get('job_id', 'job_{}'.format(line_number)))
+            if not JOB_ID_PATTERN.match(job_id):
+                raise ValueError('Job ID {} can only have letters, numbers, dots, dashes and underscores, since it '
+                                 'gets used as a file name.'.format(job_id))
+            if job_id in seen:
+                raise ValueError('Job ID {} shows up more than once in your manifest.'.format(job_id))
+            seen.add(job_id)
+            job['job_id'] = job_id
+            jobs.append(job)
+    return jobs
+
+
+def _atomic_write(path, text):
+    # Written under a temporary name in the same directory and then moved into place, so nobody reading the shared
+    # directory ever sees half a file.
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w') as f:
+            f.write(text)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+class WorkQueue:
+    """
+
+    A queue of jobs kept in a directory that every node can see, with no other services needed. A node claims a job
+    by creating claims/<job_id>.lock, which only one node can do since the file gets created exclusively. Results go
+    to results/<job_id>.json, written atomically. While a job runs, its lock keeps getting touched - a lock that
+    hasn't been touched for stale_after seconds belongs to a node that died, and the job can be claimed again. Each
+    claim has its own token written in it, so a node only ever touches or removes its own claims, and taking over a
+    stale claim can't remove a fresh one that replaced it in the meantime.
+
+    :param queue_dir: Shared directory for the queue. Gets created if it doesn't exist.
+    :param stale_after: Seconds after which a claim that hasn't been touched counts as abandoned. Defaults to an hour.
+    """
+    def __init__(self, queue_dir, stale_after=3600):
+        self.queue_dir = queue_dir
+        self.stale_after = stale_after
+        self.claims_dir = os.path.join(queue_dir, 'claims')
+        self.results_dir = os.path.join(queue_dir, 'results')
+        self.reports_dir = os.path.join(queue_dir, 'reports')
+        # Token written into each claim this node holds, so it can tell its own claims apart from newer ones.
+        self._tokens = dict()
+        for directory in (self.claims_dir, self.results_dir, self.reports_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def _lock(self, job_id):
+        return os.path.join(self.claims_dir, job_id + '.lock')
+
+    def _result(self, job_id):
+        return os.path.join(self.results_dir, job_id + '.json')
+
+    def _read_claim(self, path):
+        # Token and last touch of a claim, or None if there's no claim at path. A claim that's been created but not
+        # written yet has no token.
+        try:
+            modified = os.path.getmtime(path)
+            with open(path) as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            token = json.loads(text).get('token')
+        except ValueError:
+            token = None
+        return token, modified
+
+    def _take(self, job_id, expected):
+        # Moves the claim on a job out of the way, as long as it's still the one that was looked at (expected is a
+        # token and a last touch, from _read_claim). The rename is atomic, so only one node can get any given claim
+        # file - but it might be a newer claim than the one that was looked at, so the token and last touch get
+        # checked afterwards and the claim gets put back if it's not the one expected.
+        lock = self._lock(job_id)
+        moved = '{}.{}'.format(lock, uuid.uuid4().hex)
+        try:
+            os.rename(lock, moved)
+        except FileNotFoundError:
+            return False
+        if self._read_claim(moved) == expected:
+            os.remove(moved)
+            return True
+        try:
+            # Linking fails instead of overwriting if yet another claim has shown up in the meantime.
+            os.link(moved, lock)
+        except FileExistsError:
+            logging.warning('Claim on job {} was replaced while being checked.'.format(job_id))
+        os.remove(moved)
+        return False
+
+    def claim(self, job_id):
+        """
+
+        :param job_id: Job to claim.
+        :return: True if this node now has the job, False if some other node does.
+        """
+        lock = self._lock(job_id)
+        for _ in range(2):
+            token = uuid.uuid4().hex
+            try:
+                handle = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                seen = self._read_claim(lock)
+                if seen is None:
+                    continue
+                age = time.time() - seen[1]
+                if age < self.stale_after:
+                    return False
+                if self._take(job_id, seen):
+                    logging.warning('Claim on job {} went stale after {:.0f} seconds, claiming it again.'
+                                    .format(job_id, age))
+                continue
+            claim = {'token': token, 'host': socket.gethostname(), 'pid': os.getpid(), 'claimed': time.time()}
+            with os.fdopen(handle, 'w') as f:
+                json.dump(claim, f)
+            self._tokens[job_id] = token
+            return True
+        return False
+
+    def heartbeat(self, job_id):
+        """
+
+        Touches a job's claim so it doesn't go stale, as long as this node still has it.
+
+        :return: True if the claim was touched, False if some other node has taken the job over.
+        """
+        seen = self._read_claim(self._lock(job_id))
+        if seen is None or seen[0] != self._tokens.get(job_id):
+            return False
+        try:
+            os.utime(self._lock(job_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, job_id):
+        """
+
+        Gives up this node's claim on a job. A claim some other node has taken over gets left alone.
+        """
+        token = self._tokens.pop(job_id, None)
+        seen = self._read_claim(self._lock(job_id))
+        if seen is not None and token is not None and seen[0] == token:
+            self._take(job_id, seen)
+
+    def is_claimed(self, job_id):
+        """
+
+        :return: True if some node has a claim on the job that hasn't gone stale.
+        """
+        try:
+            return time.time() - os.path.getmtime(self._lock(job_id)) < self.stale_after
+        except FileNotFoundError:
+            return False
+
+    def result(self, job_id):
+        """
+
+        :return: Dictionary with the job's result, or None if it hasn't finished.
+        """
+        try:
+            with open(self._result(job_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write_result(self, job_id, result):
+        """
+
+        Writes a job's result atomically.
+
+        :param result: Dictionary that can be written as JSON.
+        """
+        _atomic_write(self._result(job_id), json.dumps(result, indent=2))
+
+
+def run_job(job, queue):
+    """
+
+    Runs one job from a manifest with run_strainchoosr. Unless the job gives an output_name, its report goes to
+    reports/<job_id> in the queue directory.
+
+    :param job: Job dictionary from read_manifest.
+    :param queue: The WorkQueue the job came from.
+    :return: Dictionary where number of strains is the key and the value is a list of strains picked.
+    """
+    options = {key: value for key, value in job.items() if key != 'job_id'}
+    options.setdefault('output_name', os.path.join(queue.reports_dir, job['job_id']))
+    return strainchoosr.run_strainchoosr(**options)
+
+
+def work(manifest_file, queue_dir, stale_after=3600, poll_seconds=10, max_jobs=None, retry_failed=False,
+         runner=run_job):
+    """
+
+    Runs jobs from a manifest until every job has a result. Any number of these can run at once on any number of
+    nodes that share queue_dir - each job only gets run by one of them. Once there's nothing left to claim, a worker
+    waits for jobs other nodes are running, so it can take over any whose node dies.
+
+    :param manifest_file: Path to the manifest (see read_manifest).
+    :param queue_dir: Shared directory for the queue (see WorkQueue).
+    :param stale_after: Seconds after which a claim that hasn't been touched counts as abandoned.
+    :param poll_seconds: Seconds to wait between checks on jobs other nodes are running.
+    :param max_jobs: If specified, stop after running this many jobs.
+    :param retry_failed: If True, jobs that failed before get run again.
+    :param runner: Function that takes a job and a WorkQueue and returns the job's selections. Defaults to run_job.
+    :return: List of IDs of the jobs this worker ran.
+    """
+    jobs = read_manifest(manifest_file)
+    queue = WorkQueue(queue_dir, stale_after=stale_after)
+    ran = list()
+
+    def finished(job_id):
+        result = queue.result(job_id)
+        return result is not None and (result['status'] == 'done' or not retry_failed or job_id in ran)
+
+    while True:
+        waiting = False
+        for job in jobs:
+            if max_jobs is not None and len(ran) >= max_jobs:
+                return ran
+            job_id = job['job_id']
+            if finished(job_id):
+                continue
+            if not queue.claim(job_id):
+                waiting = True
+                continue
+            # Some other node may have finished the job between checking for a result and claiming it.
+            if finished(job_id):
+                queue.release(job_id)
+                continue
+            logging.info('Running job {}'.format(job_id))
+            stop = threading.Event()
+            beat = threading.Thread(target=_keep_alive, args=(queue, job_id, stop), daemon=True)
+            beat.start()
+            start = time.time()
+            result = {'job_id': job_id, 'host': socket.gethostname(), 'started': start}
+            try:
+                selections = runner(job, queue)
+                result.update({'status': 'done',
+                               'selections': {str(number): strains for number, strains in selections.items()}})
+            except Exception as e:
+                logging.warning('Job {} failed: {}'.format(job_id, e))
+                result.update({'status': 'failed', 'error': '{}: {}'.format(type(e).__name__, e)})
+            finally:
+                stop.set()
+                beat.join()
+            result['seconds'] = time.time() - start
+            queue.write_result(job_id, result)
+            queue.release(job_id)
+            ran.append(job_id)
+            logging.info('Finished job {} in {:.1f} seconds.'.format(job_id, result['seconds']))
+        if not waiting:
+            return ran
+        time.sleep(poll_seconds)
+
+
+def _keep_alive(queue, job_id, stop):
+    # Touching the claim a few times per stale_after means a slow job never looks abandoned.
+    while not stop.wait(max(queue.stale_after / 4, 0.01)):
+        if not queue.heartbeat(job_id):
+            logging.warning('Lost the claim on job {} to another node.'.format(job_id))
+            return
+
+
+def compile_summary(manifest_file, queue_dir, output_file=None):
+    """
+
+    Gathers up the results of every job in a manifest. Can be run from any node, at any time - jobs that haven't
+    finished show up as running or pending.
+
+    :param manifest_file: Path to the manifest (see read_manifest).
+    :param queue_dir: Shared directory for the queue (see WorkQueue).
+    :param output_file: If specified, the summary gets written (atomically) to this file, tab-separated.
+    :return: List of (job ID, status, number of strains, strains picked, seconds, host) tuples, with one row for
+    every number of strains in each finished job and one row with blanks for jobs that failed or haven't finished.
+    """
+    queue = WorkQueue(queue_dir)
+    rows = list()
+    for job in read_manifest(manifest_file):
+        job_id = job['job_id']
+        result = queue.result(job_id)
+        if result is None:
+            rows.append((job_id, 'running' if queue.is_claimed(job_id) else 'pending', '', '', '', ''))
+        elif result['status'] != 'done':
+            # Errors can run over several lines, which would break up the table.
+            error = ' '.join(result.get('error', '').split())
+            rows.append((job_id, result['status'], '', error, result['seconds'], result['host']))
+        else:
+            for number, strains in result['selections'].items():
+                rows.append((job_id, 'done', number, ','.join(strains), result['seconds'], result['host']))
+    if output_file is not None:
+        lines = ['JobID\tStatus\tStrains\tPicked\tSeconds\tHost']
+        lines.extend('\t'.join(str(value) for value in row) for row in rows)
+        _atomic_write(os.path.abspath(output_file), '\n'.join(lines) + '\n')
+    return rows
+
+
+def argument_parsing(args):
+    parser = argparse.ArgumentParser(description='Spreads lots of StrainChoosr runs across nodes that share a '
+                                                 'filesystem. Start a worker on every node, and each run in the '
+                                                 'manifest gets done by exactly one of them.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    worker = subparsers.add_parser('work',
+                                   help='Run jobs from the manifest until every job has a result.')
+    summary = subparsers.add_parser('summary',
+                                    help='Gather up the results of every job in the manifest.')
+    for subparser in (worker, summary):
+        subparser.add_argument('--manifest',
+                               type=str,
+                               required=True,
+                               help='Path to a file with one job per line, each a JSON object of options for '
+                                    'run_strainchoosr, like {"job_id": "panel_a", "treefile": "/data/a.nwk", '
+                                    '"number_representatives": [10, 20]}.')
+        subparser.add_argument('--queue_dir',
+                               type=str,
+                               required=True,
+                               help='Directory every node can see, for claims, results and reports.')
+    worker.add_argument('--stale_after',
+                        type=float,
+                        default=3600,
+                        help='Seconds after which a claim on a job that hasn\'t been touched counts as abandoned '
+                             '(because its node died) and the job gets run again. Defaults to 3600.')
+    worker.add_argument('--poll',
+                        type=float,
+                        default=10,
+                        help='Seconds to wait between checks on jobs other nodes are running. Defaults to 10.')
+    worker.add_argument('--max_jobs',
+                        type=int,
+                        help='If specified, stop after running this many jobs.')
+    worker.add_argument('--retry_failed',
+                        action='store_true',
+                        help='Run jobs that failed before again.')
+    summary.add_argument('-o', '--output',
+                         type=str,
+                         help='File to write the summary to. If not given, it gets printed.')
+    return parser.parse_args(args)
+
+
+def main():
+    args = argument_parsing(sys.argv[1:])
+    logging.basicConfig(format='\033[92m \033[1m %(asctime)s \033[0m %(message)s ',
+                        level=logging.INFO,
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    if args.command == 'work':
+        ran = work(args.manifest, args.queue_dir, stale_after=args.stale_after, poll_seconds=args.poll,
+                   max_jobs=args.max_jobs, retry_failed=args.retry_failed)
+        logging.info('Ran {} jobs.'.format(len(ran)))
+    else:
+        rows = compile_summary(args.manifest, args.queue_dir, output_file=args.output)
+        if args.output is None:
+            for row in rows:
+                print('\t'.join(str(value) for value in row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import random
+import logging
+import argparse
+import tempfile
+from strainchoosr import strainchoosr
+
+# Operations that go through the original ete3 code get slow fast, so they only run up to these many leaves (and
+# strains picked) by default. Everything else runs at every size.
+REFERENCE_LEAF_LIMIT = 100
+REFERENCE_PICK_LIMIT = 10
+RENDER_LEAF_LIMIT = 1000
+
+SHAPES = ['balanced', 'caterpillar', 'star', 'coalescent']
+SIZES = [100, 1000, 10000, 100000, 200000]
+NUMBERS_TO_PICK = [10, 100, 1000]
+
+
+def _leaf(number, rng):
+    return 'strain_{}:{:.6g}'.format(number, rng.uniform(0.0001, 0.01))
+
+
+def balanced_tree(number_leaves, seed=0):
+    """
+
+    :param number_leaves: Number of leaves the tree should have. Must be at least 2.
+    :param seed: Seed for branch lengths.
+    :return: Newick string for a (as close as possible to) perfectly balanced binary tree.
+    """
+    rng = random.Random(seed)
+    level = [_leaf(number, rng) for number in range(number_leaves)]
+    while len(level) > 1:
+        next_level = ['({},{}):{:.6g}'.format(level[i], level[i + 1], rng.uniform(0.0001, 0.01))
+                      for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2 == 1:
+            next_level.append(level[-1])
+        level = next_level
+    return level[0].rsplit(':', 1)[0] + ';'
+
+
+def caterpillar_tree(number_leaves, seed=0):
+    """
+
+    :param number_leaves: Number of leaves the tree should have. Must be at least 2.
+    :param seed: Seed for branch lengths.
+    :return: Newick string for a caterpillar (ladder) tree, where every internal node has a leaf as one child - as
+    deep as a tree with this many leaves can get.
+    """
+    rng = random.Random(seed)
+    parts = ['(' * (number_leaves - 1), _leaf(0, rng), ',', _leaf(1, rng), ')']
+    for number in range(2, number_leaves):
+        parts.append(':{:.6g},{})'.format(rng.uniform(0.0001, 0.01), _leaf(number, rng)))
+    parts.append(';')
+    return ''.join(parts)
+
+
+def star_tree(number_leaves, seed=0):
+    """
+
+    :param number_leaves: Number of leaves the tree should have.
+    :param seed: Seed for branch lengths.
+    :return: Newick string for a star tree, with every leaf hanging directly off the root.
+    """
+    rng = random.Random(seed)
+    return '({});'.format(','.join(_leaf(number, rng) for number in range(number_leaves)))
+
+
+def coalescent_tree(number_leaves, seed=0):
+    """
+
+    :param number_leaves: Number of leaves the tree should have. Must be at least 2.
+    :param seed: Seed for the shape of the tree and its branch lengths.
+    :return: Newick string for a tree drawn from the Kingman coalescent, which looks a lot like trees of real
+    populations - lots of short branches near the tips, a few long ones near the root.
+    """
+    rng = random.Random(seed)
+    lineages = [('strain_{}'.format(number), 0.0) for number in range(number_leaves)]
+    height = 0.0
+    while len(lineages) > 1:
+        count = len(lineages)
+        height += rng.expovariate(count * (count - 1) / 2)
+        first, second = rng.sample(range(count), 2)
+        (first_subtree, first_height), (second_subtree, second_height) = lineages[first], lineages[second]
+        merged = ('({}:{:.6g},{}:{:.6g})'.format(first_subtree, height - first_height,
+                                                 second_subtree, height - second_height), height)
+        # Swap the merged lineages to the end so removing them is cheap.
+        for index in sorted([first, second], reverse=True):
+            lineages[index] = lineages[-1]
+            lineages.pop()
+        lineages.append(merged)
+    return lineages[0][0] + ';'
+
+
+TREE_GENERATORS = {'balanced': balanced_tree,
+                   'caterpillar': caterpillar_tree,
+                   'star': star_tree,
+                   'coalescent': coalescent_tree}
+
+
+def _case_key(case):
+    return '{shape}/{leaves}/{operation}/{number}'.format(**case)
+
+
+def _time_case(results, shape, leaves, operation, function, number=None):
+    """
+
+    Runs function as one benchmark case, and adds a record of how long it took and how much memory it used to results.
+    Errors get recorded rather than raised, so one case hitting something like a RecursionError doesn't stop the rest.
+
+    :return: Whatever function returns, or None if it raised.
+    """
+    case = {'shape': shape, 'leaves': leaves, 'operation': operation, 'number': number}
+    profiler = strainchoosr.StageProfiler(enabled=True)
+    value = None
+    logging.info('Running {}'.format(_case_key(case)))
+    try:
+        with profiler.stage(operation):
+            value = function()
+        case['error'] = None
+    except (RecursionError, MemoryError, RuntimeError, ValueError) as e:
+        case['error'] = '{}: {}'.format(type(e).__name__, e)
+        logging.warning('{} failed with {}'.format(_case_key(case), case['error']))
+    record = profiler.stages[operation]
+    case['wall_seconds'] = record['wall_seconds']
+    case['cpu_seconds'] = record['cpu_seconds']
+    case['peak_traced_bytes'] = record['peak_traced_bytes']
+    case['leaves_per_second'] = leaves / record['wall_seconds'] if record['wall_seconds'] > 0 else None
+    results.append(case)
+    return value
+
+
+def run_benchmarks(sizes=None, shapes=None, numbers_to_pick=None, seed=0, reference_leaf_limit=REFERENCE_LEAF_LIMIT,
+                   render_leaf_limit=RENDER_LEAF_LIMIT):
+    """
+
+    Times parsing, finding starting leaves, greedy selection, weighting, rendering and report generation on synthetic
+    trees of every shape and size asked for.
+
+    :param sizes: List of numbers of leaves. Defaults to SIZES.
+    :param shapes: List of tree shapes, from TREE_GENERATORS. Defaults to all of them.
+    :param numbers_to_pick: List of numbers of strains to pick in selection benchmarks. Defaults to NUMBERS_TO_PICK.
+    :param seed: Seed for tree generation and weights.
+    :param reference_leaf_limit: Largest tree to run the original ete3-based starting leaf search and pd_greedy on.
+    pd_greedy only gets run for up to REFERENCE_PICK_LIMIT strains.
+    :param render_leaf_limit: Largest tree to draw.
+    :return: List of dictionaries, one per case, with shape, leaves, operation, number (of strains picked, where that
+    applies), wall_seconds, cpu_seconds, peak_traced_bytes, leaves_per_second and error.
+    """
+    sizes = SIZES if sizes is None else sizes
+    shapes = SHAPES if shapes is None else shapes
+    numbers_to_pick = NUMBERS_TO_PICK if numbers_to_pick is None else numbers_to_pick
+    results = list()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for shape in shapes:
+            for leaves in sizes:
+                treefile = os.path.join(tmpdir, 'tree.nwk')
+                with open(treefile, 'w') as f:
+                    f.write(TREE_GENERATORS[shape](leaves, seed=seed))
+                tree = _time_case(results, shape, leaves, 'parse', lambda: strainchoosr.load_tree(treefile))
+                if tree is None:
+                    continue
+                compact = _time_case(results, shape, leaves, 'compact_tree', lambda: strainchoosr.CompactTree(tree))
+                if compact is None:
+                    continue
+                _time_case(results, shape, leaves, 'starting_leaves_fast', lambda: compact.find_starting_leaves([]))
+                if leaves <= reference_leaf_limit:
+                    _time_case(results, shape, leaves, 'starting_leaves_reference',
+                               lambda: strainchoosr.find_starting_leaves(tree, []))
+                picks = list()
+                for number in numbers_to_pick:
+                    if number > leaves:
+                        continue
+                    picks = _time_case(results, shape, leaves, 'selection_fast',
+                                       lambda: strainchoosr.compact_pd_greedy(compact, number, []), number=number)
+                    if leaves <= reference_leaf_limit and number <= REFERENCE_PICK_LIMIT:
+                        _time_case(results, shape, leaves, 'selection_reference',
+                                   lambda: strainchoosr.pd_greedy(tree, number, []), number=number)
+                rng = random.Random(seed)
+                weights = {name: rng.uniform(0.5, 2) for name in rng.sample(tree.get_leaf_names(),
+                                                                            max(1, leaves // 100))}
+                _time_case(results, shape, leaves, 'weighting',
+                           lambda: strainchoosr.modify_tree_with_weights(tree, weights))
+                representatives = [compact.names[leaf] for leaf in picks or []]
+                image = None
+                if leaves <= render_leaf_limit:
+                    image = os.path.join(tmpdir, 'tree.png')
+                    _time_case(results, shape, leaves, 'rendering',
+                               lambda: strainchoosr.create_colored_tree_tip_image(tree_to_draw=tree,
+                                                                                  representatives=representatives,
+                                                                                  output_file=image))
+                    if not os.path.isfile(image):
+                        image = None
+                report = os.path.join(tmpdir, 'report.html')
+                completed_choosr = strainchoosr.CompletedStrainChoosr(representatives=representatives,
+                                                                      image=image,
+                                                                      name='{} Strains'.format(len(representatives)))
+                _time_case(results, shape, leaves, 'report',
+                           lambda: strainchoosr.generate_html_report([completed_choosr], report))
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25, min_seconds=0.05):
+    """
+
+    Looks for cases that got slower or hungrier than they were in a baseline run.
+
+    :param results: List of case dictionaries from run_benchmarks.
+    :param baseline: List of case dictionaries from an earlier run_benchmarks (usually read from its JSON output).
+    :param tolerance: How much worse than the baseline (as a fraction) a case can get before it's flagged.
+    :param min_seconds: Cases have to be slower by at least this much to be flagged, so tiny cases that are mostly
+    noise don't get flagged.
+    :return: List of strings describing each regression. Empty if there weren't any.
+    """
+    baseline_cases = {_case_key(case): case for case in baseline}
+    regressions = list()
+    for case in results:
+        key = _case_key(case)
+        if key not in baseline_cases:
+            continue
+        old = baseline_cases[key]
+        if case['error'] is not None and old['error'] is None:
+            regressions.append('{} now fails with {}'.format(key, case['error']))
+            continue
+        if case['error'] is not None or old['error'] is not None:
+            continue
+        if case['wall_seconds'] > old['wall_seconds'] * (1 + tolerance) and \
+                case['wall_seconds'] - old['wall_seconds'] > min_seconds:
+            regressions.append('{} took {:.3f}s, baseline was {:.3f}s'.format(key, case['wall_seconds'],
+                                                                              old['wall_seconds']))
+        if case['peak_traced_bytes'] > old['peak_traced_bytes'] * (1 + tolerance) and \
+                case['peak_traced_bytes'] - old['peak_traced_bytes'] > 1024 * 1024:
+            regressions.append('{} peaked at {} bytes, baseline was {} bytes'.format(key, case['peak_traced_bytes'],
+                                                                                     old['peak_traced_bytes']))
+    return regressions
+
+
+def argument_parsing(args):
+    parser = argparse.ArgumentParser(description='Times StrainChoosr on synthetic trees of different shapes and sizes, '
+                                                 'and flags anything that got slower than a saved baseline.')
+    parser.add_argument('--sizes',
+                        type=int,
+                        nargs='+',
+                        default=SIZES,
+                        help='Numbers of leaves to benchmark, separated by spaces. Defaults to {}.'
+                             .format(' '.join(str(size) for size in SIZES)))
+    parser.add_argument('--shapes',
+                        nargs='+',
+                        choices=SHAPES,
+                        default=SHAPES,
+                        help='Tree shapes to benchmark. Defaults to all of them.')
+    parser.add_argument('-n', '--number',
+                        type=int,
+                        nargs='+',
+                        default=NUMBERS_TO_PICK,
+                        help='Numbers of strains to pick in selection benchmarks. Defaults to {}.'
+                             .format(' '.join(str(number) for number in NUMBERS_TO_PICK)))
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Seed for generating trees. Defaults to 0.')
+    parser.add_argument('--reference_leaf_limit',
+                        type=int,
+                        default=REFERENCE_LEAF_LIMIT,
+                        help='Largest tree to run the original ete3-based code on. Defaults to {}.'
+                             .format(REFERENCE_LEAF_LIMIT))
+    parser.add_argument('--render_leaf_limit',
+                        type=int,
+                        default=RENDER_LEAF_LIMIT,
+                        help='Largest tree to draw. Defaults to {}.'.format(RENDER_LEAF_LIMIT))
+    parser.add_argument('-o', '--output',
+                        type=str,
+                        help='File to write results to, as JSON. Can be used as a baseline for later runs.')
+    parser.add_argument('--baseline',
+                        type=str,
+                        help='JSON results from an earlier run to compare against. If any case got slower (or used '
+                             'more memory) by more than --tolerance, the regressions are printed and the exit code '
+                             'is 1.')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.25,
+                        help='How much worse than the baseline (as a fraction) a case can get before it is flagged. '
+                             'Defaults to 0.25.')
+    return parser.parse_args(args)
+
+
+def main():
+    args = argument_parsing(sys.argv[1:])
+    logging.basicConfig(format='\033[92m \033[1m %(asctime)s \033[0m %(message)s ',
+                        level=logging.INFO,
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    results = run_benchmarks(sizes=args.sizes,
+                             shapes=args.shapes,
+                             numbers_to_pick=args.number,
+                             seed=args.seed,
+                             reference_leaf_limit=args.reference_leaf_limit,
+                             render_leaf_limit=args.render_leaf_limit)
+    for case in results:
+        print('{}\t{:.4f}s\t{} bytes{}'.format(_case_key(case), case['wall_seconds'], case['peak_traced_bytes'],
+                                               '\t' + case['error'] if case['error'] else ''))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'version': strainchoosr.get_version(), 'results': results}, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_to_baseline(results, baseline, tolerance=args.tolerance)
+        for regression in regressions:
+            print('REGRESSION: {}'.format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import random
+import logging
+import argparse
+import ete3
+from strainchoosr import strainchoosr
+
+
+def random_tree(rng, number_leaves, zero_fraction=0.2, duplicate_fraction=0.0, polytomy_fraction=0.1):
+    """
+
+    Makes a random tree that's good at turning up differences between selection engines. Branch lengths are small
+    multiples of 1/8, so sums are exact in floating point and ties between candidate leaves are common and real.
+
+    :param rng: A random.Random object.
+    :param number_leaves: Number of leaves the tree should have. Must be at least 2.
+    :param zero_fraction: Fraction of branches that get a length of zero.
+    :param duplicate_fraction: Fraction of leaves that get the same name as some other leaf.
+    :param polytomy_fraction: Fraction of internal nodes that get three children instead of two.
+    :return: Newick string.
+    """
+    names = list()
+    for number in range(number_leaves):
+        if names and rng.random() < duplicate_fraction:
+            names.append(rng.choice(names))
+        else:
+            names.append('strain_{}'.format(number))
+    subtrees = list(names)
+    while len(subtrees) > 1:
+        number_children = 3 if len(subtrees) > 2 and rng.random() < polytomy_fraction else 2
+        children = list()
+        for _ in range(number_children):
+            children.append(subtrees.pop(rng.randrange(len(subtrees))))
+        lengths = [0 if rng.random() < zero_fraction else rng.randint(1, 8) / 8 for _ in children]
+        subtrees.append('({})'.format(','.join('{}:{}'.format(child, length)
+                                               for child, length in zip(children, lengths))))
+    return subtrees[0] + ';'
+
+
+def _names(nodes):
+    return [None if node is None else node.name for node in nodes]
+
+
+def compare_engines(number_trees=1000, seed=0, min_leaves=3, max_leaves=25, duplicate_fraction=0.05):
+    """
+
+    Runs pd_greedy with the reference and fast engines on lots of random trees (see random_tree) with random numbers
+    of strains to pick and random starting strains, and checks they pick exactly the same strains in the same order.
+
+    The reference engine can't handle trees with duplicate leaf names and raises an error on them - those get counted
+    separately rather than as mismatches. On real trees, where branch lengths aren't exact in floating point, candidates
+    that tie to within rounding error can also come out in a different order, since the two engines add up branch
+    lengths differently - random_tree sticks to exact branch lengths so those don't hide real differences.
+
+    :param number_trees: Number of random trees to try.
+    :param seed: Seed for making trees.
+    :param min_leaves: Fewest leaves a tree can have.
+    :param max_leaves: Most leaves a tree can have.
+    :param duplicate_fraction: Fraction of trees that get some duplicated leaf names.
+    :return: Dictionary with number of trees, number of matches, a list of mismatches (each a dictionary with the
+    newick string, starting strain names, number of strains, and the names each engine picked), the number of trees
+    where the reference engine raised an error, the seconds each engine took in total, and the speedup.
+    """
+    rng = random.Random(seed)
+    summary = {'trees': number_trees,
+               'matches': 0,
+               'mismatches': list(),
+               'reference_errors': 0,
+               'reference_seconds': 0.0,
+               'fast_seconds': 0.0}
+    for _ in range(number_trees):
+        newick = random_tree(rng, rng.randint(min_leaves, max_leaves),
+                             zero_fraction=rng.choice([0, 0.2, 0.5]),
+                             duplicate_fraction=0.2 if rng.random() < duplicate_fraction else 0,
+                             polytomy_fraction=rng.choice([0, 0.2]))
+        tree = ete3.Tree(newick)
+        leaves = tree.get_leaves()
+        starting_strains = rng.sample(leaves, rng.choice([0, 0, 1, 2, 3]))
+        number = rng.randint(1, len(leaves))
+        start = time.perf_counter()
+        try:
+            reference = _names(strainchoosr.pd_greedy(tree, number, starting_strains))
+        except Exception as e:
+            reference = '{}: {}'.format(type(e).__name__, e)
+        summary['reference_seconds'] += time.perf_counter() - start
+        start = time.perf_counter()
+        fast = _names(strainchoosr.pd_greedy(tree, number, starting_strains, engine='fast'))
+        summary['fast_seconds'] += time.perf_counter() - start
+        if isinstance(reference, str):
+            summary['reference_errors'] += 1
+        elif reference == fast:
+            summary['matches'] += 1
+        else:
+            summary['mismatches'].append({'newick': newick,
+                                          'starting_strains': _names(starting_strains),
+                                          'number': number,
+                                          'reference': reference,
+                                          'fast': fast})
+    summary['speedup'] = summary['reference_seconds'] / summary['fast_seconds'] if summary['fast_seconds'] else None
+    return summary
+
+
+def argument_parsing(args):
+    parser = argparse.ArgumentParser(description='Checks that the reference and fast implementations of the greedy '
+                                                 'algorithm pick exactly the same strains on lots of random trees, '
+                                                 'and reports how much faster the fast one is.')
+    parser.add_argument('--trees',
+                        type=int,
+                        default=1000,
+                        help='Number of random trees to try. Defaults to 1000.')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Seed for making trees. Defaults to 0.')
+    parser.add_argument('--max_leaves',
+                        type=int,
+                        default=25,
+                        help='Most leaves a random tree can have. Defaults to 25.')
+    return parser.parse_args(args)
+
+
+def main():
+    args = argument_parsing(sys.argv[1:])
+    # pd_greedy logs every strain it works on, which is far too much here.
+    logging.basicConfig(level=logging.WARNING)
+    summary = compare_engines(number_trees=args.trees, seed=args.seed, max_leaves=args.max_leaves)
+    for mismatch in summary['mismatches']:
+        print('MISMATCH: {}'.format(mismatch))
+    print('Trees: {}'.format(summary['trees']))
+    print('Matches: {}'.format(summary['matches']))
+    print('Mismatches: {}'.format(len(summary['mismatches'])))
+    print('Reference engine errors: {}'.format(summary['reference_errors']))
+    print('Speedup: {:.1f}x'.format(summary['speedup']))
+    if summary['mismatches']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,43 @@
 #!/usr/bin/env python
 import os
+import re
 import sys
-import copy
+import bz2
+import gzip
+import json
+import lzma
+import time
 import base64
+import shutil
+import hashlib
+import cProfile
 import logging
 import tempfile
 import argparse
+import contextlib
+import tracemalloc
 import pkg_resources
+import multiprocessing
+import xml.etree.ElementTree as ElementTree
 
 # Other stuff
 import ete3
+import numpy as np
+try:
+    import resource
+except ImportError:  # Not available on Windows - peak RSS just doesn't get reported there.
+    resource = None
 from ete3 import NodeStyle, TreeStyle, TextFace
 from ete3.parser.newick import NewickError
 
 
+class SelectionCancelled(RuntimeError):
+    """
+
+    Raised when strain picking gets stopped part way through because the cancel event passed to pd_greedy was set.
+    """
+
+
 def get_version():
     """
 
@@ -29,7 +53,7 @@ def get_version():
     return version
 
 
-def find_starting_leaves(tree, starting_leaf_list):
+def find_starting_leaves(tree, starting_leaf_list, exclude=()):
     """
 
     Gets the start of what the most diverse set of strains should be.
@@ -40,12 +64,13 @@ def find_starting_leaves(tree, starting_leaf_list):
 
     :param tree: An ete3.Tree object
     :param starting_leaf_list: A list of ete3.TreeNode objects.
+    :param exclude: Names of leaves that can't be picked.
     :return: A list of ete3.TreeNode objects representing the most diverse starting set possible
     """
     logging.debug('Finding starting leaves.')
     if len(starting_leaf_list) == 0:
         logging.debug('Starting with 0 leaves. Finding the two leaves with most total branch length between them.')
-        leaves = tree.get_leaves()
+        leaves = [leaf for leaf in tree.get_leaves() if leaf.name not in exclude]
         max_distance = 0
         most_distant_leaves = None, None
         for leaf_one in leaves:
@@ -59,7 +84,7 @@ def find_starting_leaves(tree, starting_leaf_list):
     elif len(starting_leaf_list) == 1:
         logging.debug('Starting with 1 leaf. Finding the leaf that has the most branch length between it and the '
                       'specified starting leaf.')
-        leaves = tree.get_leaves()
+        leaves = [leaf for leaf in tree.get_leaves() if leaf.name not in exclude]
         starting_leaf = starting_leaf_list[0]
         max_distance = 0
         most_distant_leaf = None
@@ -98,18 +123,1576 @@ def get_leaf_nodes_from_names(tree, leaf_names):
     :param leaf_names: List of leaf names that
     :return:
     """
+    leaves_by_name = dict()
+    for leaf in tree.iter_leaves():
+        leaves_by_name.setdefault(leaf.name, leaf)
     leaf_nodes = list()
     for leaf_name in leaf_names:
         try:
-            leaf_nodes.append(tree.get_leaves_by_name(leaf_name)[0])
-        except IndexError:
+            leaf_nodes.append(leaves_by_name[leaf_name])
+        except KeyError:
             raise RuntimeError('One of the leaves you specified could not be found in the treefile provided. '
                                'Leaf name was {}. Please check that your treefile contains that '
                                'leaf.'.format(leaf_name))
     return leaf_nodes
 
 
-def find_next_leaf(diverse_leaves, tree):
+def copy_tree(tree):
+    """
+
+    Copies an ete3 tree one node at a time instead of recursively like copy.deepcopy and tree.copy() do, so trees
+    with thousands of nested nodes (ladder-like outbreak trees, for example) don't hit python's recursion limit.
+
+    :param tree: An ete3.Tree object.
+    :return: A new ete3.Tree with the same topology, names, branch lengths, support values and other features.
+    """
+    new_tree = tree.__class__()
+    to_copy = [(tree, new_tree)]
+    while to_copy:
+        node, new_node = to_copy.pop()
+        for feature in node.features:
+            new_node.add_feature(feature, getattr(node, feature))
+        for child in node.children:
+            new_child = new_node.add_child()
+            to_copy.append((child, new_child))
+    return new_tree
+
+
+def ladderize_tree(tree):
+    """
+
+    Same as ete3's ladderize (sorting every node's children by how many leaves they have, smallest first), but without
+    recursion so deep trees can be ladderized. Works in place.
+
+    :param tree: An ete3.Tree object.
+    """
+    size = dict()
+    for node in tree.traverse('postorder'):
+        if node.is_leaf():
+            size[node] = 1
+        else:
+            node.children.sort(key=lambda child: size[child])
+            size[node] = sum(size[child] for child in node.children)
+
+
+def tree_levels(tree):
+    """
+
+    :param tree: An ete3.Tree object.
+    :return: Most branches between the root and any leaf, worked out without recursion so deep trees are fine.
+    """
+    levels = {tree: 0}
+    for node in tree.traverse('preorder'):
+        for child in node.children:
+            levels[child] = levels[node] + 1
+    return max(levels.values())
+
+
+# Past this many levels, the reference engine gets too slow to be worth it (see run_strainchoosr).
+DEEP_TREE_LEVELS = 500
+
+
+def _newick_name(name):
+    # Names with characters that mean something in newick have to be quoted, with any quotes inside doubled up. Trees
+    # read with quoted_node_names keep their quotes, so those are left alone.
+    if len(name) > 1 and name[0] == name[-1] == "'":
+        return name
+    if re.search(r'[\s(),:;\[\]\']', name):
+        return "'{}'".format(name.replace("'", "''"))
+    return name
+
+
+class CompactTree:
+    """
+
+    Array based snapshot of an ete3.Tree. Nodes are numbered in preorder, so every subtree occupies the contiguous
+    block of indices [node, end[node]) and leaves show up in the same order as tree.get_leaves(). Building one of these
+    walks the tree once - after that, distances can be worked out with numpy instead of ete3 traversals.
+
+    :param tree: An ete3.Tree object. It does not get modified.
+    """
+    def __init__(self, tree):
+        nodes = list(tree.traverse('preorder'))
+        node_index = {id(node): i for i, node in enumerate(nodes)}
+        parent = np.full(len(nodes), -1, dtype=np.int64)
+        dist = np.zeros(len(nodes))
+        for i in range(1, len(nodes)):
+            parent[i] = node_index[id(nodes[i].up)]
+            dist[i] = nodes[i].dist
+        self._build(parent, dist, [node.name for node in nodes])
+        self.nodes = nodes
+        self.node_index = node_index
+
+    @classmethod
+    def from_arrays(cls, parent, dist, names, depth=None, end=None, name_rank=None):
+        """
+
+        Builds a CompactTree without an ete3.Tree behind it, for trees that only exist as arrays (shared between
+        processes, read from disk, or built from a distance matrix). The nodes attribute is None for these.
+
+        :param parent: numpy array with the parent of each node, in preorder. The root's parent is -1.
+        :param dist: numpy array with the branch length above each node.
+        :param names: List of node names, in preorder.
+        :param depth: Optional numpy array of distances from the root, if already worked out.
+        :param end: Optional numpy array of where each node's preorder block ends, if already worked out.
+        :param name_rank: Optional numpy array with the sorted-name rank of each leaf, if already worked out.
+        :return: A CompactTree
+        """
+        compact = cls.__new__(cls)
+        compact._build(np.asarray(parent, dtype=np.int64), np.asarray(dist, dtype=np.float64), list(names),
+                       depth=depth, end=end, name_rank=name_rank)
+        compact.nodes = None
+        compact.node_index = dict()
+        return compact
+
+    def _build(self, parent, dist, names, depth=None, end=None, name_rank=None):
+        number_nodes = len(parent)
+        self.parent = parent
+        self.dist = dist.copy()
+        self.dist[0] = 0.0
+        self.names = names
+        parent_list = parent.tolist()
+        level = [0] * number_nodes
+        for i in range(1, number_nodes):
+            level[i] = level[parent_list[i]] + 1
+        self.level = np.array(level, dtype=np.int64)
+        self._sparse_table = None
+        if depth is None:
+            depth = [0.0] * number_nodes
+            dist_list = self.dist.tolist()
+            for i in range(1, number_nodes):
+                depth[i] = depth[parent_list[i]] + dist_list[i]
+        self.depth = np.asarray(depth, dtype=np.float64)
+        if end is None:
+            subtree_size = np.ones(number_nodes, dtype=np.int64)
+            for i in range(number_nodes - 1, 0, -1):
+                subtree_size[parent_list[i]] += subtree_size[i]
+            end = np.arange(number_nodes) + subtree_size
+        self.end = np.asarray(end, dtype=np.int64)
+        self.is_leaf = self.end == np.arange(number_nodes) + 1
+        self.leaves = np.flatnonzero(self.is_leaf)
+        self.leaf_names = [names[i] for i in self.leaves]
+        self.name_index = dict()
+        for leaf, name in zip(self.leaves, self.leaf_names):
+            self.name_index.setdefault(name, int(leaf))
+        if name_rank is None:
+            # Rank of each leaf's name in sorted order, used to break ties the same way find_next_leaf does.
+            name_rank = np.zeros(number_nodes, dtype=np.int64)
+            for rank, position in enumerate(sorted(range(len(self.leaves)), key=lambda x: self.leaf_names[x])):
+                name_rank[self.leaves[position]] = rank
+        self.name_rank = np.asarray(name_rank, dtype=np.int64)
+
+    def index(self, node):
+        """
+
+        :param node: An ete3.TreeNode that is part of the tree this CompactTree was built from. Leaves from a copy of
+        the tree (see copy_tree) are matched up by name, taking the first leaf if names repeat.
+        :return: Preorder index of the node.
+        """
+        try:
+            return self.node_index[id(node)]
+        except KeyError:
+            return self.name_index[node.name]
+
+    def leaf_mask(self, names):
+        """
+
+        :param names: Collection of leaf names.
+        :return: Boolean numpy array flagging every leaf with one of those names. Names that aren't in the tree are
+        ignored.
+        """
+        mask = np.zeros(len(self.parent), dtype=bool)
+        names = set(names)
+        mask[self.leaves] = [name in names for name in self.leaf_names]
+        return mask
+
+    def path_to_root(self, node_index):
+        """
+
+        :param node_index: Index of a node.
+        :return: numpy array of the indices of the node and all of its ancestors, root first.
+        """
+        path = [node_index]
+        while self.parent[path[-1]] != -1:
+            path.append(self.parent[path[-1]])
+        return np.array(path[::-1], dtype=np.int64)
+
+    def distances_from(self, node_index):
+        """
+
+        Finds the distance between one node and every node in the tree. The subtrees of the source's ancestors are
+        nested preorder blocks, so counting how many of them cover a node tells us which ancestor is the common
+        ancestor - no pairwise get_distance calls needed.
+
+        :param node_index: Index of the node to measure from.
+        :return: numpy array with the distance from node_index to each node.
+        """
+        path = self.path_to_root(node_index)
+        coverage = np.zeros(len(self.parent) + 1, dtype=np.int64)
+        coverage[path] += 1
+        np.add.at(coverage, self.end[path], -1)
+        common_ancestor_depth = self.depth[path][np.cumsum(coverage[:-1]) - 1]
+        return self.depth + self.depth[node_index] - 2 * common_ancestor_depth
+
+    def farthest_leaf(self, distances, exclude=None):
+        """
+
+        :param distances: numpy array of a distance for each node.
+        :param exclude: Optional boolean array - nodes flagged True can't be picked.
+        :return: Index of the leaf with the largest distance, ties broken by leaf name. None if no leaf has a
+        distance greater than 0.
+        """
+        leaf_distances = distances[self.leaves].copy()
+        if exclude is not None:
+            leaf_distances[exclude[self.leaves]] = -np.inf
+        if len(leaf_distances) == 0 or leaf_distances.max() <= 0:
+            return None
+        tied = self.leaves[leaf_distances == leaf_distances.max()]
+        return int(tied[np.argmin(self.name_rank[tied])])
+
+    def find_starting_leaves(self, starting_leaves, exclude=None):
+        """
+
+        Same idea as find_starting_leaves, but on node indices. Any leaf's farthest leaf is one of the two ends of
+        a longest path in the tree, so three distance passes replace the all-pairs search. Like find_starting_leaves,
+        the pair returned is the first one (in get_leaves order) that is the longest distance apart.
+
+        :param starting_leaves: List of leaf indices.
+        :param exclude: Optional boolean array - leaves flagged True can't be picked. The longest path trick still
+        works, since it holds for any subset of a tree's leaves.
+        :return: List of leaf indices representing the most diverse starting set possible
+        """
+        starting_leaves = list(starting_leaves)
+        leaves = self.leaves if exclude is None else self.leaves[~exclude[self.leaves]]
+        if len(starting_leaves) == 0:
+            if len(leaves) == 0:
+                return [None, None]
+            end_one = leaves[np.argmax(self.distances_from(int(leaves[0]))[leaves])]
+            distances_one = self.distances_from(int(end_one))
+            end_two = leaves[np.argmax(distances_one[leaves])]
+            distances_two = self.distances_from(int(end_two))
+            eccentricity = np.maximum(distances_one, distances_two)[leaves]
+            if eccentricity.max() <= 0:
+                return [None, None]
+            first_leaf = int(leaves[np.argmax(eccentricity)])
+            second_leaf = int(leaves[np.argmax(self.distances_from(first_leaf)[leaves])])
+            # find_starting_leaves gets (a, b) and (b, a) as separate sums that can round differently - when they do,
+            # it keeps whichever order came out bigger, so do the same.
+            if self._get_distance(second_leaf, first_leaf) > self._get_distance(first_leaf, second_leaf):
+                first_leaf, second_leaf = second_leaf, first_leaf
+            starting_leaves.append(first_leaf)
+            starting_leaves.append(second_leaf)
+        elif len(starting_leaves) == 1:
+            distances = self.distances_from(starting_leaves[0])[leaves]
+            if len(distances) == 0 or distances.max() <= 0:
+                starting_leaves.append(None)
+            else:
+                starting_leaves.append(int(leaves[np.argmax(distances)]))
+        return starting_leaves
+
+    def _get_distance(self, target, target2):
+        # Adds up branch lengths in exactly the same order as ete3's get_distance(target, target2).
+        ancestor = target
+        while not self.is_ancestor(ancestor, target2):
+            ancestor = self.parent[ancestor]
+        distance = 0.0
+        for node in (target2, target):
+            while node != ancestor:
+                distance += float(self.dist[node])
+                node = self.parent[node]
+        return distance
+
+    def is_ancestor(self, ancestor, node):
+        """
+
+        :param ancestor: Index of a node.
+        :param node: Index of a node.
+        :return: True if node is in the subtree of ancestor (a node counts as its own ancestor).
+        """
+        return ancestor <= node < self.end[ancestor]
+
+    def lowest_common_ancestors(self, first, second):
+        """
+
+        Finds the lowest common ancestor of many pairs of nodes at once. For nodes u before v in preorder, the
+        shallowest node in the preorder range (u, v] is a child of their common ancestor, so this is a range-minimum
+        lookup in a sparse table over node levels (built the first time it's needed).
+
+        :param first: numpy array of node indices.
+        :param second: numpy array of node indices, same length as first.
+        :return: numpy array with the common ancestor of each pair.
+        """
+        first = np.asarray(first, dtype=np.int64)
+        second = np.asarray(second, dtype=np.int64)
+        if self._sparse_table is None:
+            table = [np.arange(len(self.parent), dtype=np.int64)]
+            span = 1
+            while 2 * span <= len(self.parent):
+                previous = table[-1]
+                left = previous[:len(previous) - span]
+                right = previous[span:]
+                table.append(np.where(self.level[right] < self.level[left], right, left))
+                span *= 2
+            self._sparse_table = table
+        low = np.minimum(first, second)
+        high = np.maximum(first, second)
+        same = low == high
+        start = np.where(same, low, low + 1)
+        power = np.floor(np.log2(np.maximum(high - start + 1, 1))).astype(np.int64)
+        ancestors = low.copy()
+        for k in np.unique(power[~same]):
+            rows = np.flatnonzero((power == k) & ~same)
+            left = self._sparse_table[k][start[rows]]
+            right = self._sparse_table[k][high[rows] - (1 << k) + 1]
+            shallowest = np.where(self.level[right] < self.level[left], right, left)
+            ancestors[rows] = self.parent[shallowest]
+        return ancestors
+
+    def add_to_spanning_tree(self, marked, leaf, common_ancestor=None):
+        """
+
+        Adds a leaf to the set of leaves described by marked (every node with a picked leaf under it) and
+        common_ancestor (the most recent common ancestor of the picked leaves). Each node only ever gets marked once,
+        so picking leaves one at a time costs O(n) overall.
+
+        :param marked: Boolean numpy array, modified in place.
+        :param leaf: Index of the leaf to add.
+        :param common_ancestor: Index of the common ancestor of leaves already added, or None if there aren't any.
+        :return: Index of the common ancestor once leaf has been added.
+        """
+        node = leaf
+        while node != -1 and not marked[node]:
+            marked[node] = True
+            node = self.parent[node]
+        if common_ancestor is None:
+            return leaf
+        while not self.is_ancestor(common_ancestor, leaf):
+            common_ancestor = self.parent[common_ancestor]
+        return int(common_ancestor)
+
+    def gain(self, marked, leaf, common_ancestor):
+        """
+
+        :param marked: Boolean numpy array of nodes with a picked leaf under them (see add_to_spanning_tree).
+        :param leaf: Index of a leaf.
+        :param common_ancestor: Index of the common ancestor of the picked leaves, or None if none are picked.
+        :return: How much phylogenetic diversity adding leaf would add.
+        """
+        if common_ancestor is None:
+            return 0.0
+        attach = leaf
+        while not marked[attach]:
+            attach = self.parent[attach]
+        return float(self.depth[leaf] - self.depth[attach] + max(0.0, self.depth[common_ancestor] - self.depth[attach]))
+
+    def phylogenetic_diversity(self, leaves):
+        """
+
+        Total branch length of the smallest subtree connecting a set of leaves - the same number find_next_leaf gets
+        by pruning a copy of the tree down to those leaves and adding up what's left.
+
+        :param leaves: List of leaf indices.
+        :return: Phylogenetic diversity of the leaves.
+        """
+        if len(leaves) == 0:
+            return 0.0
+        marked = np.zeros(len(self.parent), dtype=bool)
+        common_ancestor = None
+        for leaf in leaves:
+            common_ancestor = self.add_to_spanning_tree(marked, leaf, common_ancestor)
+        return float(self.dist[marked].sum() - self.depth[common_ancestor])
+
+    def induced_subtree(self, leaves):
+        """
+
+        Writes out the smallest subtree connecting a set of leaves - what pruning a copy of the tree down to those
+        leaves with preserve_branch_length=True gives - without copying anything. Internal nodes with only one marked
+        child get merged into the branch below them, so each branch length is just the difference in depth between a
+        kept node and the closest kept node above it. One preorder pass, so this is linear in the size of the tree.
+
+        :param leaves: List of leaf indices.
+        :return: Newick string of the subtree, with leaf names and branch lengths.
+        """
+        if len(leaves) == 0:
+            return ';'
+        marked = np.zeros(len(self.parent), dtype=bool)
+        common_ancestor = None
+        for leaf in leaves:
+            common_ancestor = self.add_to_spanning_tree(marked, leaf, common_ancestor)
+        nodes = np.flatnonzero(marked[common_ancestor:self.end[common_ancestor]]) + common_ancestor
+        marked_children = np.bincount(self.parent[nodes[1:]], minlength=len(self.parent))
+        is_picked = np.zeros(len(self.parent), dtype=bool)
+        is_picked[list(leaves)] = True
+        kept = nodes[is_picked[nodes] | (marked_children[nodes] >= 2)].tolist()
+        if kept[0] != common_ancestor:
+            kept.insert(0, common_ancestor)
+        depth = self.depth.tolist()
+        end = self.end.tolist()
+        pieces = list()
+        # Kept nodes still on the stack are the ancestors of the current node, so popping one closes its clade.
+        stack = list()
+        for node in kept:
+            while stack and node >= end[stack[-1]]:
+                closed = stack.pop()
+                pieces.append(')')
+                if stack:
+                    pieces.append(':{}'.format(depth[closed] - depth[stack[-1]]))
+            if stack and pieces[-1] != '(':
+                pieces.append(',')
+            if is_picked[node]:
+                pieces.append(_newick_name(self.names[node]))
+                if stack:
+                    pieces.append(':{}'.format(depth[node] - depth[stack[-1]]))
+            else:
+                pieces.append('(')
+                stack.append(node)
+        while stack:
+            closed = stack.pop()
+            pieces.append(')')
+            if stack:
+                pieces.append(':{}'.format(depth[closed] - depth[stack[-1]]))
+        return ''.join(pieces) + ';'
+
+    def marginal_gains(self, marked, common_ancestor):
+        """
+
+        Works out how much phylogenetic diversity each node would add to an already picked set of leaves, all at once.
+        A node's gain is its distance to the closest point on the picked leaves' spanning subtree. Every unmarked node
+        hangs off the marked part of the tree below exactly one unmarked node whose parent is marked, and those
+        hanging subtrees are non-overlapping preorder blocks, so finding where each node attaches is one cumulative
+        sum.
+
+        :param marked: Boolean numpy array of nodes with a picked leaf under them (see add_to_spanning_tree).
+        :param common_ancestor: Index of the common ancestor of the picked leaves.
+        :return: numpy array of gains. Marked nodes get 0.
+        """
+        number_nodes = len(self.parent)
+        hanging = np.flatnonzero(~marked[1:] & marked[self.parent[1:]]) + 1
+        block = np.zeros(number_nodes + 1, dtype=np.int64)
+        block_ids = np.arange(1, len(hanging) + 1)
+        np.add.at(block, hanging, block_ids)
+        np.add.at(block, self.end[hanging], -block_ids)
+        block = np.cumsum(block[:-1])
+        attach_depth = np.concatenate(([0.0], self.depth[self.parent[hanging]]))[block]
+        gains = self.depth - attach_depth + np.maximum(0.0, self.depth[common_ancestor] - attach_depth)
+        gains[marked] = 0.0
+        return gains
+
+    def collapse(self, threshold, keep=(), exclude=None):
+        """
+
+        Collapses every clade whose leaves are all within threshold of the clade's root (clusters of near-identical
+        strains) into a single leaf. The leaf each clade gets collapsed to is its representative: a leaf from keep if
+        the clade has one, otherwise whichever leaf is farthest from the clade's root (ties broken by name), so that
+        the collapsed leaf adds exactly as much phylogenetic diversity as the best strain in the clade would.
+
+        :param threshold: Largest clade height (distance from the clade's root to its farthest leaf) to collapse.
+        :param keep: Leaf indices that should be used as representatives for their clades.
+        :param exclude: Optional boolean array of leaves that shouldn't be used as representatives unless every leaf
+        in the clade is flagged.
+        :return: Tuple of a new CompactTree with clades collapsed, a numpy array with the leaf in this tree each node
+        in the collapsed tree stands for (-1 for internal nodes), and a numpy array with how many leaves each node in
+        the collapsed tree stands for.
+        """
+        number_nodes = len(self.parent)
+        parent = self.parent.tolist()
+        dist = self.dist.tolist()
+        depth = self.depth.tolist()
+        height = [0.0] * number_nodes
+        for node in range(number_nodes - 1, 0, -1):
+            height[parent[node]] = max(height[parent[node]], height[node] + dist[node])
+        keep = set(keep)
+        new_parent, new_dist, new_names, representative, clade_size = list(), list(), list(), list(), list()
+        new_index = dict()
+        node = 0
+        while node < number_nodes:
+            new_index[node] = len(new_parent)
+            new_parent.append(new_index[parent[node]] if node > 0 else -1)
+            if self.is_leaf[node] or height[node] > threshold:
+                new_dist.append(dist[node])
+                new_names.append(self.names[node])
+                representative.append(node if self.is_leaf[node] else -1)
+                clade_size.append(1 if self.is_leaf[node] else 0)
+                node += 1
+                continue
+            clade_leaves = self.leaves[np.searchsorted(self.leaves, node):np.searchsorted(self.leaves, self.end[node])]
+            kept = [leaf for leaf in clade_leaves if leaf in keep]
+            allowed = clade_leaves if exclude is None else clade_leaves[~exclude[clade_leaves]]
+            if len(allowed) == 0:
+                allowed = clade_leaves
+            if kept:
+                chosen = int(kept[0])
+            else:
+                farthest = allowed[self.depth[allowed] == self.depth[allowed].max()]
+                chosen = int(farthest[np.argmin(self.name_rank[farthest])])
+            new_dist.append(dist[node] + depth[chosen] - depth[node])
+            new_names.append(self.names[chosen])
+            representative.append(chosen)
+            clade_size.append(len(clade_leaves))
+            node = int(self.end[node])
+        collapsed = CompactTree.from_arrays(new_parent, new_dist, new_names)
+        return collapsed, np.array(representative, dtype=np.int64), np.array(clade_size, dtype=np.int64)
+
+    def scale_subtrees(self, nodes, factors):
+        """
+
+        Multiplies every branch in each node's subtree (including the branch above the node itself, so a leaf's
+        subtree is just its own branch) by that node's factor. Subtrees are preorder blocks [node, end[node]) and any
+        two blocks are either nested or apart, so each node's combined factor is that of the innermost block holding
+        it, worked out for all nodes in one pass instead of touching each subtree separately.
+
+        :param nodes: Indices of the nodes whose subtrees get scaled. A node can show up more than once.
+        :param factors: Factor for each node. Factors of nested subtrees multiply.
+        :return: numpy array of branch lengths, in preorder.
+        """
+        number_nodes = len(self.parent)
+        weight = np.ones(number_nodes)
+        np.multiply.at(weight, np.asarray(nodes, dtype=np.int64), np.asarray(factors, dtype=np.float64))
+        starts = np.flatnonzero(weight != 1.0)
+        if len(starts) == 0:
+            return self.dist.copy()
+        ends = self.end[starts]
+        # Starts are distinct preorder indices, so walking them in order visits each block after any block holding
+        # it. Only the weighted blocks get walked here - there are usually far fewer of those than nodes.
+        enclosing = np.full(len(starts), -1, dtype=np.int64)
+        combined = weight[starts]
+        stack = list()
+        for k, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+            while stack and ends[stack[-1]] <= start:
+                stack.pop()
+            if stack:
+                enclosing[k] = stack[-1]
+                combined[k] = combined[stack[-1]] * combined[k]
+            stack.append(k)
+        # Which block applies changes only where one starts (it becomes the innermost) or ends (the one holding the
+        # outermost block that ends there takes over). Fill forward from those positions to label every node.
+        label = np.full(number_nodes + 1, -1, dtype=np.int64)
+        changed = np.zeros(number_nodes + 1, dtype=bool)
+        changed[0] = True
+        outermost_start = np.full(number_nodes + 1, number_nodes, dtype=np.int64)
+        np.minimum.at(outermost_start, ends, starts)
+        ending = np.flatnonzero(outermost_start < number_nodes)
+        block_of_start = np.full(number_nodes, -1, dtype=np.int64)
+        block_of_start[starts] = np.arange(len(starts))
+        label[ending] = enclosing[block_of_start[outermost_start[ending]]]
+        changed[ending] = True
+        label[starts] = np.arange(len(starts))
+        changed[starts] = True
+        last_change = np.maximum.accumulate(np.where(changed, np.arange(number_nodes + 1), 0))
+        label = label[last_change[:number_nodes]]
+        factor = np.append(combined, 1.0)[label]
+        dist = self.dist * factor
+        dist[0] = self.dist[0]
+        return dist
+
+    def best_leaf(self, scores, exclude):
+        """
+
+        :param scores: numpy array of a score for each node.
+        :param exclude: Boolean numpy array - nodes flagged True can't be picked.
+        :return: Index of the leaf with the highest score, ties broken by leaf name the same way find_next_leaf does.
+        None if every leaf is excluded.
+        """
+        candidates = self.leaves[~exclude[self.leaves]]
+        if len(candidates) == 0:
+            return None
+        candidate_scores = scores[candidates]
+        tied = candidates[candidate_scores == candidate_scores.max()]
+        return int(tied[np.argmin(self.name_rank[tied])])
+
+
+def phylogenetic_diversity(tree, sets):
+    """
+
+    Scores any number of strain sets against a tree in one go - for each set, the total branch length of the smallest
+    subtree connecting its strains (what find_next_leaf gets by pruning a copy of the tree). Walking a set's strains
+    in preorder and coming back to the first one covers every branch of that subtree exactly twice, so each set's
+    diversity is half the sum of distances between consecutive strains, and every distance for every set gets worked
+    out in one vectorized batch of common ancestor lookups.
+
+    :param tree: An ete3.Tree object, or a CompactTree.
+    :param sets: List of sets, where each set is a list of leaf names. If a name shows up more than once in the tree,
+    the first leaf with that name is used.
+    :return: numpy array with the phylogenetic diversity of each set.
+    """
+    compact = tree if isinstance(tree, CompactTree) else CompactTree(tree)
+    set_ids = list()
+    members = list()
+    for set_id, strain_set in enumerate(sets):
+        for name in strain_set:
+            try:
+                members.append(compact.name_index[name])
+            except KeyError:
+                raise RuntimeError('One of the leaves you specified could not be found in the treefile provided. '
+                                   'Leaf name was {}. Please check that your treefile contains that '
+                                   'leaf.'.format(name))
+            set_ids.append(set_id)
+    totals = np.zeros(len(sets))
+    if len(members) == 0:
+        return totals
+    # Sorting by (set, preorder position) and dropping repeats lines each set's strains up in preorder.
+    pairs = np.unique(np.stack([np.array(set_ids, dtype=np.int64), np.array(members, dtype=np.int64)], axis=1),
+                      axis=0)
+    set_ids, members = pairs[:, 0], pairs[:, 1]
+    new_set = set_ids[1:] != set_ids[:-1]
+    set_starts = np.flatnonzero(np.insert(new_set, 0, True))
+    first_of_set = np.repeat(set_starts, np.diff(np.append(set_starts, len(members))))
+    following = np.where(np.append(new_set, True), members[first_of_set], np.roll(members, -1))
+    ancestors = compact.lowest_common_ancestors(members, following)
+    distances = compact.depth[members] + compact.depth[following] - 2 * compact.depth[ancestors]
+    np.add.at(totals, set_ids, distances)
+    return totals / 2
+
+
+def iter_compact_pd_greedy(compact, starting_leaves, exclude=None):
+    """
+
+    Generator version of compact_pd_greedy - yields each pick as soon as it's made, along with how much phylogenetic
+    diversity it added and the running total, and keeps going until every leaf has been picked (or the caller
+    stops asking). Starting leaves come out first.
+
+    :param compact: A CompactTree.
+    :param starting_leaves: List of leaf indices that make up your starting strains. If empty, will be chosen
+    automatically
+    :param exclude: Optional boolean array - leaves flagged True never get picked (see CompactTree.leaf_mask).
+    :return: Generator of (leaf index, marginal gain, total phylogenetic diversity) tuples.
+    """
+    chosen = [leaf for leaf in compact.find_starting_leaves(starting_leaves, exclude=exclude) if leaf is not None]
+    marked = np.zeros(len(compact.parent), dtype=bool)
+    common_ancestor = None
+    total = 0.0
+    for leaf in chosen:
+        gain = compact.gain(marked, leaf, common_ancestor)
+        common_ancestor = compact.add_to_spanning_tree(marked, leaf, common_ancestor)
+        total += gain
+        yield leaf, gain, total
+    number_picked = len(chosen)
+    # No starting leaves means every leaf that can be picked is at the same spot, so there's nothing to add.
+    while number_picked < len(compact.leaves) and common_ancestor is not None:
+        logging.debug('Working on strain {num}'.format(num=number_picked + 1))
+        gains = compact.marginal_gains(marked, common_ancestor)
+        next_leaf = compact.best_leaf(gains, exclude=marked if exclude is None else marked | exclude)
+        if next_leaf is None:
+            break
+        common_ancestor = compact.add_to_spanning_tree(marked, next_leaf, common_ancestor)
+        number_picked += 1
+        total += float(gains[next_leaf])
+        yield next_leaf, float(gains[next_leaf]), total
+
+
+def compact_pd_greedy(compact, number_tips, starting_leaves, checkpoint=None, exclude=None, cancel=None):
+    """
+
+    The same greedy algorithm as pd_greedy, worked out on a CompactTree. Instead of pruning a copy of the tree for
+    every candidate leaf, the gain for every leaf is worked out in one vectorized pass per pick.
+
+    :param compact: A CompactTree.
+    :param number_tips: Number of strains you want to pick out.
+    :param starting_leaves: List of leaf indices that make up your starting strains. If empty, will be chosen
+    automatically
+    :param checkpoint: If specified, a SelectionCheckpoint to save picks to as they're made.
+    :param exclude: Optional boolean array - leaves flagged True never get picked.
+    :param cancel: If specified, something with an is_set method (like a threading.Event). Gets checked between
+    picks, and a SelectionCancelled error is raised once it's set.
+    :return: List of leaf indices, in the order they were picked. Can be shorter than number_tips if too many leaves
+    are excluded.
+    """
+    starting_leaves = compact.find_starting_leaves(starting_leaves, exclude=exclude)
+    # Like pd_greedy, starting strains all get kept even if there are more of them than number_tips.
+    number_tips = max(number_tips, len([leaf for leaf in starting_leaves if leaf is not None]))
+    chosen = list()
+    for leaf, _, _ in iter_compact_pd_greedy(compact, starting_leaves, exclude=exclude):
+        if len(chosen) >= number_tips:
+            break
+        if cancel is not None and cancel.is_set():
+            raise SelectionCancelled('Picking was cancelled after {} strains.'.format(len(chosen)))
+        chosen.append(leaf)
+        if checkpoint is not None:
+            checkpoint.update(np.searchsorted(compact.leaves, chosen).tolist())
+    if checkpoint is not None:
+        checkpoint.save(np.searchsorted(compact.leaves, chosen).tolist())
+    return chosen
+
+
+def collapsed_pd_greedy(compact, number_tips, starting_leaves, threshold, exclude=None, cancel=None):
+    """
+
+    Runs compact_pd_greedy on a copy of the tree where clusters of near-identical strains have been collapsed into
+    single leaves (see CompactTree.collapse), which can shrink big surveillance trees a lot. Picks get expanded back
+    to the representative strain of each cluster. If more strains are wanted than there are collapsed leaves,
+    picking carries on in the full tree. How many strains each pick stands for gets logged.
+
+    This is an approximation, and it can pick differently from compact_pd_greedy on the full tree. Once a cluster has
+    been picked, none of its other strains can be until every cluster has been, even where a second strain from a big
+    cluster would add more than a strain from another, tighter one. Ties are also broken by the names of the clusters'
+    representatives rather than of every strain.
+
+    :param compact: A CompactTree.
+    :param number_tips: Number of strains you want to pick out.
+    :param starting_leaves: List of leaf indices that make up your starting strains. If empty, will be chosen
+    automatically
+    :param threshold: Clades whose leaves are all within this distance of the clade's root get collapsed.
+    :param exclude: Optional boolean array - leaves flagged True never get picked. A cluster only gets excluded if
+    every strain in it is.
+    :param cancel: If specified, a cancel event - see compact_pd_greedy.
+    :return: List of leaf indices, in the order they were picked.
+    """
+    # Starting leaves get found in the full tree, since ties there are broken by tree order rather than by name.
+    starting_leaves = [leaf for leaf in compact.find_starting_leaves(starting_leaves, exclude=exclude)
+                       if leaf is not None]
+    collapsed, representative, clade_size = compact.collapse(threshold, keep=starting_leaves, exclude=exclude)
+    collapsed_exclude = None
+    if exclude is not None:
+        collapsed_exclude = np.zeros(len(representative), dtype=bool)
+        collapsed_exclude[representative >= 0] = exclude[representative[representative >= 0]]
+    logging.info('Collapsed {} strains into {} for selection.'.format(len(compact.leaves), len(collapsed.leaves)))
+    collapsed_index = {int(leaf): number for number, leaf in enumerate(representative) if leaf >= 0}
+    # Starting strains that got collapsed into some other starting strain's clade are kept, but aren't needed in
+    # the collapsed tree.
+    collapsed_starting = list()
+    for leaf in starting_leaves:
+        if leaf in collapsed_index and collapsed_index[leaf] not in collapsed_starting:
+            collapsed_starting.append(collapsed_index[leaf])
+    picks = list(starting_leaves)
+    collapsed_picks = compact_pd_greedy(collapsed, number_tips, collapsed_starting, exclude=collapsed_exclude,
+                                        cancel=cancel)
+    for leaf in collapsed_picks:
+        logging.debug('Picked {}, which stands for {} strains.'.format(collapsed.names[leaf], clade_size[leaf]))
+        if int(representative[leaf]) not in picks:
+            picks.append(int(representative[leaf]))
+    logging.info('The {} strains picked from the collapsed tree stand for {} of {} strains.'
+                 .format(len(collapsed_picks), clade_size[collapsed_picks].sum(), len(compact.leaves)))
+    if len(picks) < number_tips:
+        for leaf, _, _ in iter_compact_pd_greedy(compact, picks, exclude=exclude):
+            if len(picks) >= number_tips:
+                break
+            if cancel is not None and cancel.is_set():
+                raise SelectionCancelled('Picking was cancelled after {} strains.'.format(len(picks)))
+            if leaf not in picks:
+                picks.append(leaf)
+    return picks[:max(number_tips, len(starting_leaves))]
+
+
+class CladeQuotas:
+    """
+
+    Limits on how many strains can be picked from each clade (lineage, serotype, and so on). Clades are either
+    groups of strains from a metadata file, or named internal nodes of the tree, in which case the clade is every
+    strain under that node.
+
+    :param quotas: Dictionary with clade names as keys and (minimum, maximum) tuples as values. Either can be None
+    for no limit.
+    :param groups: Optional dictionary with strain names as keys and the clade each strain is in as values (see
+    read_clade_metadata). Clades in quotas that aren't in here get looked up as named internal nodes.
+    :param minimum: Minimum for every clade in groups that isn't in quotas.
+    :param maximum: Maximum for every clade in groups that isn't in quotas.
+    """
+    def __init__(self, quotas=None, groups=None, minimum=None, maximum=None):
+        self.groups = dict() if groups is None else dict(groups)
+        self.quotas = dict()
+        if minimum is not None or maximum is not None:
+            for clade in sorted(set(self.groups.values())):
+                self.quotas[clade] = (minimum, maximum)
+        if quotas is not None:
+            self.quotas.update(quotas)
+        for clade, (low, high) in self.quotas.items():
+            if low is not None and high is not None and low > high:
+                raise ValueError('Clade {} has a minimum of {}, which is more than its maximum of {}.'
+                                 .format(clade, low, high))
+
+    def index(self, compact):
+        """
+
+        Works out where each clade is in a tree, so that checking a strain against every quota takes constant time
+        per clade. Clades from metadata get a clade number for each leaf, and clades from named internal nodes are
+        the preorder interval [node, end[node]) of leaves under the node.
+
+        :param compact: A CompactTree.
+        :return: Dictionary with the clade names, minimum and maximum arrays (over clades), group (clade number of
+        each node from metadata, -1 for none), and the starts and ends of every interval clade along with their
+        clade numbers.
+        """
+        group_clades = sorted(clade for clade in self.quotas if clade in set(self.groups.values()))
+        group_number = {clade: number for number, clade in enumerate(group_clades)}
+        internal_index = dict()
+        for node in np.flatnonzero(~compact.is_leaf):
+            if compact.names[node]:
+                internal_index.setdefault(compact.names[node], int(node))
+        interval_clades = sorted(clade for clade in self.quotas if clade not in group_number)
+        missing = [clade for clade in interval_clades if clade not in internal_index]
+        if missing:
+            raise RuntimeError('Could not find clades {} in your metadata or as named internal nodes in the tree.'
+                               .format(', '.join(missing)))
+        names = group_clades + interval_clades
+        group = np.full(len(compact.parent), -1, dtype=np.int64)
+        group[compact.leaves] = [group_number.get(self.groups.get(name), -1) for name in compact.leaf_names]
+        starts = np.array([internal_index[clade] for clade in interval_clades], dtype=np.int64)
+        limits = [self.quotas[clade] for clade in names]
+        return {'names': names,
+                'minimum': np.array([0 if low is None else low for low, _ in limits], dtype=np.int64),
+                'maximum': np.array([len(compact.leaves) if high is None else high for _, high in limits],
+                                    dtype=np.int64),
+                'group': group,
+                'starts': starts,
+                'ends': compact.end[starts],
+                'interval_numbers': np.arange(len(group_clades), len(names), dtype=np.int64)}
+
+
+def quota_pd_greedy(compact, number_tips, starting_leaves, quotas, exclude=None, cancel=None):
+    """
+
+    The greedy algorithm with limits on how many strains can come from each clade, worked out in one pass. Once a
+    clade has its maximum, every strain in it gets ruled out. Once there are only as many picks left as strains
+    still needed to get every clade to its minimum, picks only come from clades that are short, going for strains
+    that count towards as many short clades as possible (the innermost one, for nested clades). Otherwise picks are
+    the same as compact_pd_greedy, so when no quota ever comes into play the same strains get picked. Ties are broken
+    the same way too, so picks are always the same for the same input.
+
+    :param compact: A CompactTree.
+    :param number_tips: Number of strains you want to pick out.
+    :param starting_leaves: List of leaf indices that make up your starting strains. If empty, will be chosen
+    automatically.
+    :param quotas: A CladeQuotas object.
+    :param exclude: Optional boolean array - leaves flagged True never get picked.
+    :param cancel: If specified, a cancel event - see compact_pd_greedy.
+    :return: List of leaf indices, in the order they were picked.
+    """
+    clades = quotas.index(compact)
+    number_nodes = len(compact.parent)
+    counts = np.zeros(len(clades['names']), dtype=np.int64)
+    blocked = np.zeros(number_nodes, dtype=bool) if exclude is None else exclude.copy()
+    marked = np.zeros(number_nodes, dtype=bool)
+    number_groups = len(clades['names']) - len(clades['starts'])
+
+    def clades_of(leaf):
+        # A leaf's metadata clade is a lookup, and each interval clade is two comparisons.
+        inside = clades['interval_numbers'][(clades['starts'] <= leaf) & (leaf < clades['ends'])]
+        if clades['group'][leaf] >= 0:
+            inside = np.append(inside, clades['group'][leaf])
+        return inside
+
+    def block(clade):
+        if clade < number_groups:
+            blocked[clades['group'] == clade] = True
+        else:
+            position = clade - number_groups
+            blocked[clades['starts'][position]:clades['ends'][position]] = True
+
+    for clade in np.flatnonzero(clades['maximum'] == 0):
+        block(clade)
+    chosen = list()
+    common_ancestor = None
+    for leaf in starting_leaves:
+        common_ancestor = compact.add_to_spanning_tree(marked, leaf, common_ancestor)
+        chosen.append(leaf)
+        counts[clades_of(leaf)] += 1
+    over = np.flatnonzero(counts > clades['maximum'])
+    if len(over) > 0:
+        raise ValueError('Your starting strains have more strains from clades {} than their maximum allows.'
+                         .format(', '.join(clades['names'][clade] for clade in over)))
+    for clade in np.flatnonzero(counts == clades['maximum']):
+        block(clade)
+    pending = None
+    if not chosen:
+        pending = [leaf for leaf in compact.find_starting_leaves([], exclude=blocked) if leaf is not None]
+    # Like pd_greedy, starting strains all get kept even if there are more of them than number_tips.
+    number_tips = max(number_tips, len(chosen), len(pending) if pending else 0)
+    while len(chosen) < number_tips:
+        if cancel is not None and cancel.is_set():
+            raise SelectionCancelled('Picking was cancelled after {} strains.'.format(len(chosen)))
+        unavailable = blocked | marked
+        deficit = np.maximum(clades['minimum'] - counts, 0)
+        short = deficit.sum() >= number_tips - len(chosen) and deficit.sum() > 0
+        if short:
+            # How many short clades each node counts towards.
+            cover = np.isin(clades['group'], np.flatnonzero(deficit[:number_groups] > 0)).astype(np.int64)
+            short_intervals = deficit[clades['interval_numbers']] > 0
+            if short_intervals.any():
+                change = np.zeros(number_nodes + 1, dtype=np.int64)
+                np.add.at(change, clades['starts'][short_intervals], 1)
+                np.add.at(change, clades['ends'][short_intervals], -1)
+                cover += np.cumsum(change[:-1])
+            available = compact.leaves[~unavailable[compact.leaves]]
+            most = cover[available].max() if len(available) > 0 else 0
+            unavailable |= cover < max(most, 1)
+        if pending and not short and not unavailable[pending[0]]:
+            # The same starting pair compact_pd_greedy would have picked, as long as quotas don't get in the way.
+            next_leaf = pending.pop(0)
+        else:
+            pending = None
+            if common_ancestor is None:
+                # Nothing to measure gains from yet, so go by distance from the root.
+                next_leaf = compact.best_leaf(compact.depth, exclude=unavailable)
+            else:
+                next_leaf = compact.best_leaf(compact.marginal_gains(marked, common_ancestor), exclude=unavailable)
+        if next_leaf is None:
+            logging.warning('Ran out of strains that fit the clade quotas after picking {}.'.format(len(chosen)))
+            break
+        common_ancestor = compact.add_to_spanning_tree(marked, next_leaf, common_ancestor)
+        chosen.append(next_leaf)
+        inside = clades_of(next_leaf)
+        counts[inside] += 1
+        for clade in inside[counts[inside] == clades['maximum'][inside]]:
+            block(clade)
+    short = np.flatnonzero(counts < clades['minimum'])
+    if len(short) > 0:
+        raise ValueError('Could not pick enough strains to meet the minimum for clades {}.'
+                         .format(', '.join(clades['names'][clade] for clade in short)))
+    return chosen
+
+
+def iter_pd_greedy(tree, starting_strains, exclude=(), engine='fast'):
+    """
+
+    Streams the picks pd_greedy would make, one at a time, without needing to know how many strains you want ahead of
+    time. Each pick comes with the phylogenetic diversity it added and the total so far, so you can stop whenever
+    you've got enough diversity.
+
+    :param tree: An ete3.Tree object
+    :param starting_strains: List of ete3.TreeNode objects that make up your starting strains. If empty, will be chosen
+    automatically
+    :param exclude: Names of strains that can't be picked.
+    :param engine: fast (the default) to pick with iter_compact_pd_greedy, or reference to pick with find_next_leaf,
+    same as pd_greedy. Use the same engine as pd_greedy to get the same picks where gains tie to within rounding
+    error.
+    :return: Generator of (ete3.TreeNode, marginal gain, total phylogenetic diversity) tuples.
+    """
+    if engine not in ('reference', 'fast'):
+        raise ValueError('Unknown engine {}, choose from reference or fast.'.format(engine))
+    compact = CompactTree(tree)
+    if engine == 'fast':
+        for leaf, gain, total in iter_compact_pd_greedy(compact, [compact.index(node) for node in starting_strains],
+                                                        exclude=compact.leaf_mask(exclude) if exclude else None):
+            yield compact.nodes[leaf], gain, total
+        return
+    # Picks come from find_next_leaf, and the CompactTree just keeps count of how much each one added.
+    exclude = set(exclude)
+    diverse_strains = find_starting_leaves(tree, list(starting_strains), exclude=exclude)
+    marked = np.zeros(len(compact.parent), dtype=bool)
+    common_ancestor = None
+    total = 0.0
+    number_leaves = len(compact.leaves)
+    for position in range(number_leaves):
+        if position == len(diverse_strains):
+            if common_ancestor is None:
+                break
+            logging.debug('Working on strain {num}'.format(num=position + 1))
+            next_leaf = find_next_leaf(diverse_strains, tree, exclude=exclude)
+            if next_leaf is None:
+                break
+            diverse_strains.append(next_leaf)
+        node = diverse_strains[position]
+        leaf = compact.index(node)
+        gain = compact.gain(marked, leaf, common_ancestor)
+        common_ancestor = compact.add_to_spanning_tree(marked, leaf, common_ancestor)
+        total += gain
+        yield node, gain, total
+
+
+def pd_greedy_until(tree, starting_strains, pd_fraction=None, min_gain=None, max_tips=None, exclude=(),
+                    engine='fast'):
+    """
+
+    Runs the greedy algorithm until a target is reached instead of for a set number of strains.
+
+    :param tree: An ete3.Tree object
+    :param starting_strains: List of ete3.TreeNode objects that make up your starting strains. If empty, will be chosen
+    automatically
+    :param pd_fraction: If specified, stop as soon as picked strains cover at least this fraction of the tree's total
+    branch length.
+    :param min_gain: If specified, stop as soon as the next strain would add less than this much phylogenetic
+    diversity. Starting strains are always kept.
+    :param max_tips: If specified, never pick more than this many strains.
+    :param exclude: Names of strains that can't be picked.
+    :param engine: fast (the default) or reference - see iter_pd_greedy.
+    :return: List of ete3.TreeNode objects, in the order they were picked.
+    """
+    total_branch_length = np.sum([node.dist for node in tree.traverse('preorder')][1:])
+    # Starting strains are always kept, even if they add less than min_gain - two get picked if none were given.
+    number_starting = max(len(starting_strains), 2)
+    chosen = list()
+    for node, gain, total in iter_pd_greedy(tree, starting_strains, exclude=exclude, engine=engine):
+        if max_tips is not None and len(chosen) >= max_tips:
+            break
+        if min_gain is not None and len(chosen) >= number_starting and gain < min_gain:
+            logging.info('Next strain would only add {}, stopping at {} strains.'.format(gain, len(chosen)))
+            break
+        chosen.append(node)
+        if pd_fraction is not None and total >= pd_fraction * total_branch_length:
+            logging.info('Picked strains cover {} of total branch length, stopping at {} strains.'
+                         .format(total / total_branch_length, len(chosen)))
+            break
+    return chosen
+
+
+def _max_plus(first, second, length):
+    # Best first[c - b] + second[b] for every total cost c below length, along with the b (cost given to second)
+    # each best came from. Only finite entries can be part of a best, so the loop runs over whichever side has fewer.
+    best = np.full(length, -np.inf)
+    split = np.full(length, -1, dtype=np.int32)
+    first_costs = np.flatnonzero(np.isfinite(first))
+    second_costs = np.flatnonzero(np.isfinite(second))
+    if len(second_costs) <= len(first_costs):
+        for b in second_costs:
+            if b >= length:
+                break
+            candidate = first[:length - b] + second[b]
+            target = best[b:b + len(candidate)]
+            better = candidate > target
+            target[better] = candidate[better]
+            split[b:b + len(candidate)][better] = b
+    else:
+        for a in first_costs:
+            if a >= length:
+                break
+            candidate = first[a] + second[:length - a]
+            target = best[a:a + len(candidate)]
+            better = candidate > target
+            target[better] = candidate[better]
+            split[a:a + len(candidate)][better] = np.flatnonzero(better)
+    return best, split
+
+
+def _prune_dominated(values):
+    # A state that costs more than another without having more diversity can never be part of a best selection.
+    earlier_best = np.concatenate(([-np.inf], np.maximum.accumulate(values)[:-1]))
+    values[values <= earlier_best] = -np.inf
+    return values
+
+
+def budget_pd_exact(compact, units, budget_units, forced=(), exclude=None):
+    """
+
+    Finds the set of leaves with the most phylogenetic diversity whose costs add up to no more than a budget, with a
+    dynamic program over the tree (Pardi & Goldman 2007). Costs are whole numbers of units - see budget_pd for how
+    real costs get turned into those. Going up the tree, every node keeps a table of the most diversity its subtree
+    can add for each total cost, split by whether 0, 1, or 2 or more of its children have a picked leaf under them
+    (the last being sets whose common ancestor is the node itself). Tables never get longer than the budget or the
+    total cost of the subtree, states that cost more than a cheaper state with at least as much diversity get dropped,
+    and a child's table gets thrown away as soon as it has been merged into its parent's, so only what's needed to
+    reconstruct the answer gets kept.
+
+    :param compact: A CompactTree.
+    :param units: numpy array with the cost of each leaf in units.
+    :param budget_units: Budget, in units.
+    :param forced: Leaf indices that have to be picked.
+    :param exclude: Optional boolean array - leaves flagged True never get picked.
+    :return: Tuple of the list of leaf indices picked (in preorder) and the most bytes the tables took up at once.
+    """
+    number_nodes = len(compact.parent)
+    forced = set(forced)
+    children = [list() for _ in range(number_nodes)]
+    for node in range(1, number_nodes):
+        children[compact.parent[node]].append(node)
+    forced_low = min(forced) if forced else None
+    forced_high = max(forced) if forced else None
+    rooted = dict()
+    rooted_choice = dict()
+    records = dict()
+    live_bytes, record_bytes, peak_bytes = 0, 0, 0
+    best_value, best_node, best_cost = -np.inf, None, None
+    for node in range(number_nodes - 1, -1, -1):
+        if compact.is_leaf[node]:
+            cost = int(units[node])
+            if (exclude is not None and exclude[node]) or cost > budget_units:
+                values = np.full(1, -np.inf)
+            else:
+                values = np.full(cost + 1, -np.inf)
+                values[cost] = 0.0
+                if best_value < 0.0 and (not forced or forced == {node}):
+                    best_value, best_node, best_cost = 0.0, node, cost
+            rooted[node] = (values, node not in forced)
+            live_bytes += values.nbytes
+            peak_bytes = max(peak_bytes, live_bytes + record_bytes)
+            continue
+        tables = [np.zeros(1), np.full(1, -np.inf), np.full(1, -np.inf)]
+        node_records = list()
+        for child in children[node]:
+            values, empty_ok = rooted.pop(child)
+            live_bytes -= values.nbytes
+            hanging = values + compact.dist[child]
+            length = min(budget_units, len(tables[0]) + len(hanging) - 2) + 1
+            new_tables, previous, splits = list(), list(), list()
+            for k in range(3):
+                table = np.full(length, -np.inf)
+                came_from = np.full(length, k, dtype=np.int8)
+                split = np.full(length, -1, dtype=np.int32)
+                if empty_ok:
+                    table[:len(tables[k])] = tables[k][:length]
+                for source in ((k - 1,) if k == 1 else (1, 2) if k == 2 else ()):
+                    candidate, candidate_split = _max_plus(tables[source], hanging, length)
+                    better = candidate > table
+                    table[better] = candidate[better]
+                    came_from[better] = source
+                    split[better] = candidate_split[better]
+                new_tables.append(table)
+                previous.append(came_from)
+                splits.append(split)
+            tables = [_prune_dominated(table) for table in new_tables]
+            node_records.append((child, previous, splits))
+            record_bytes += sum(array.nbytes for array in previous + splits)
+            peak_bytes = max(peak_bytes, live_bytes + record_bytes + sum(table.nbytes for table in tables))
+        records[node] = node_records
+        if not forced or (node <= forced_low and forced_high < compact.end[node]):
+            finite = np.flatnonzero(np.isfinite(tables[2]))
+            if len(finite) > 0:
+                cost = int(finite[np.argmax(tables[2][finite])])
+                if tables[2][cost] > best_value:
+                    best_value, best_node, best_cost = float(tables[2][cost]), node, cost
+        choice = np.where(tables[2] > tables[1], 2, 1).astype(np.int8)
+        values = _prune_dominated(np.maximum(tables[1], tables[2]))
+        rooted[node] = (values, bool(np.isfinite(tables[0][0])))
+        rooted_choice[node] = choice
+        live_bytes += values.nbytes
+        record_bytes += choice.nbytes
+        peak_bytes = max(peak_bytes, live_bytes + record_bytes)
+    if best_node is None:
+        return list(), peak_bytes
+    picked = list()
+    # Walking back down the tree goes through a stack rather than recursion, so deep trees are fine.
+    stack = [(best_node, 2 if not compact.is_leaf[best_node] else None, best_cost)]
+    while stack:
+        node, k, cost = stack.pop()
+        if compact.is_leaf[node]:
+            picked.append(node)
+            continue
+        if k is None:
+            k = int(rooted_choice[node][cost])
+        for child, previous, splits in reversed(records[node]):
+            child_cost = int(splits[k][cost])
+            k = int(previous[k][cost])
+            if child_cost >= 0:
+                stack.append((child, None, child_cost))
+                cost -= child_cost
+    return sorted(picked), peak_bytes
+
+
+def budget_pd_ratio_greedy(compact, costs, budget, forced=(), exclude=None):
+    """
+
+    Quick alternative to budget_pd_exact for trees too big for it: after any forced leaves, keeps picking whichever
+    affordable leaf adds the most phylogenetic diversity per unit of cost, until nothing affordable adds anything. The
+    first leaf (when nothing is forced) is scored by its distance from the root. Takes O(n) per pick, but unlike the
+    exact version there's no guarantee of how close to the best set it gets.
+
+    :param compact: A CompactTree.
+    :param costs: numpy array with the cost of each leaf.
+    :param budget: Most the picked leaves can cost in total.
+    :param forced: Leaf indices that have to be picked, in order.
+    :param exclude: Optional boolean array - leaves flagged True never get picked.
+    :return: Tuple of the list of leaf indices picked (in the order they were picked) and the bytes taken by the
+    arrays it works with.
+    """
+    marked = np.zeros(len(compact.parent), dtype=bool)
+    common_ancestor = None
+    chosen = list()
+    spent = 0.0
+    for leaf in forced:
+        common_ancestor = compact.add_to_spanning_tree(marked, leaf, common_ancestor)
+        chosen.append(leaf)
+        spent += float(costs[leaf])
+    unavailable = marked.copy() if exclude is None else marked | exclude
+    peak_bytes = marked.nbytes + unavailable.nbytes
+    while True:
+        # With nothing picked, gains come out as distances from the root.
+        gains = compact.marginal_gains(marked, 0 if common_ancestor is None else common_ancestor)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = np.where(gains > 0, gains / costs, 0.0)
+        peak_bytes = max(peak_bytes, marked.nbytes + unavailable.nbytes + gains.nbytes + ratios.nbytes)
+        candidates = unavailable | (costs > budget - spent + 1e-9 * max(budget, 1.0)) | (gains <= 0)
+        next_leaf = compact.best_leaf(ratios, exclude=candidates)
+        if next_leaf is None:
+            break
+        common_ancestor = compact.add_to_spanning_tree(marked, next_leaf, common_ancestor)
+        unavailable[next_leaf] = True
+        chosen.append(next_leaf)
+        spent += float(costs[next_leaf])
+    return chosen, peak_bytes
+
+
+class BudgetSelection:
+    """
+
+    Strains picked to get the most phylogenetic diversity for a budget, along with what it took to pick them.
+
+    :param strains: List of ete3.TreeNode objects picked. Starting strains come first.
+    :param cost: Total cost of the strains picked.
+    :param phylogenetic_diversity: Phylogenetic diversity of the strains picked.
+    :param method: exact or greedy.
+    :param seconds: How long picking took.
+    :param peak_bytes: Most memory the method's tables and working arrays took up at once, in bytes.
+    """
+    def __init__(self, strains, cost, phylogenetic_diversity, method, seconds, peak_bytes):
+        self.strains = strains
+        self.cost = cost
+        self.phylogenetic_diversity = phylogenetic_diversity
+        self.method = method
+        self.seconds = seconds
+        self.peak_bytes = peak_bytes
+
+
+def budget_pd(tree, costs, budget, method='exact', resolution=1000, starting_strains=(), exclude=(),
+              default_cost=None):
+    """
+
+    Picks strains to get as much phylogenetic diversity as possible without their costs adding up to more than a
+    budget, instead of picking a set number of strains.
+
+    The exact method (see budget_pd_exact) works in whole units of budget / resolution, with every strain's cost
+    rounded up to a whole number of units, so picks always fit the real budget and are the best possible set for the
+    rounded costs. Any budget left over from rounding then gets spent the same way the greedy method would. Time and
+    memory grow with the number of strains times resolution, so for very big trees the greedy method (see
+    budget_pd_ratio_greedy) is much quicker, at the cost of not always finding the best set.
+
+    :param tree: An ete3.Tree object
+    :param costs: Dictionary with strain names as keys and costs as values (see read_weights_file).
+    :param budget: Most the picked strains can cost in total.
+    :param method: exact or greedy.
+    :param resolution: Number of units the budget gets split into for the exact method.
+    :param starting_strains: List of ete3.TreeNode objects that have to be picked. Their costs count towards the
+    budget.
+    :param exclude: Names of strains that can't be picked.
+    :param default_cost: Cost of strains not in costs. If None, every strain in the tree has to have a cost.
+    :return: BudgetSelection
+    """
+    if method not in ('exact', 'greedy'):
+        raise ValueError('Unknown budget method {}, choose from exact or greedy.'.format(method))
+    if budget < 0:
+        raise ValueError('Budget can\'t be negative, got {}.'.format(budget))
+    if resolution < 1:
+        raise ValueError('Cost resolution has to be at least 1, got {}.'.format(resolution))
+    compact = CompactTree(tree)
+    missing = [name for name in compact.leaf_names if name not in costs]
+    if missing and default_cost is None:
+        raise RuntimeError('{} strains in the tree have no cost, including {}. Add them to your cost file or give a '
+                           'default cost.'.format(len(missing), ', '.join(missing[:5])))
+    leaf_costs = np.zeros(len(compact.parent))
+    leaf_costs[compact.leaves] = [costs.get(name, default_cost) for name in compact.leaf_names]
+    if (leaf_costs < 0).any():
+        raise ValueError('Costs can\'t be negative.')
+    forced = [compact.index(node) for node in starting_strains]
+    if sum(float(leaf_costs[leaf]) for leaf in forced) > budget:
+        raise ValueError('Your starting strains cost {}, which is more than the budget of {}.'
+                         .format(sum(float(leaf_costs[leaf]) for leaf in forced), budget))
+    exclude = compact.leaf_mask(exclude) if exclude else None
+    start = time.perf_counter()
+    if method == 'exact':
+        unit = budget / resolution if budget > 0 else 1.0
+        # A little slack so costs that are exact multiples of a unit don't get rounded up by floating point error.
+        units = np.ceil(leaf_costs / unit - 1e-9).astype(np.int64)
+        picked, peak_bytes = budget_pd_exact(compact, units, resolution if budget > 0 else 0, forced=forced,
+                                             exclude=exclude)
+        picked = forced + [leaf for leaf in picked if leaf not in forced]
+        # Rounding costs up can leave some of the real budget unspent, which the greedy method can put to use.
+        picked, greedy_bytes = budget_pd_ratio_greedy(compact, leaf_costs, budget, forced=picked, exclude=exclude)
+        peak_bytes = max(peak_bytes, greedy_bytes)
+    else:
+        picked, peak_bytes = budget_pd_ratio_greedy(compact, leaf_costs, budget, forced=forced, exclude=exclude)
+    seconds = time.perf_counter() - start
+    return BudgetSelection(strains=[compact.nodes[leaf] for leaf in picked],
+                           cost=float(leaf_costs[picked].sum()),
+                           phylogenetic_diversity=compact.phylogenetic_diversity(picked),
+                           method=method,
+                           seconds=seconds,
+                           peak_bytes=peak_bytes)
+
+
+class RepresentativeAssignment:
+    """
+
+    Keeps track of which picked strain (representative) every node in a tree is closest to, and how far away it is.
+    The starting representatives get assigned with a single two-way pass over the tree (up from the leaves, then back
+    down from the root), which costs the same no matter how many representatives there are. Each representative
+    added afterwards costs one more pass. When two representatives are the same distance away, the one that was
+    picked first wins.
+
+    :param compact: A CompactTree.
+    :param representatives: List of leaf indices that are already picked.
+    """
+    def __init__(self, compact, representatives=()):
+        self.compact = compact
+        self.representatives = list()
+        number_nodes = len(compact.parent)
+        self.nearest = np.full(number_nodes, -1, dtype=np.int64)
+        self.distance = np.full(number_nodes, np.inf)
+        if len(representatives) > 0:
+            self._multi_source_pass(list(representatives))
+
+    def _multi_source_pass(self, representatives):
+        parent = self.compact.parent.tolist()
+        dist = self.compact.dist.tolist()
+        number_nodes = len(parent)
+        distance = [float('inf')] * number_nodes
+        priority = [number_nodes] * number_nodes
+        for order, leaf in enumerate(representatives):
+            if priority[leaf] == number_nodes:
+                distance[leaf] = 0.0
+                priority[leaf] = order
+        # Children come after their parents in preorder, so going backwards pulls the closest source up the tree...
+        for node in range(number_nodes - 1, 0, -1):
+            up = parent[node]
+            candidate = distance[node] + dist[node]
+            if (candidate, priority[node]) < (distance[up], priority[up]):
+                distance[up] = candidate
+                priority[up] = priority[node]
+        # ...and going forwards pushes it back down into the other subtrees.
+        for node in range(1, number_nodes):
+            up = parent[node]
+            candidate = distance[up] + dist[node]
+            if (candidate, priority[up]) < (distance[node], priority[node]):
+                distance[node] = candidate
+                priority[node] = priority[up]
+        self.representatives = list(representatives)
+        self.distance = np.array(distance)
+        self.nearest = np.array([representatives[order] for order in priority], dtype=np.int64)
+
+    def add(self, leaf):
+        """
+
+        Adds a representative, reassigning any node that is now closer to it than to its old representative.
+
+        :param leaf: Index of the leaf to add.
+        """
+        distances = self.compact.distances_from(leaf)
+        closer = distances < self.distance
+        self.nearest[closer] = leaf
+        self.distance[closer] = distances[closer]
+        self.representatives.append(leaf)
+
+    def radius(self):
+        """
+
+        :return: The farthest any leaf is from its representative.
+        """
+        return float(self.distance[self.compact.leaves].max())
+
+    def assignments(self):
+        """
+
+        :return: List of (leaf name, representative name, distance) tuples, one for every leaf in get_leaves order.
+        """
+        assignments = list()
+        for leaf, name in zip(self.compact.leaves, self.compact.leaf_names):
+            assignments.append((name, self.compact.names[self.nearest[leaf]], float(self.distance[leaf])))
+        return assignments
+
+
+def coverage_by_prefix(tree, representatives):
+    """
+
+    Works out how well each prefix of a list of picked strains covers a tree - as strains are picked one at a time
+    by pd_greedy or farthest_point_greedy, the farthest any strain is from its nearest pick (the coverage radius)
+    shrinks. Useful for choosing how many strains to pick.
+
+    :param tree: An ete3.Tree object
+    :param representatives: List of ete3.TreeNode objects, in the order they were picked.
+    :return: Tuple of a list of coverage radii (entry i is the radius when the first i + 1 strains are picked), and a
+    list of (leaf name, representative name, distance) tuples for every leaf when all representatives are picked.
+    """
+    compact = CompactTree(tree)
+    leaves = [compact.index(node) for node in representatives]
+    assignment = RepresentativeAssignment(compact, leaves[:1])
+    radii = [assignment.radius()]
+    for leaf in leaves[1:]:
+        assignment.add(leaf)
+        radii.append(assignment.radius())
+    return radii, assignment.assignments()
+
+
+def tree_cut_clusters(compact, cut_distance):
+    """
+
+    Splits the leaves of a tree into as few clusters as possible such that no two leaves in the same cluster are more
+    than cut_distance apart, by cutting branches in one pass up the tree (the max-diameter method from TreeCluster,
+    Balaban et al. 2019). Every node keeps track of how far it is from the farthest leaf still hanging below it.
+    Whenever the two longest children of a node would put leaves more than cut_distance apart, the branch above the
+    longest one gets cut, and that child becomes the top of its own cluster.
+
+    :param compact: A CompactTree.
+    :param cut_distance: Farthest apart two leaves in the same cluster can be.
+    :return: numpy array with the cluster each node is in, given as the index of the node at the top of the cluster.
+    The root is the top of the cluster that's left over at the end.
+    """
+    parent = compact.parent.tolist()
+    dist = compact.dist.tolist()
+    number_nodes = len(parent)
+    children = [list() for _ in range(number_nodes)]
+    for node in range(1, number_nodes):
+        children[parent[node]].append(node)
+    height = [0.0] * number_nodes
+    cut = [False] * number_nodes
+    for node in range(number_nodes - 1, -1, -1):
+        if not children[node]:
+            continue
+        arms = sorted(((height[child] + dist[child], child) for child in children[node]), reverse=True)
+        longest = 0
+        while len(arms) - longest >= 2 and arms[longest][0] + arms[longest + 1][0] > cut_distance:
+            cut[arms[longest][1]] = True
+            longest += 1
+        height[node] = arms[longest][0]
+    cluster = [0] * number_nodes
+    for node in range(1, number_nodes):
+        cluster[node] = node if cut[node] else cluster[parent[node]]
+    return np.array(cluster, dtype=np.int64)
+
+
+def cluster_medoids(compact, cluster, keep=()):
+    """
+
+    Finds the medoid of each cluster - the leaf with the smallest total distance to every other leaf in its cluster.
+    Totals for every leaf come from one pass up the tree (adding up distances to leaves below each node) and one pass
+    back down (adding in the rest of the cluster), so this is O(n) however big the clusters are.
+
+    :param compact: A CompactTree.
+    :param cluster: numpy array with the cluster of each node, from tree_cut_clusters.
+    :param keep: Leaf indices that should represent their clusters instead of the medoid, if a cluster has one.
+    :return: Dictionary with each cluster (the node at its top) as keys and the leaf representing it as values. Ties
+    are broken by leaf name.
+    """
+    parent = compact.parent.tolist()
+    dist = compact.dist.tolist()
+    cluster_list = cluster.tolist()
+    number_nodes = len(parent)
+    below = compact.is_leaf.astype(np.int64).tolist()
+    down = [0.0] * number_nodes
+    for node in range(number_nodes - 1, 0, -1):
+        up = parent[node]
+        if cluster_list[node] == cluster_list[up]:
+            below[up] += below[node]
+            down[up] += down[node] + below[node] * dist[node]
+    total = list(down)
+    for node in range(1, number_nodes):
+        top = cluster_list[node]
+        if top != node:
+            total[node] = total[parent[node]] + dist[node] * (below[top] - 2 * below[node])
+    total = np.array(total)
+    leaves = compact.leaves
+    order = np.lexsort((compact.name_rank[leaves], total[leaves], cluster[leaves]))
+    clusters, first = np.unique(cluster[leaves][order], return_index=True)
+    medoids = {int(top): int(leaves[order][position]) for top, position in zip(clusters, first)}
+    for leaf in reversed(list(keep)):
+        medoids[int(cluster[leaf])] = int(leaf)
+    return medoids
+
+
+def cut_clusters(tree, cut_distance, starting_strains=()):
+    """
+
+    Picks one strain per cluster, where clusters are groups of strains that are all within cut_distance of each other
+    (see tree_cut_clusters), and each cluster is represented by its medoid (see cluster_medoids).
+
+    :param tree: An ete3.Tree object
+    :param cut_distance: Farthest apart two strains in the same cluster can be.
+    :param starting_strains: List of ete3.TreeNode objects that should represent their clusters. If two are in the
+    same cluster, the first one does.
+    :return: Tuple of a list of ete3.TreeNode objects representing each cluster, biggest cluster first, and a list of
+    (leaf name, cluster number, representative name, distance to representative) tuples for every leaf in get_leaves
+    order. Clusters are numbered from 1 in the same order as the representatives.
+    """
+    if cut_distance < 0:
+        raise ValueError('Cut distance can\'t be negative, got {}.'.format(cut_distance))
+    compact = CompactTree(tree)
+    cluster = tree_cut_clusters(compact, cut_distance)
+    keep = [compact.index(node) for node in starting_strains]
+    medoids = cluster_medoids(compact, cluster, keep=keep)
+    tops, sizes = np.unique(cluster[compact.leaves], return_counts=True)
+    ordered = [int(top) for top in tops[np.lexsort((tops, -sizes))]]
+    for leaf in keep:
+        if medoids[int(cluster[leaf])] != leaf:
+            logging.warning('Starting strain {} is in the same cluster as starting strain {}, which represents it.'
+                            .format(compact.names[leaf], compact.names[medoids[int(cluster[leaf])]]))
+    number = {top: position for position, top in enumerate(ordered, start=1)}
+    representative = np.array([medoids[int(top)] for top in cluster[compact.leaves]], dtype=np.int64)
+    ancestors = compact.lowest_common_ancestors(compact.leaves, representative)
+    distances = compact.depth[compact.leaves] + compact.depth[representative] - 2 * compact.depth[ancestors]
+    table = [(name, number[int(top)], compact.names[rep], float(distance)) for name, top, rep, distance in
+             zip(compact.leaf_names, cluster[compact.leaves], representative, distances)]
+    return [compact.nodes[medoids[top]] for top in ordered], table
+
+
+def tree_hash(tree, exclude=()):
+    """
+
+    :param tree: An ete3.Tree object or a CompactTree.
+    :param exclude: Names of strains excluded from picking, which change the picks just like the tree does.
+    :return: SHA-256 hex digest of the tree's topology, leaf names and branch lengths, which changes if any of those
+    change even slightly.
+    """
+    compact = tree if isinstance(tree, CompactTree) else CompactTree(tree)
+    digest = hashlib.sha256()
+    digest.update(compact.parent.tobytes())
+    digest.update(compact.dist.tobytes())
+    digest.update('\n'.join(str(name) for name in compact.names).encode('utf-8'))
+    if exclude:
+        digest.update(b'\0')
+        digest.update('\n'.join(sorted(str(name) for name in exclude)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class SelectionCheckpoint:
+    """
+
+    Saves the strains pd_greedy has picked so far to a JSON file every so often, so a long selection that gets killed
+    part way through can pick up where it left off. Strains are saved as positions in get_leaves order, along with a
+    hash of the tree and the engine used, so a checkpoint can't be resumed on a different tree by accident. Since
+    each pick only depends on the strains picked before it, resuming gives exactly the same strains as a run that
+    was never interrupted.
+
+    :param checkpoint_file: Path to the checkpoint file. Gets written atomically, so it's never left half written.
+    :param tree_hash: Hash of the tree being picked from, from tree_hash.
+    :param engine: Engine doing the picking (reference or fast).
+    :param every: Write the checkpoint after every this many picks.
+    """
+    def __init__(self, checkpoint_file, tree_hash, engine, every=10):
+        self.checkpoint_file = checkpoint_file
+        self.tree_hash = tree_hash
+        self.engine = engine
+        self.every = every
+
+    def load(self):
+        """
+
+        :return: List of leaf positions picked so far, or an empty list if there isn't a checkpoint yet. Raises a
+        ValueError if the checkpoint is for a different tree or engine.
+        """
+        if not os.path.isfile(self.checkpoint_file):
+            return list()
+        with open(self.checkpoint_file) as f:
+            checkpoint = json.load(f)
+        if checkpoint['tree_hash'] != self.tree_hash:
+            raise ValueError('Checkpoint {} was made with a different tree or different excluded strains, so it can\'t '
+                             'be resumed. Delete it to start over.'.format(self.checkpoint_file))
+        if checkpoint['engine'] != self.engine:
+            raise ValueError('Checkpoint {} was made with the {} engine, so it can only be resumed with that engine.'
+                             .format(self.checkpoint_file, checkpoint['engine']))
+        logging.info('Resuming from checkpoint with {} strains picked.'.format(len(checkpoint['chosen'])))
+        return checkpoint['chosen']
+
+    def update(self, chosen):
+        """
+
+        Writes the checkpoint if enough strains have been picked since the last time.
+
+        :param chosen: List of leaf positions picked so far.
+        """
+        if len(chosen) % self.every == 0:
+            self.save(chosen)
+
+    def save(self, chosen):
+        """
+
+        :param chosen: List of leaf positions picked so far.
+        """
+        temporary_file = self.checkpoint_file + '.tmp'
+        with open(temporary_file, 'w') as f:
+            json.dump({'version': get_version(),
+                       'tree_hash': self.tree_hash,
+                       'engine': self.engine,
+                       'chosen': [None if position is None else int(position) for position in chosen]}, f)
+        os.replace(temporary_file, self.checkpoint_file)
+
+
+def find_next_leaf(diverse_leaves, tree, profiler=None, exclude=()):
     """
 
     Given a set of leaves we've already decided represent the most diversity, find the next leaf that contributes
@@ -118,6 +1701,8 @@ def find_next_leaf(diverse_leaves, tree):
     :param diverse_leaves: List of leaves that we've already decided represent the most diversity possible - each entry
     in this list should be an ete3.TreeNode object
     :param tree: an ete3.Tree object that contains the nodes listed in diverse_leaves
+    :param profiler: If specified, a StageProfiler to count leaves evaluated and tree copies made with.
+    :param exclude: Names of leaves that can't be picked.
     :return: an ete3.TreeNode object representing the leaf that adds the most diversity to `diverse_leaves`
     """
     # Here, we prune off everything except for the leaves we've already selected as diverse and one other leaf in the
@@ -128,16 +1713,19 @@ def find_next_leaf(diverse_leaves, tree):
     leaves = tree.get_leaves()
     leaf_to_return = None
     for leaf in leaves:
-        if leaf not in diverse_leaves:
+        if leaf not in diverse_leaves and leaf.name not in exclude:
             leafset = diverse_leaves.copy()
             leafset.append(leaf)
             sets_to_try[leaf.name] = leafset
+    if profiler is not None:
+        profiler.count('leaves_evaluated', len(sets_to_try))
+        profiler.count('tree_copies', len(sets_to_try))
 
     # In the event multiple strains have same distance, sort the keys so we're consistent about which one we're taking
     for leafname in sorted(sets_to_try):
         logging.debug('Calculating total tree distance when adding leaf {}.'.format(leafname))
         total_branch_length = 0
-        newtree = tree.copy()
+        newtree = copy_tree(tree)
         newtree.prune(get_leaf_names_from_nodes(sets_to_try[leafname]), preserve_branch_length=True)
         for branch in newtree.get_descendants():
             total_branch_length += branch.dist
@@ -148,7 +1736,8 @@ def find_next_leaf(diverse_leaves, tree):
     return leaf_to_return
 
 
-def pd_greedy(tree, number_tips, starting_strains):
+def pd_greedy(tree, number_tips, starting_strains, profiler=None, engine='reference', collapse_threshold=None,
+              checkpoint_file=None, resume=False, checkpoint_every=10, exclude=(), cancel=None, quotas=None):
     """
 
     Implements the greedy algorithm described in Species Choice for Comparative Genomics: Being Greedy Works (Pardi 2005
@@ -158,48 +1747,624 @@ def pd_greedy(tree, number_tips, starting_strains):
     :param number_tips: Number of strains you want to pick out.
     :param starting_strains: List of ete3.TreeNode objects that make up your starting strains. If empty, will be chosen
     automatically
+    :param profiler: If specified, a StageProfiler to count leaves evaluated and tree copies made with.
+    :param engine: reference (the default) to prune a copy of the tree for every candidate leaf with find_next_leaf,
+    or fast to work out every leaf's gain at once with compact_pd_greedy. Both pick the same strains, except where
+    candidates tie to within rounding error - see strainchoosr.differential.
+    :param collapse_threshold: If specified, clusters of strains that are all within this distance of their common
+    ancestor get collapsed into one strain before picking - see collapsed_pd_greedy. Always uses the fast engine.
+    :param checkpoint_file: If specified, strains picked so far get saved here every checkpoint_every picks - see
+    SelectionCheckpoint.
+    :param resume: If True and checkpoint_file exists, carry on from the strains saved in it instead of starting
+    over. Starting strains must be the first strains in the checkpoint.
+    :param checkpoint_every: How many picks to make between checkpoints. Defaults to 10.
+    :param exclude: Names of strains that can't be picked, like lost isolates. Their branches still count towards
+    the tree, they just never get picked. If too many strains are excluded, fewer than number_tips get returned.
+    :param cancel: If specified, something with an is_set method (like a threading.Event). Gets checked between
+    picks, and a SelectionCancelled error is raised once it's set.
+    :param quotas: If specified, a CladeQuotas object with the fewest and most strains to pick from each clade - see
+    quota_pd_greedy. Always uses the fast engine.
     :return: List of ete3.TreeNode objects representing the maximum possible amount of diversity.
     """
+    exclude = set(exclude)
+    for node in starting_strains:
+        if node.name in exclude:
+            raise ValueError('Strain {} is a starting strain, so it can\'t be excluded.'.format(node.name))
+    if quotas is not None:
+        if collapse_threshold is not None or checkpoint_file is not None:
+            raise ValueError('Clade quotas can\'t be used when collapsing clades or with checkpoints.')
+        compact = CompactTree(tree)
+        picks = quota_pd_greedy(compact, number_tips, [compact.index(node) for node in starting_strains], quotas,
+                                exclude=compact.leaf_mask(exclude) if exclude else None, cancel=cancel)
+        return [compact.nodes[leaf] for leaf in picks]
+    if collapse_threshold is not None:
+        if checkpoint_file is not None:
+            raise ValueError('Checkpoints can\'t be used when collapsing clades.')
+        compact = CompactTree(tree)
+        picks = collapsed_pd_greedy(compact, number_tips, [compact.index(node) for node in starting_strains],
+                                    collapse_threshold, exclude=compact.leaf_mask(exclude) if exclude else None,
+                                    cancel=cancel)
+        return [compact.nodes[leaf] for leaf in picks]
+    if engine not in ('reference', 'fast'):
+        raise ValueError('Unknown engine {}, choose from reference or fast.'.format(engine))
+    leaves = tree.get_leaves()
+    checkpoint = None
+    if checkpoint_file is not None:
+        checkpoint = SelectionCheckpoint(checkpoint_file, tree_hash(tree, exclude), engine, every=checkpoint_every)
+        resumed = checkpoint.load() if resume else list()
+        if resumed:
+            position = {id(leaf): number for number, leaf in enumerate(leaves)}
+            wanted = [position.get(id(node)) for node in starting_strains]
+            if resumed[:len(wanted)] != wanted:
+                raise ValueError('Starting strains don\'t match the strains in checkpoint {}.'.format(checkpoint_file))
+            starting_strains = [None if number is None else leaves[number] for number in resumed]
+            if len(starting_strains) >= number_tips:
+                return starting_strains[:max(number_tips, len(wanted), 2)]
+    if engine == 'fast':
+        compact = CompactTree(tree)
+        picks = compact_pd_greedy(compact, number_tips,
+                                  [compact.index(node) for node in starting_strains if node is not None],
+                                  checkpoint=checkpoint,
+                                  exclude=compact.leaf_mask(exclude) if exclude else None,
+                                  cancel=cancel)
+        return [compact.nodes[leaf] for leaf in picks]
     # The way this works - start out by picking the two strains that have the longest total length
     # between them in the tree.
     # From there, add the leaf that adds the most total branch length to the tree, then just keep doing that until
     # you hit the number of strains you want.
 
-    diverse_strains = copy.deepcopy(starting_strains)
-    diverse_strains = find_starting_leaves(tree, diverse_strains)
+    diverse_strains = list(starting_strains)
+    diverse_strains = find_starting_leaves(tree, diverse_strains, exclude=exclude)
+    if checkpoint is not None:
+        position = {id(leaf): number for number, leaf in enumerate(leaves)}
+        chosen = [position.get(id(node)) for node in diverse_strains]
+        checkpoint.save(chosen)
 
     while len(diverse_strains) < number_tips:
+        if cancel is not None and cancel.is_set():
+            raise SelectionCancelled('Picking was cancelled after {} strains.'.format(len(diverse_strains)))
         logging.info('Working on strain {num}'.format(num=len(diverse_strains) + 1))
-        next_leaf = find_next_leaf(diverse_strains, tree)
+        next_leaf = find_next_leaf(diverse_strains, tree, profiler=profiler, exclude=exclude)
+        if next_leaf is None and exclude:
+            logging.warning('Ran out of strains that aren\'t excluded after picking {}.'.format(len(diverse_strains)))
+            break
         diverse_strains.append(next_leaf)
+        if checkpoint is not None:
+            chosen.append(position.get(id(next_leaf)))
+            checkpoint.update(chosen)
+    if checkpoint is not None:
+        checkpoint.save(chosen)
     return diverse_strains
 
 
+class SelectionScenarios:
+    """
+
+    Answers what-if questions about one tree, like "what would the panel be if these strains were lost" or "what if
+    we had to keep these ones". The tree gets indexed once (see CompactTree), and every question after that is just
+    the fast greedy algorithm run against those indexes - no re-parsing or copying the tree. Picks get remembered for
+    each combination of forced and excluded strains, so asking for a bigger panel carries on from the last pick
+    instead of starting over.
+
+    :param tree: An ete3.Tree object, or a CompactTree.
+    """
+    def __init__(self, tree):
+        self.compact = tree if isinstance(tree, CompactTree) else CompactTree(tree)
+        self._scenarios = dict()
+
+    def _leaf_index(self, name):
+        try:
+            return self.compact.name_index[name]
+        except KeyError:
+            raise RuntimeError('One of the leaves you specified could not be found in the treefile provided. '
+                               'Leaf name was {}. Please check that your treefile contains that '
+                               'leaf.'.format(name))
+
+    def panel(self, number_tips, forced=(), excluded=()):
+        """
+
+        :param number_tips: Number of strains wanted.
+        :param forced: Names of strains that have to be in the panel, in the order they should come first. If empty,
+        starting strains get chosen automatically, the same way pd_greedy does.
+        :param excluded: Names of strains that can't be in the panel. Names that aren't in the tree are ignored.
+        :return: List of strain names, in the order they were picked. Can be shorter than number_tips if too many
+        strains are excluded.
+        """
+        forced = tuple(forced)
+        excluded = frozenset(excluded)
+        for name in forced:
+            if name in excluded:
+                raise ValueError('Strain {} is forced, so it can\'t be excluded.'.format(name))
+        key = (forced, excluded)
+        if key not in self._scenarios:
+            exclude = self.compact.leaf_mask(excluded) if excluded else None
+            starting_leaves = [leaf for leaf in
+                               self.compact.find_starting_leaves([self._leaf_index(name) for name in forced],
+                                                                 exclude=exclude)
+                               if leaf is not None]
+            self._scenarios[key] = (iter_compact_pd_greedy(self.compact, starting_leaves, exclude=exclude), list(),
+                                    len(starting_leaves))
+        picks, chosen, number_starting = self._scenarios[key]
+        # Like pd_greedy, starting strains all get kept even if there are more of them than number_tips.
+        number_tips = max(number_tips, number_starting)
+        while len(chosen) < number_tips:
+            pick = next(picks, None)
+            if pick is None:
+                break
+            chosen.append(pick[0])
+        return [self.compact.names[leaf] for leaf in chosen[:number_tips]]
+
+    def phylogenetic_diversity(self, names):
+        """
+
+        :param names: List of strain names.
+        :return: Phylogenetic diversity of those strains.
+        """
+        return float(phylogenetic_diversity(self.compact, [names])[0])
+
+
+def refine_centers(chosen, fixed, distances, name_rank, max_rounds=20, exclude=None):
+    """
+
+    Improves a k-center solution by moving each pick to the middle of the strains closest to it. Farthest-point
+    traversal picks strains on the edges of the tree, which is what maxmin wants, but a pick in the middle of its
+    group covers that group better. Every round, each pick that isn't fixed gets swapped for the strain in its group
+    that is closest to the farthest strain of the group, if that's strictly closer than the pick is. The farthest strain
+    from any point is always one of the two ends of the group's longest path in a tree, so two distance passes per group
+    find the candidate. The swap only happens after checking the candidate against the whole group, so on a distance
+    matrix that isn't a tree this is still safe. No strain ends up farther from its nearest pick than before, so the
+    coverage radius never goes up.
+
+    :param chosen: List of item indices picked so far.
+    :param fixed: Set of item indices that must stay picked (starting strains).
+    :param distances: Function that takes an item index and returns a numpy array with its distance to every item.
+    :param name_rank: numpy array with the sorted-name rank of each item, used to break ties.
+    :param max_rounds: Most rounds of swapping to do.
+    :param exclude: Optional boolean array - items flagged True still count as part of a group, but never get swapped
+    in as a pick.
+    :return: List of item indices, with swapped picks in the place of the ones they replaced.
+    """
+    chosen = list(chosen)
+    number_items = len(name_rank)
+    for _ in range(max_rounds):
+        nearest = np.full(number_items, np.inf)
+        owner = np.zeros(number_items, dtype=np.int64)
+        for position, item in enumerate(chosen):
+            row = distances(item)
+            closer = row < nearest
+            nearest[closer] = row[closer]
+            owner[closer] = position
+        order = np.argsort(owner, kind='stable')
+        bounds = np.searchsorted(owner[order], np.arange(len(chosen) + 1))
+        picked = set(chosen)
+        moved = False
+        for position, item in enumerate(chosen):
+            group = order[bounds[position]:bounds[position + 1]]
+            if item in fixed or len(group) < 3:
+                continue
+            radius = nearest[group].max()
+            first_end = int(group[np.argmax(nearest[group])])
+            first_row = distances(first_end)[group]
+            second_row = distances(int(group[np.argmax(first_row)]))[group]
+            eccentricity = np.maximum(first_row, second_row)
+            if exclude is not None:
+                eccentricity[exclude[group]] = np.inf
+            tied = group[eccentricity == eccentricity.min()]
+            candidate = int(tied[np.argmin(name_rank[tied])])
+            if candidate in picked or distances(candidate)[group].max() >= radius:
+                continue
+            picked.discard(item)
+            picked.add(candidate)
+            chosen[position] = candidate
+            moved = True
+        if not moved:
+            break
+    return chosen
+
+
+def farthest_point_greedy(tree, number_tips, starting_strains, objective='maxmin', exclude=()):
+    """
+
+    Picks strains by farthest-point traversal: after the starting leaves (found the same way find_starting_leaves
+    does it), keep adding the leaf that is farthest from its nearest already-picked strain. This is the standard
+    2-approximation both for maximizing the minimum distance between picked strains (maxmin) and for minimizing the
+    maximum distance from any strain to its nearest pick (kcenter). Distance to the nearest pick is kept up to date
+    for every leaf, so each pick costs one pass over the tree. For kcenter, the picks then get moved towards the
+    middle of the strains they cover with refine_centers.
+
+    :param tree: An ete3.Tree object
+    :param number_tips: Number of strains you want to pick out. Asking for more strains than there are to pick from
+    picks all of them.
+    :param starting_strains: List of ete3.TreeNode objects that make up your starting strains. If empty, will be chosen
+    automatically
+    :param objective: maxmin or kcenter.
+    :param exclude: Names of strains that can't be picked. They still count as strains that need a pick close by.
+    :return: List of ete3.TreeNode objects, in the order they were picked.
+    """
+    compact = CompactTree(tree)
+    excluded = compact.leaf_mask(exclude)
+    chosen = compact.find_starting_leaves([compact.index(node) for node in starting_strains], exclude=excluded)
+    chosen = [leaf for leaf in chosen if leaf is not None]
+    # Excluded strains start out flagged as picked, so they're never candidates - they just don't count as picks.
+    picked = excluded.copy()
+    assignment = RepresentativeAssignment(compact)
+    min_pairwise_distance = np.inf
+    for position, leaf in enumerate(chosen):
+        if position > 0:
+            min_pairwise_distance = min(min_pairwise_distance, assignment.distance[leaf])
+        assignment.add(leaf)
+        picked[leaf] = True
+
+    number_tips = min(number_tips, len(chosen) + np.count_nonzero(~picked[compact.leaves]))
+    while len(chosen) < number_tips:
+        logging.info('Working on strain {num}'.format(num=len(chosen) + 1))
+        next_leaf = compact.farthest_leaf(assignment.distance, exclude=picked)
+        if next_leaf is None:
+            # Everything left is sitting on top of something already picked - take the first by name.
+            remaining = compact.leaves[~picked[compact.leaves]]
+            next_leaf = int(remaining[np.argmin(compact.name_rank[remaining])])
+        min_pairwise_distance = min(min_pairwise_distance, assignment.distance[next_leaf])
+        assignment.add(next_leaf)
+        picked[next_leaf] = True
+        chosen.append(next_leaf)
+    if objective == 'kcenter':
+        # refine_centers works on positions in the list of leaves rather than node indices.
+        position_of = np.zeros(len(compact.parent), dtype=np.int64)
+        position_of[compact.leaves] = np.arange(len(compact.leaves))
+        starting = set(position_of[[compact.index(node) for node in starting_strains]].tolist())
+        refined = refine_centers(position_of[chosen].tolist(), starting,
+                                 lambda position: compact.distances_from(compact.leaves[position])[compact.leaves],
+                                 compact.name_rank[compact.leaves],
+                                 exclude=excluded[compact.leaves])
+        chosen = compact.leaves[refined].tolist()
+        assignment = RepresentativeAssignment(compact, chosen)
+    logging.info('Minimum distance between picked strains: {}. Farthest any strain is from a picked strain: {}.'
+                 .format(min_pairwise_distance, assignment.radius()))
+    return [compact.nodes[leaf] for leaf in chosen]
+
+
+class ReplicateSelection:
+    """
+
+    Results of picking strains across a set of replicate (bootstrap or posterior) trees.
+
+    :param consensus: List of strain names picked to have the highest mean phylogenetic diversity across all the
+    replicate trees, in the order they were picked.
+    :param mean_pd: List where entry i is the mean phylogenetic diversity across replicates of the first i + 1
+    consensus strains.
+    :param replicate_picks: List with the strain names pd_greedy picked on each replicate tree, in pick order.
+    """
+    def __init__(self, consensus, mean_pd, replicate_picks):
+        self.consensus = consensus
+        self.mean_pd = mean_pd
+        self.replicate_picks = replicate_picks
+
+    def frequencies(self, number_tips):
+        """
+
+        :param number_tips: Number of strains picked on each replicate.
+        :return: Dictionary with strain names as keys and the fraction of replicates where that strain was one of
+        the first number_tips picked as values. Strains that were never picked are left out.
+        """
+        counts = dict()
+        for picks in self.replicate_picks:
+            for strain in picks[:number_tips]:
+                counts[strain] = counts.get(strain, 0) + 1
+        return {strain: count / len(self.replicate_picks) for strain, count in counts.items()}
+
+
+# Replicate trees, as set up in each worker process by _init_replicate_worker.
+_replicate_trees = dict()
+
+
+def _init_replicate_worker(shared_arrays, offsets, strain_names):
+    _replicate_trees.clear()
+    for key, (shared_array, dtype) in shared_arrays.items():
+        _replicate_trees[key] = np.frombuffer(shared_array, dtype=dtype)
+    _replicate_trees['offsets'] = offsets
+    _replicate_trees['strain_names'] = strain_names
+    _replicate_trees['cache'] = dict()
+
+
+def _replicate_tree(tree_number):
+    # Trees are rebuilt as views on the shared arrays, so the only thing each task copies is small per-leaf stuff.
+    cache = _replicate_trees['cache']
+    if tree_number not in cache:
+        start = _replicate_trees['offsets'][tree_number]
+        stop = _replicate_trees['offsets'][tree_number + 1]
+        strain = _replicate_trees['strain'][start:stop]
+        names = [_replicate_trees['strain_names'][i] if i >= 0 else '' for i in strain]
+        name_rank = np.where(strain >= 0, _replicate_trees['strain_rank'][strain], 0)
+        compact = CompactTree.from_arrays(_replicate_trees['parent'][start:stop],
+                                          _replicate_trees['dist'][start:stop],
+                                          names,
+                                          depth=_replicate_trees['depth'][start:stop],
+                                          end=_replicate_trees['end'][start:stop],
+                                          name_rank=name_rank)
+        leaf_of_strain = np.full(len(_replicate_trees['strain_names']), -1, dtype=np.int64)
+        leaf_of_strain[strain[compact.leaves]] = compact.leaves
+        cache[tree_number] = compact, strain, leaf_of_strain
+    return cache[tree_number]
+
+
+def _pick_on_replicate(job):
+    tree_number, number_tips, starting_strains, excluded_strains = job
+    compact, strain, leaf_of_strain = _replicate_tree(tree_number)
+    exclude = np.zeros(len(compact.parent), dtype=bool)
+    exclude[leaf_of_strain[excluded_strains]] = True
+    picks = compact_pd_greedy(compact, number_tips, [int(leaf_of_strain[s]) for s in starting_strains],
+                              exclude=exclude)
+    return strain[picks].tolist()
+
+
+def _gains_on_replicates(job):
+    tree_numbers, chosen_strains = job
+    total_gains = np.zeros(len(_replicate_trees['strain_names']))
+    for tree_number in tree_numbers:
+        compact, strain, leaf_of_strain = _replicate_tree(tree_number)
+        marked = np.zeros(len(compact.parent), dtype=bool)
+        common_ancestor = None
+        for chosen_strain in chosen_strains:
+            common_ancestor = compact.add_to_spanning_tree(marked, int(leaf_of_strain[chosen_strain]), common_ancestor)
+        gains = compact.marginal_gains(marked, common_ancestor)
+        total_gains[strain[compact.leaves]] += gains[compact.leaves]
+    return total_gains
+
+
+def _share_replicate_trees(trees):
+    strain_names = sorted(trees[0].get_leaf_names())
+    strain_ids = {name: i for i, name in enumerate(strain_names)}
+    if len(strain_ids) != len(strain_names):
+        raise RuntimeError('Leaf names in your replicate trees must be unique. Please check your treefile.')
+    columns = {'parent': list(), 'dist': list(), 'depth': list(), 'end': list(), 'strain': list()}
+    offsets = [0]
+    for tree in trees:
+        compact = CompactTree(tree)
+        if sorted(compact.leaf_names) != strain_names:
+            raise RuntimeError('Every replicate tree must have exactly the same leaves. Tree number {} does not '
+                               'match the first tree.'.format(len(offsets)))
+        strain = np.full(len(compact.parent), -1, dtype=np.int64)
+        strain[compact.leaves] = [strain_ids[name] for name in compact.leaf_names]
+        columns['parent'].append(compact.parent)
+        columns['dist'].append(compact.dist)
+        columns['depth'].append(compact.depth)
+        columns['end'].append(compact.end)
+        columns['strain'].append(strain)
+        offsets.append(offsets[-1] + len(compact.parent))
+    # Strain ids are handed out in sorted name order, so an id is also the strain's name rank.
+    columns['strain_rank'] = [np.arange(len(strain_names), dtype=np.int64)]
+    shared_arrays = dict()
+    for key, arrays in columns.items():
+        values = np.concatenate(arrays)
+        shared_array = multiprocessing.RawArray('b', values.nbytes)
+        np.frombuffer(shared_array, dtype=values.dtype)[:] = values
+        shared_arrays[key] = shared_array, values.dtype
+    return shared_arrays, offsets, strain_names
+
+
+def replicate_pd_greedy(trees, number_tips, starting_strains=None, threads=1, exclude=()):
+    """
+
+    Picks strains that are diverse across a whole set of replicate trees (bootstrap trees, or trees sampled from a
+    posterior) instead of just one tree. pd_greedy gets run on every replicate, which gives how often each strain gets
+    picked. A consensus set is then built greedily, adding whichever strain adds the most phylogenetic diversity on
+    average across all replicates.
+
+    Trees are packed into shared memory arrays once, so worker processes read them directly instead of having them
+    pickled and sent over for every task.
+
+    :param trees: List of ete3.Tree objects, all with the same (uniquely named) leaves.
+    :param number_tips: Number of strains you want to pick out.
+    :param starting_strains: List of leaf names that must be picked. If empty, starting strains get chosen
+    automatically on each replicate, and the consensus starts with the replicates' starting pair that is farthest
+    apart on average.
+    :param threads: Number of processes to use. With 1, everything runs in this process.
+    :param exclude: Names of strains that can't be picked, on any replicate or in the consensus.
+    :return: A ReplicateSelection object.
+    """
+    if starting_strains is None:
+        starting_strains = list()
+    shared_arrays, offsets, strain_names = _share_replicate_trees(trees)
+    strain_ids = {name: i for i, name in enumerate(strain_names)}
+    try:
+        starting_ids = [strain_ids[name] for name in starting_strains]
+    except KeyError as e:
+        raise RuntimeError('One of the leaves you specified could not be found in the replicate trees provided. '
+                           'Leaf name was {}.'.format(e.args[0]))
+    excluded_ids = [strain_ids[name] for name in exclude if name in strain_ids]
+    tree_numbers = list(range(len(trees)))
+    chunks = [chunk.tolist() for chunk in np.array_split(tree_numbers, min(threads, len(trees))) if len(chunk) > 0]
+    initargs = (shared_arrays, offsets, strain_names)
+    pool = None
+    if threads > 1:
+        pool = multiprocessing.Pool(threads, initializer=_init_replicate_worker, initargs=initargs)
+        mapper = pool.map
+    else:
+        _init_replicate_worker(*initargs)
+        mapper = map
+    try:
+        logging.info('Picking {} strains on each of {} replicate trees.'.format(number_tips, len(trees)))
+        replicate_picks = list(mapper(_pick_on_replicate,
+                                      [(tree_number, number_tips, starting_ids, excluded_ids)
+                                       for tree_number in tree_numbers]))
+
+        def mean_gains(chosen):
+            return sum(mapper(_gains_on_replicates, [(chunk, chosen) for chunk in chunks])) / len(trees)
+
+        logging.info('Building consensus set across replicate trees.')
+        if len(starting_ids) >= 2:
+            consensus = starting_ids[:1]
+            mean_pd = [0.0]
+            for starting_id in starting_ids[1:]:
+                mean_pd.append(mean_pd[-1] + float(mean_gains(consensus)[starting_id]))
+                consensus.append(starting_id)
+        else:
+            # With one strain picked, gain is just distance - try each replicate's starting strains as the first
+            # strain, and take whichever pair is farthest apart on average.
+            seeds = starting_ids if starting_ids else sorted({strain for picks in replicate_picks
+                                                              for strain in picks[:2]})
+            best = None
+            for seed in seeds:
+                distances = mean_gains([seed])
+                distances[seed] = -np.inf
+                distances[excluded_ids] = -np.inf
+                partner = int(np.argmax(distances))
+                if best is None or distances[partner] > best[0]:
+                    best = distances[partner], seed, partner
+            consensus = [best[1], best[2]]
+            mean_pd = [0.0, float(best[0])]
+        while len(consensus) < min(number_tips, len(strain_names) - len(excluded_ids)):
+            gains = mean_gains(consensus)
+            gains[consensus] = -np.inf
+            gains[excluded_ids] = -np.inf
+            # Strain ids are in name order, so argmax breaks ties by name like everywhere else.
+            next_strain = int(np.argmax(gains))
+            mean_pd.append(mean_pd[-1] + float(gains[next_strain]))
+            consensus.append(next_strain)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _replicate_trees.clear()
+    return ReplicateSelection(consensus=[strain_names[i] for i in consensus],
+                              mean_pd=mean_pd,
+                              replicate_picks=[[strain_names[i] for i in picks] for picks in replicate_picks])
+
+
 def modify_tree_with_weights(tree, weights):
     """
 
     Given an ete3 Tree object and a dictionary where keys are node names in the tree and values are multipliers (can
     be generated with read_weights_file), returns a new tree where each branch in the weights dictionary is multiplied
-    by the multiplier specified.
+    by the multiplier specified. Keys can also name a whole clade - an internal node label, or two or more leaf names
+    separated by commas for their most recent common ancestor - in which case every branch in the clade, including
+    the one leading to it, gets multiplied. Weights on nested clades multiply.
+
+    :param tree: an ete3.Tree object
+    :param weights: Dictionary where keys are names of nodes/tips in the tree, and values are weights by which branch
+    lengths will be multiplied
+    :return: A new ete3.Tree where branch lengths have been modified.
+    """
+    newtree = copy_tree(tree)
+    compact = CompactTree(newtree)
+    dist = weighted_branch_lengths(compact, weights)
+    for i in np.flatnonzero(dist != compact.dist).tolist():
+        if i > 0:
+            compact.nodes[i].dist = float(dist[i])
+    return newtree
+
+
+class ImageCache:
+    """
+
+    Keeps rendered tree images on disk so that drawing the same tree with the same strains highlighted in the same
+    style doesn't have to happen again. Images are stored under a SHA-256 of everything that goes into drawing them
+    (see ImageCache.key), so an image can only ever be reused for exactly the same drawing. Once the images in the
+    cache add up to more than max_bytes, the ones used least recently get deleted.
+
+    :param cache_dir: Directory to keep images in. Defaults to strainchoosr/images in $XDG_CACHE_HOME (or ~/.cache).
+    Gets created if it doesn't exist.
+    :param max_bytes: Most space the cached images can take up. Defaults to 512 MB.
+    """
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 * 1024):
+        if cache_dir is None:
+            cache_dir = ImageCache.default_dir()
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def default_dir():
+        """
+
+        :return: strainchoosr/images in $XDG_CACHE_HOME, or in ~/.cache if that isn't set.
+        """
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(cache_home, 'strainchoosr', 'images')
+
+    @staticmethod
+    def key(tree, representatives, color, mode, rotation, extension):
+        """
+
+        :param tree: An ete3.Tree object or a CompactTree.
+        :param representatives: Strain names that get highlighted. Order doesn't matter.
+        :param color: Color strains get highlighted in.
+        :param mode: r or c.
+        :param rotation: Rotation of the tree.
+        :param extension: Image format, like .png.
+        :return: SHA-256 hex digest of the tree (see tree_hash), highlighted strains, style, image format, and the
+        versions of StrainChoosr and ete3 doing the drawing.
+        """
+        description = json.dumps({'tree': tree_hash(tree),
+                                  'representatives': sorted(set(representatives)),
+                                  'color': color,
+                                  'mode': mode,
+                                  'rotation': rotation,
+                                  'extension': extension.lower(),
+                                  'renderer': [get_version(), getattr(ete3, '__version__', None), 300]},
+                                 sort_keys=True)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def _path(self, key, extension):
+        return os.path.join(self.cache_dir, key + extension.lower())
+
+    def fetch(self, key, extension, output_file):
+        """
+
+        Copies a cached image to output_file, if there is one.
+
+        :return: True if the image was in the cache, otherwise False.
+        """
+        path = self._path(key, extension)
+        try:
+            shutil.copyfile(path, output_file)
+        except FileNotFoundError:
+            return False
+        # Marks the image as recently used, so it's the last to get evicted.
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return True
+
+    def store(self, key, extension, image_file):
+        """
+
+        Adds a copy of image_file to the cache, then evicts the least recently used images if the cache is too big.
+        The copy gets written under a temporary name and moved into place, so other processes using the same cache
+        never see a half-written image.
+        """
+        handle, temporary = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(handle)
+        try:
+            shutil.copyfile(image_file, temporary)
+            os.replace(temporary, self._path(key, extension))
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(temporary)
+        self.evict()
+
+    def evict(self):
+        """
 
-    :param tree: an ete3.Tree object
-    :param weights: Dictionary where keys are names of nodes/tips in the tree, and values are weights by which branch
-    lengths will be multiplied
-    :return: A new ete3.Tree where branch lengths have been modified.
-    """
-    newtree = copy.deepcopy(tree)
-    for node in weights:
-        # Make sure that we can actually find the node, and that more than one branch doesn't have the same name.
-        branch = newtree.get_leaves_by_name(node)
-        if len(branch) != 1:
-            raise AttributeError('The branch {} either could not be found in your tree or was found more than once. '
-                                 'Please verify your tree/weights dictionary and try again.'.format(node))
-        else:
-            branch[0].dist *= weights[node]
-    return newtree
+        Deletes the least recently used images until the cache is no bigger than max_bytes.
+        """
+        entries = list()
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    with contextlib.suppress(OSError):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.name, stat.st_size))
+        total = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(self.cache_dir, name))
+            total -= size
 
 
-def create_colored_tree_tip_image(tree_to_draw, representatives, output_file, color='red', mode='r', rotation=0):
+def create_colored_tree_tip_image(tree_to_draw, representatives, output_file, color='red', mode='r', rotation=0,
+                                  cache=None):
     """
 
     Given a list of representatives, shows (for now) a phylogeny that has those representatives highlighted in
@@ -212,8 +2377,16 @@ def create_colored_tree_tip_image(tree_to_draw, representatives, output_file, co
     http://etetoolkit.org/docs/latest/reference/reference_treeview.html#ete3.SVG_COLORS
     :param mode: method for tree drawing - options are r for rectangular or c for circular
     :param rotation: how much to rotate the tree (in a clockwise direction). Default is 0.
+    :param cache: If specified, an ImageCache. If the same image has been drawn before it gets copied from the cache
+    instead of drawn again, and new images get added to it.
     """
-    tree = copy.deepcopy(tree_to_draw)  # Don't want to actually modify original tree.
+    if cache is not None:
+        extension = os.path.splitext(output_file)[1]
+        key = ImageCache.key(tree_to_draw, representatives, color, mode, rotation, extension)
+        if cache.fetch(key, extension, output_file):
+            logging.debug('Reused cached image for {}'.format(output_file))
+            return
+    tree = copy_tree(tree_to_draw)  # Don't want to actually modify original tree.
     ts = TreeStyle()
     ts.mode = mode
     ts.show_leaf_name = False
@@ -231,15 +2404,152 @@ def create_colored_tree_tip_image(tree_to_draw, representatives, output_file, co
             name_face = TextFace(terminal_clade.name, fgcolor='black', fsize=8)
             terminal_clade.add_face(name_face, column=0)
 
-    tree.ladderize()
+    ladderize_tree(tree)
     tree.render(output_file, dpi=300, tree_style=ts)
+    if cache is not None:
+        cache.store(key, extension, output_file)
+
+
+def write_subtrees(tree, selections, output_prefix):
+    """
+
+    Writes the subtree connecting each set of picked strains to a newick file (see CompactTree.induced_subtree), and
+    a tab-separated summary of how much phylogenetic diversity each subtree has and what fraction of the whole tree's
+    branch length that is.
+
+    :param tree: An ete3.Tree object, or a CompactTree.
+    :param selections: Dictionary where keys are numbers of strains and values are lists of picked strain names, like
+    what run_strainchoosr returns.
+    :param output_prefix: Subtrees get written to output_prefix_<number>_strains.nwk, and the summary to
+    output_prefix_subtrees.tsv.
+    :return: List of (number of strains, newick file, phylogenetic diversity, fraction of total tree length) tuples.
+    """
+    compact = tree if isinstance(tree, CompactTree) else CompactTree(tree)
+    total_branch_length = compact.dist.sum()
+    results = list()
+    for number, strains in selections.items():
+        leaves = [compact.name_index[name] for name in strains]
+        newick_file = '{}_{}_strains.nwk'.format(output_prefix, number)
+        with open(newick_file, 'w') as f:
+            f.write(compact.induced_subtree(leaves) + '\n')
+        diversity = compact.phylogenetic_diversity(leaves)
+        fraction = diversity / total_branch_length if total_branch_length > 0 else 0.0
+        results.append((number, newick_file, float(diversity), float(fraction)))
+    with open('{}_subtrees.tsv'.format(output_prefix), 'w') as f:
+        f.write('Strains\tNewickFile\tPhylogeneticDiversity\tFractionOfTreeLength\n')
+        for result in results:
+            f.write('{}\t{}\t{}\t{}\n'.format(*result))
+    return results
+
+
+def write_clusters(table, output_file):
+    """
+
+    Writes the clusters from cut_clusters to a tab-separated file.
+
+    :param table: List of (leaf name, cluster number, representative name, distance) tuples from cut_clusters.
+    :param output_file: Path to write to.
+    """
+    with open(output_file, 'w') as f:
+        f.write('Strain\tCluster\tRepresentative\tDistance\n')
+        for row in table:
+            f.write('{}\t{}\t{}\t{}\n'.format(*row))
+
+
+def read_previous_selection(selection_file):
+    """
+
+    :param selection_file: Path to a file with one strain name per line, like the ones the StrainChoosr GUI saves.
+    Blank lines are ignored.
+    :return: List of strain names, in the order they were in the file.
+    """
+    with open(selection_file) as f:
+        return [line.strip() for line in f if line.strip() != '']
+
+
+def read_exclusions(entries):
+    """
+
+    :param entries: List where each entry is either a strain name, or the path to a file with one strain name per
+    line (blank lines are ignored).
+    :return: List of strain names.
+    """
+    names = list()
+    for entry in entries:
+        if os.path.isfile(entry):
+            with open(entry) as f:
+                names.extend(line.strip() for line in f if line.strip() != '')
+        else:
+            names.append(entry)
+    return names
+
+
+def read_clade_metadata(metadata_file, column=None):
+    """
+
+    Reads which clade (lineage, serotype and so on) each strain is in from a tab-separated metadata file with a header
+    row and strain names in the first column.
+
+    :param metadata_file: Path to the metadata file.
+    :param column: Name of the column with clades in it. Defaults to the second column.
+    :return: Dictionary with strain names as keys and clades as values. Strains with a blank clade are left out.
+    """
+    with open(metadata_file) as f:
+        header = f.readline().rstrip('\r\n').split('\t')
+        if column is None:
+            position = 1
+        elif column in header:
+            position = header.index(column)
+        else:
+            raise RuntimeError('Column {} is not in the header of your metadata file ({}). Columns are: {}'
+                               .format(column, metadata_file, ', '.join(header)))
+        if position >= len(header):
+            raise RuntimeError('Your metadata file ({}) needs at least two columns - strain names, then clades.'
+                               .format(metadata_file))
+        groups = dict()
+        for line in f:
+            x = line.rstrip('\r\n').split('\t')
+            if len(x) > position and x[position] != '':
+                groups[x[0]] = x[position]
+    return groups
+
+
+def read_clade_quotas(quota_file):
+    """
+
+    Reads limits on how many strains to pick from each clade from a tab-separated file with a clade name, the fewest
+    strains to pick from it and the most strains to pick from it on each line. Either number can be left blank for no
+    limit.
+
+    :param quota_file: Path to the quota file.
+    :return: Dictionary with clade names as keys and (minimum, maximum) tuples as values, with None for no limit.
+    """
+    quotas = dict()
+    with open(quota_file) as f:
+        for line in f:
+            stripped_line = line.rstrip('\r\n')
+            if stripped_line.strip() == '':
+                continue
+            x = stripped_line.split('\t')
+            if len(x) != 3:
+                raise RuntimeError('One of the lines in your quota file ({}) is not formatted correctly. Correct '
+                                   'format is clade\tminimum\tmaximum, tab-separated. Offending line was: {}'
+                                   .format(quota_file, stripped_line))
+            try:
+                quotas[x[0]] = tuple(None if value.strip() == '' else int(value) for value in x[1:])
+            except ValueError:
+                raise ValueError('The minimum and maximum in your quota file ({}) must be whole numbers. Please fix '
+                                 'the following line: {}'.format(quota_file, stripped_line))
+    return quotas
 
 
 def read_weights_file(weights_file):
     """
 
     Given a tab separated file with leaf names for a phylogenetic tree in column one and multipliers for that leaf's
-    branch length in column two, will create a dictionary with leaf names as keys and multipliers as values
+    branch length in column two, will create a dictionary with leaf names as keys and multipliers as values. Column one
+    can also be an internal node label, or leaf names separated by commas, to weight a whole clade (see
+    modify_tree_with_weights).
 
     :param weights_file: Path to a tab-separated text file described above.
     :return: dictionary with leaf names as keys and multipliers as values
@@ -264,14 +2574,666 @@ def read_weights_file(weights_file):
     return weights
 
 
+def _matrix_block_rows(number_columns, block_bytes=64 * 1024 * 1024):
+    # How many rows of a distance matrix fit in one block without going over block_bytes.
+    return max(1, block_bytes // (8 * max(number_columns, 1)))
+
+
+def read_distance_matrix(matrix_file, workdir, names_file=None):
+    """
+
+    Reads a square distance matrix, such as the ones made by Mash (mash dist -t) or ANI tools. Accepted formats:
+
+    - .npy files, which get memory mapped instead of read into memory. Names come from names_file (one per line, in
+      row order) - if there is no names_file, rows are named by number, starting at 0.
+    - PHYLIP: first line is the number of strains, then one line per strain with its name and distances.
+    - Tab-separated with a header line: first row has strain names after one label column, then each row has a
+      name followed by its distances.
+
+    Text matrices get streamed one row at a time into a .npy file in workdir, which is then memory mapped - so
+    even very large matrices never have to fit in memory.
+
+    :param matrix_file: Path to the distance matrix.
+    :param workdir: Directory where text matrices get converted to .npy.
+    :param names_file: Optional file with one strain name per line, for .npy matrices.
+    :return: Tuple of a list of strain names and a (memory mapped) numpy array of distances.
+    """
+    if matrix_file.endswith('.npy'):
+        matrix = np.load(matrix_file, mmap_mode='r')
+        if names_file is not None:
+            with open(names_file) as f:
+                names = [line.rstrip('\n') for line in f if line.strip() != '']
+        else:
+            names = [str(i) for i in range(matrix.shape[0])]
+    else:
+        matrix = None
+        names = list()
+        with open(matrix_file) as f:
+            header = f.readline().rstrip('\n')
+            phylip = header.strip().isdigit()
+            if phylip:
+                number_strains = int(header.strip())
+            else:
+                header_names = header.split('\t')[1:]
+                number_strains = len(header_names)
+            matrix = np.lib.format.open_memmap(os.path.join(workdir, 'distance_matrix.npy'), mode='w+',
+                                               dtype=np.float64, shape=(number_strains, number_strains))
+            for line in f:
+                if line.strip() == '':
+                    continue
+                if len(names) == number_strains:
+                    raise RuntimeError('Your distance matrix ({}) has more rows than strains. Offending line was: '
+                                       '{}'.format(matrix_file, line.rstrip()))
+                row = line.split() if phylip else line.rstrip('\n').split('\t')
+                if len(row) != number_strains + 1:
+                    raise RuntimeError('Every row in your distance matrix ({}) must have a strain name followed by '
+                                       '{} distances. Offending line was: {}'.format(matrix_file, number_strains,
+                                                                                     line.rstrip()))
+                try:
+                    matrix[len(names)] = [float(distance) for distance in row[1:]]
+                except ValueError:
+                    raise ValueError('Distances in your distance matrix ({}) must be numbers. Please fix the '
+                                     'following line: {}'.format(matrix_file, line.rstrip()))
+                names.append(row[0])
+            if len(names) != number_strains:
+                raise RuntimeError('Your distance matrix ({}) should have {} rows, but only {} were '
+                                   'found.'.format(matrix_file, number_strains, len(names)))
+            matrix.flush()
+    if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1] or matrix.shape[0] != len(names):
+        raise RuntimeError('Your distance matrix ({}) must be square, with one row for each strain '
+                           'name.'.format(matrix_file))
+    if len(set(names)) != len(names):
+        raise RuntimeError('Strain names in your distance matrix ({}) must be unique.'.format(matrix_file))
+    return names, matrix
+
+
+def neighbor_joining_tree(names, matrix, workdir):
+    """
+
+    Builds a neighbor-joining tree (Saitou & Nei 1987) from a distance matrix, so the regular tree-based selection can
+    be run on it. The matrix gets copied into a memory mapped working file in workdir and scanned in row blocks, so
+    memory use stays bounded. Time is still cubic in the number of strains - for very large matrices, consider
+    picking strains directly from the matrix with matrix_farthest_point_greedy instead.
+    Negative branch lengths get set to 0.
+
+    :param names: List of strain names, in matrix row order.
+    :param matrix: Square numpy array (or memmap) of distances.
+    :param workdir: Directory for the working copy of the matrix.
+    :return: An ete3.Tree object.
+    """
+    number_strains = len(names)
+    nodes = [ete3.Tree(name=name) for name in names]
+    if number_strains < 3:
+        tree = ete3.Tree()
+        for i in range(number_strains):
+            tree.add_child(nodes[i], dist=float(matrix[0, 1]) / 2 if number_strains == 2 else 0.0)
+        return tree
+    block_rows = _matrix_block_rows(number_strains)
+    work = np.lib.format.open_memmap(os.path.join(workdir, 'neighbor_joining.npy'), mode='w+',
+                                     dtype=np.float64, shape=(number_strains, number_strains))
+    row_sums = np.zeros(number_strains)
+    for start in range(0, number_strains, block_rows):
+        work[start:start + block_rows] = matrix[start:start + block_rows]
+        row_sums[start:start + block_rows] = work[start:start + block_rows].sum(axis=1)
+    active = np.ones(number_strains, dtype=bool)
+    remaining = number_strains
+    while remaining > 3:
+        active_rows = np.flatnonzero(active)
+        best = np.inf, -1, -1
+        for start in range(0, remaining, block_rows):
+            rows = active_rows[start:start + block_rows]
+            q = (remaining - 2) * work[rows][:, active_rows] - row_sums[rows][:, None] - row_sums[active_rows][None, :]
+            q[active_rows[None, :] <= rows[:, None]] = np.inf
+            position = np.argmin(q)
+            if q.flat[position] < best[0]:
+                best = q.flat[position], rows[position // remaining], active_rows[position % remaining]
+        _, i, j = best
+        distance = work[i, j]
+        length_i = 0.5 * distance + (row_sums[i] - row_sums[j]) / (2 * (remaining - 2))
+        length_i = min(max(length_i, 0.0), distance)
+        joined = ete3.Tree()
+        joined.add_child(nodes[i], dist=length_i)
+        joined.add_child(nodes[j], dist=distance - length_i)
+        new_row = 0.5 * (work[i, active_rows] + work[j, active_rows] - distance)
+        row_sums[active_rows] += new_row - work[i, active_rows] - work[j, active_rows]
+        work[i, active_rows] = new_row
+        work[active_rows, i] = new_row
+        work[i, i] = 0.0
+        active[j] = False
+        nodes[i] = joined
+        remaining -= 1
+        row_sums[i] = work[i, active].sum()
+    a, b, c = np.flatnonzero(active)
+    tree = ete3.Tree()
+    for node, one, two in ((a, b, c), (b, a, c), (c, a, b)):
+        length = 0.5 * (work[node, one] + work[node, two] - work[one, two])
+        tree.add_child(nodes[node], dist=max(float(length), 0.0))
+    del work
+    return tree
+
+
+def matrix_farthest_point_greedy(names, matrix, number_tips, starting_strains, objective='maxmin', exclude=()):
+    """
+
+    Farthest-point traversal (see farthest_point_greedy) straight on a distance matrix, no tree needed. Starting
+    strains follow find_starting_leaves: the first pair of strains (in row order) with the largest distance, or the
+    strain farthest from a single starting strain. The matrix only ever gets read a block of rows (to find the
+    starting pair) or a single row (for each pick) at a time.
+
+    :param names: List of strain names, in matrix row order.
+    :param matrix: Square numpy array (or memmap) of distances.
+    :param number_tips: Number of strains you want to pick out.
+    :param starting_strains: List of strain names that must be picked.
+    :param objective: maxmin or kcenter. For kcenter, picks get moved towards the middle of the strains they cover
+    with refine_centers.
+    :param exclude: Names of strains that can't be picked. They still count as strains that need a pick close by.
+    :return: List of row indices, in the order they were picked.
+    """
+    name_rank = np.argsort(np.argsort(np.array(names, dtype=object), kind='stable'), kind='stable')
+    row_of_name = {name: i for i, name in enumerate(names)}
+    try:
+        chosen = [row_of_name[name] for name in starting_strains]
+    except KeyError as e:
+        raise RuntimeError('One of the strains you specified could not be found in the distance matrix provided. '
+                           'Strain name was {}.'.format(e.args[0]))
+    number_strains = len(names)
+    excluded = np.zeros(number_strains, dtype=bool)
+    excluded[[row_of_name[name] for name in exclude if name in row_of_name]] = True
+    if len(chosen) == 0:
+        block_rows = _matrix_block_rows(number_strains)
+        best = 0, None
+        for start in range(0, number_strains, block_rows):
+            block = np.asarray(matrix[start:start + block_rows])
+            if excluded.any():
+                block = np.where(excluded[start:start + block_rows, None] | excluded[None, :], -np.inf, block)
+            position = np.argmax(block)
+            if block.flat[position] > best[0]:
+                best = block.flat[position], (start + position // number_strains, position % number_strains)
+        if best[1] is not None:
+            chosen.extend(int(x) for x in best[1])
+    elif len(chosen) == 1:
+        row = np.where(excluded, -np.inf, np.asarray(matrix[chosen[0]]))
+        if row.max() > 0:
+            chosen.append(int(np.argmax(row)))
+    # Excluded strains start out flagged as picked, so they're never candidates - they just don't count as picks.
+    picked = excluded.copy()
+    nearest = np.full(number_strains, np.inf)
+    for row in chosen:
+        nearest = np.minimum(nearest, matrix[row])
+        picked[row] = True
+    number_tips = min(number_tips, len(chosen) + np.count_nonzero(~picked))
+    while len(chosen) < number_tips:
+        logging.info('Working on strain {num}'.format(num=len(chosen) + 1))
+        candidates = np.flatnonzero(~picked)
+        tied = candidates[nearest[candidates] == nearest[candidates].max()]
+        next_row = int(tied[np.argmin(name_rank[tied])])
+        nearest = np.minimum(nearest, matrix[next_row])
+        picked[next_row] = True
+        chosen.append(next_row)
+    if objective == 'kcenter':
+        chosen = refine_centers(chosen, {row_of_name[name] for name in starting_strains},
+                                lambda row: np.asarray(matrix[row]), name_rank, exclude=excluded)
+    return chosen
+
+
+def matrix_coverage_by_prefix(names, matrix, representatives):
+    """
+
+    coverage_by_prefix for a distance matrix - reads one row of the matrix per representative.
+
+    :param names: List of strain names, in matrix row order.
+    :param matrix: Square numpy array (or memmap) of distances.
+    :param representatives: List of row indices, in the order they were picked.
+    :return: Tuple of a list of coverage radii (entry i is the radius when the first i + 1 strains are picked), and a
+    list of (strain name, representative name, distance) tuples for every strain.
+    """
+    nearest = np.full(len(names), -1, dtype=np.int64)
+    distance = np.full(len(names), np.inf)
+    radii = list()
+    for representative in representatives:
+        row = np.asarray(matrix[representative])
+        closer = row < distance
+        nearest[closer] = representative
+        distance[closer] = row[closer]
+        radii.append(float(distance.max()))
+    assignments = [(name, names[nearest[i]], float(distance[i])) for i, name in enumerate(names)]
+    return radii, assignments
+
+
+def read_tree_text(treefile):
+    """
+
+    Reads a treefile into a string, decompressing it on the fly if it's gzip, bzip2 or xz compressed (worked out from
+    the first few bytes of the file, not the extension). Nothing gets written to disk, but the whole decompressed text
+    does end up in memory, since ete3 parses trees from a string.
+
+    :param treefile: Path to a treefile.
+    :return: Contents of the file, as a string.
+    """
+    with open(treefile, 'rb') as f:
+        magic = f.read(6)
+    if magic.startswith(b'\x1f\x8b'):
+        opener = gzip.open
+    elif magic.startswith(b'BZh'):
+        opener = bz2.open
+    elif magic.startswith(b'\xfd7zXZ\x00'):
+        opener = lzma.open
+    else:
+        opener = open
+    with opener(treefile, 'rt') as f:
+        return f.read()
+
+
+def _parse_newick(newick):
+    # ete3 doesn't like some trees at first, so fall back to quoted node names/internal node names.
+    try:
+        tree = ete3.Tree(newick=newick)
+    except NewickError:
+        tree = ete3.Tree(newick=newick,
+                         quoted_node_names=True, format=1)
+    return tree
+
+
+def _nexus_trees(text):
+    # Comments (including BEAST annotations like [&rate=0.1]) can show up anywhere, so they go first.
+    text = re.sub(r'\[[^\]]*\]', '', text)
+    trees_block = re.search(r'begin\s+trees\s*;(.*?)\bend\s*;', text, flags=re.IGNORECASE | re.DOTALL)
+    if trees_block is None:
+        raise RuntimeError('Could not find a trees block in your NEXUS file.')
+    translate = dict()
+    trees = list()
+    for statement in trees_block.group(1).split(';'):
+        statement = statement.strip()
+        keyword = statement.split(None, 1)[0].lower() if statement else ''
+        if keyword == 'translate':
+            for entry in statement.split(None, 1)[1].split(','):
+                key, name = entry.split(None, 1)
+                translate[key] = name.strip().strip('\'"')
+        elif keyword in ('tree', 'utree'):
+            trees.append(_parse_newick(statement.split('=', 1)[1].strip() + ';'))
+    for tree in trees:
+        for leaf in tree.iter_leaves():
+            leaf.name = translate.get(leaf.name, leaf.name)
+    return trees
+
+
+def _phyloxml_trees(text):
+    def local_name(element):
+        return element.tag.rsplit('}', 1)[-1]
+
+    def child(element, name):
+        for sub_element in element:
+            if local_name(sub_element) == name:
+                return sub_element
+        return None
+
+    trees = list()
+    for phylogeny in ElementTree.fromstring(text).iter():
+        if local_name(phylogeny) != 'phylogeny':
+            continue
+        root_clade = child(phylogeny, 'clade')
+        if root_clade is None:
+            continue
+        tree = ete3.Tree()
+        # Walked with a stack rather than recursively, so very deep trees are fine.
+        stack = [(root_clade, tree)]
+        while stack:
+            clade, node = stack.pop()
+            name = child(clade, 'name')
+            taxonomy = child(clade, 'taxonomy')
+            if name is None and taxonomy is not None:
+                name = child(taxonomy, 'scientific_name')
+            if name is not None and name.text:
+                node.name = name.text.strip()
+            branch_length = clade.get('branch_length')
+            if branch_length is None and child(clade, 'branch_length') is not None:
+                branch_length = child(clade, 'branch_length').text
+            if branch_length is not None and node is not tree:
+                node.dist = float(branch_length)
+            for sub_clade in reversed([sub_element for sub_element in clade if local_name(sub_element) == 'clade']):
+                stack.append((sub_clade, node.add_child()))
+        # Children got added in reverse, so flip them back to file order.
+        for node in tree.traverse():
+            node.children.reverse()
+        trees.append(tree)
+    return trees
+
+
+def parse_trees(text):
+    """
+
+    Parses every tree in a string, working out whether it's newick, NEXUS (like from BEAST or MrBayes, with or without
+    a translate table) or PhyloXML from what it starts with.
+
+    :param text: Contents of a treefile.
+    :return: List of ete3.Tree objects.
+    """
+    stripped = text.lstrip()
+    if stripped[:6].upper() == '#NEXUS':
+        trees = _nexus_trees(stripped)
+    elif stripped.startswith('<'):
+        trees = _phyloxml_trees(stripped)
+    else:
+        trees = [_parse_newick(newick.strip() + ';') for newick in stripped.split(';') if newick.strip() != '']
+    if len(trees) == 0:
+        raise RuntimeError('Could not find any trees in your treefile.')
+    return trees
+
+
+def load_tree(newick):
+    """
+
+    Reads a tree with ete3, falling back to quoted node names/internal node names if ete3 doesn't like it at first.
+    Treefiles can be newick, NEXUS or PhyloXML, and can be gzip, bzip2 or xz compressed - see read_tree_text and
+    parse_trees. If a file has more than one tree in it, the first one is used.
+
+    :param newick: Path to a treefile, or a newick string.
+    :return: An ete3.Tree object
+    """
+    if not os.path.isfile(newick):
+        return _parse_newick(newick)
+    text = read_tree_text(newick)
+    if text.lstrip()[:1] in ('#', '<'):
+        return parse_trees(text)[0]
+    # Plain newick gets handed straight to ete3, since splitting it up into trees is a waste for one big tree.
+    return _parse_newick(text)
+
+
+def read_trees(treefile):
+    """
+
+    Reads every tree in a file that has one or more trees in it (like the bootstrap trees from RAxML/IQ-TREE, or
+    trees sampled from a posterior by BEAST or MrBayes). Same formats as load_tree.
+
+    :param treefile: Path to the multi-tree file.
+    :return: List of ete3.Tree objects.
+    """
+    return parse_trees(read_tree_text(treefile))
+
+
+def read_strain_sets(sets_file):
+    """
+
+    Reads a tab-separated file of strain sets to score - each line has a name for the set in column one, followed by
+    the names of the strains in the set, one per column.
+
+    :param sets_file: Path to the strain sets file.
+    :return: List of (set name, list of strain names) tuples, in file order.
+    """
+    strain_sets = list()
+    with open(sets_file) as f:
+        for line in f:
+            stripped_line = line.rstrip()
+            if stripped_line == '':
+                continue
+            x = stripped_line.split('\t')
+            if len(x) < 2:
+                raise RuntimeError('One of the lines in your strain sets file ({}) is not formatted correctly. '
+                                   'Correct format is setname\tstrain1\tstrain2..., tab-separated. '
+                                   'Offending line was: {}'.format(sets_file, stripped_line))
+            strain_sets.append((x[0], x[1:]))
+    return strain_sets
+
+
+def evaluate_strain_sets(treefile, sets_file, output_file=None, weight_file=None):
+    """
+
+    Scores strain sets (hand-picked, or from other tools) against a tree. For each set, reports the phylogenetic
+    diversity and what fraction of the tree's total branch length that is.
+
+    :param treefile: Path to a newick-formatted treefile.
+    :param sets_file: Path to a strain sets file (see read_strain_sets).
+    :param output_file: If specified, results get written here as a tab-separated file. Otherwise they are printed.
+    :param weight_file: If specified, path to a weights file used to modify branch lengths first.
+    :return: List of (set name, number of strains, phylogenetic diversity, fraction of total tree length) tuples.
+    """
+    tree = load_tree(treefile)
+    if weight_file is not None:
+        tree = modify_tree_with_weights(tree, read_weights_file(weight_file))
+    compact = CompactTree(tree)
+    strain_sets = read_strain_sets(sets_file)
+    diversities = phylogenetic_diversity(compact, [strain_set for _, strain_set in strain_sets])
+    total_branch_length = compact.dist.sum()
+    results = list()
+    for (set_name, strain_set), diversity in zip(strain_sets, diversities):
+        fraction = diversity / total_branch_length if total_branch_length > 0 else 0.0
+        results.append((set_name, len(set(strain_set)), float(diversity), float(fraction)))
+    lines = ['Set\tStrains\tPhylogeneticDiversity\tFractionOfTreeLength']
+    for result in results:
+        lines.append('{}\t{}\t{}\t{}'.format(*result))
+    if output_file is not None:
+        with open(output_file, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    else:
+        for line in lines:
+            print(line)
+    return results
+
+
+def weight_targets(compact, weights):
+    """
+
+    Finds the node each key of a weights dictionary refers to - a leaf name, two or more leaf names separated by commas
+    (their most recent common ancestor), or an internal node label, checked in that order. Common ancestors all get
+    looked up together.
+
+    :param compact: A CompactTree.
+    :param weights: Dictionary of weights (see read_weights_file).
+    :return: Tuple of a numpy array of node indices and a numpy array of their weights.
+    """
+    nodes_by_name = dict()
+    for node in np.flatnonzero(~compact.is_leaf).tolist():
+        if compact.names[node]:
+            nodes_by_name.setdefault(compact.names[node], list()).append(node)
+    leaves_by_name = dict()
+    for leaf, leaf_name in zip(compact.leaves.tolist(), compact.leaf_names):
+        leaves_by_name.setdefault(leaf_name, list()).append(leaf)
+    nodes = np.zeros(len(weights), dtype=np.int64)
+    values = np.zeros(len(weights))
+    first, last, pairs = list(), list(), list()
+    for k, (name, weight) in enumerate(weights.items()):
+        values[k] = weight
+        if name not in leaves_by_name and ',' in name:
+            tips = list()
+            for tip in name.split(','):
+                tip_nodes = leaves_by_name.get(tip.strip(), list())
+                if len(tip_nodes) != 1:
+                    raise AttributeError('The leaf {} (from clade {}) either could not be found in your tree or was '
+                                         'found more than once. Please verify your tree/weights dictionary and try '
+                                         'again.'.format(tip.strip(), name))
+                tips.append(tip_nodes[0])
+            # The common ancestor of the first and last leaves in preorder is the common ancestor of all of them.
+            first.append(min(tips))
+            last.append(max(tips))
+            pairs.append(k)
+            continue
+        branch = leaves_by_name.get(name, nodes_by_name.get(name, list()))
+        if len(branch) != 1:
+            raise AttributeError('The branch {} either could not be found in your tree or was found more than once. '
+                                 'Please verify your tree/weights dictionary and try again.'.format(name))
+        nodes[k] = branch[0]
+    if pairs:
+        nodes[pairs] = compact.lowest_common_ancestors(first, last)
+    return nodes, values
+
+
+def weighted_branch_lengths(compact, weights):
+    """
+
+    Same thing as modify_tree_with_weights, but as a new branch length array for a CompactTree instead of a new tree,
+    so trying out lots of weightings doesn't mean copying the tree for each one.
+
+    :param compact: A CompactTree.
+    :param weights: Dictionary where keys are leaf names, internal node labels or comma-separated leaf names, and
+    values are weights by which branch lengths will be multiplied (see read_weights_file).
+    :return: numpy array of branch lengths, in preorder.
+    """
+    nodes, values = weight_targets(compact, weights)
+    return compact.scale_subtrees(nodes, values)
+
+
+# The tree being swept, as set up in each worker process by _init_sweep_worker.
+_sweep_trees = dict()
+
+
+def _init_sweep_worker(weighted_trees):
+    _sweep_trees.clear()
+    _sweep_trees['weighted'] = weighted_trees
+
+
+def _pick_scenario(job):
+    weighting, starting_leaves, number_tips = job
+    return compact_pd_greedy(_sweep_trees['weighted'][weighting], number_tips, starting_leaves)
+
+
+def sweep_scenarios(tree, weightings, starting_sets, numbers, threads=1):
+    """
+
+    Picks strains for every combination of weighting, starting set and number of strains, to see how much the choice
+    of weights or starting strains changes a panel. The tree gets parsed and indexed once - each weighting is just a
+    different branch length array on the same CompactTree - and each weighting/starting set combination only gets
+    picked once, for the biggest number wanted, since smaller panels are the first few picks of bigger ones.
+
+    :param tree: An ete3.Tree object, or a CompactTree.
+    :param weightings: List of (name, weights dictionary) tuples. Use an empty dictionary for no weighting.
+    :param starting_sets: List of (name, list of strain names) tuples. Use an empty list to have starting strains
+    chosen automatically.
+    :param numbers: List of numbers of strains to pick.
+    :param threads: Number of processes to use. With 1, everything runs in this process.
+    :return: List of dictionaries, one per scenario and number of strains, with the scenario name, weighting name,
+    starting set name, number of strains, strains picked, their phylogenetic diversity (on the weighted tree) and
+    what fraction of the weighted tree's total branch length that is, and an overlap dictionary with how many strains
+    each other scenario with the same number of strains has in common with this one.
+    """
+    compact = tree if isinstance(tree, CompactTree) else CompactTree(tree)
+    # Only branch lengths change between weightings, so the preorder blocks and name ranks get reused.
+    weighted_trees = [CompactTree.from_arrays(compact.parent, weighted_branch_lengths(compact, weights), compact.names,
+                                              end=compact.end, name_rank=compact.name_rank)
+                      for _, weights in weightings]
+    jobs = list()
+    scenarios = list()
+    for weighting in range(len(weightings)):
+        for starting_name, strain_set in starting_sets:
+            try:
+                starting_leaves = [compact.name_index[name] for name in strain_set]
+            except KeyError as e:
+                raise RuntimeError('One of the leaves you specified could not be found in the treefile provided. '
+                                   'Leaf name was {}. Please check that your treefile contains that '
+                                   'leaf.'.format(e.args[0]))
+            jobs.append((weighting, starting_leaves, max(numbers)))
+            scenarios.append((weightings[weighting][0], starting_name))
+    logging.info('Sweeping {} scenarios.'.format(len(jobs)))
+    initargs = (weighted_trees,)
+    if threads > 1:
+        with multiprocessing.Pool(threads, initializer=_init_sweep_worker, initargs=initargs) as pool:
+            scenario_picks = pool.map(_pick_scenario, jobs)
+    else:
+        _init_sweep_worker(*initargs)
+        try:
+            scenario_picks = list(map(_pick_scenario, jobs))
+        finally:
+            _sweep_trees.clear()
+    results = list()
+    for (weighting, starting_leaves, _), (weighting_name, starting_name), picks in zip(jobs, scenarios,
+                                                                                       scenario_picks):
+        weighted = weighted_trees[weighting]
+        strain_sets = [[compact.names[leaf] for leaf in picks[:max(number, len(starting_leaves))]]
+                       for number in numbers]
+        diversities = phylogenetic_diversity(weighted, strain_sets)
+        total_branch_length = weighted.dist.sum()
+        for number, strains, diversity in zip(numbers, strain_sets, diversities):
+            results.append({'scenario': '{}/{}'.format(weighting_name, starting_name),
+                            'weighting': weighting_name,
+                            'starting_set': starting_name,
+                            'number': number,
+                            'strains': strains,
+                            'phylogenetic_diversity': float(diversity),
+                            'fraction': float(diversity / total_branch_length) if total_branch_length > 0 else 0.0})
+    for result in results:
+        result['overlap'] = {other['scenario']: len(set(result['strains']).intersection(other['strains']))
+                             for other in results if other['number'] == result['number']}
+    return results
+
+
+def run_sweep(treefile, numbers, weight_files=None, starting_sets_file=None, output_file=None, threads=1):
+    """
+
+    Runs sweep_scenarios from files and writes out a comparison table. An unweighted tree and automatically chosen
+    starting strains are always included, so every other scenario can be compared against them.
+
+    :param treefile: Path to a newick-formatted treefile.
+    :param numbers: List of numbers of strains to pick.
+    :param weight_files: List of paths to weights files (see read_weights_file). Each one is a weighting, named after
+    the file.
+    :param starting_sets_file: Path to a strain sets file (see read_strain_sets) with starting sets to try.
+    :param output_file: If specified, the table gets written here as a tab-separated file. Otherwise it's printed.
+    :param threads: Number of processes to use.
+    :return: List of results from sweep_scenarios.
+    """
+    tree = load_tree(treefile)
+    weightings = [('unweighted', dict())]
+    for weight_file in weight_files or list():
+        weightings.append((os.path.basename(weight_file), read_weights_file(weight_file)))
+    starting_sets = [('automatic', list())]
+    if starting_sets_file is not None:
+        starting_sets.extend(read_strain_sets(starting_sets_file))
+    results = sweep_scenarios(tree, weightings, starting_sets, sorted(set(numbers)), threads=threads)
+    scenarios = list(dict.fromkeys(result['scenario'] for result in results))
+    lines = ['\t'.join(['Scenario', 'Weighting', 'StartingSet', 'Strains', 'PhylogeneticDiversity',
+                        'FractionOfTreeLength'] + ['Overlap:{}'.format(scenario) for scenario in scenarios] +
+                       ['Picked'])]
+    for result in results:
+        lines.append('\t'.join([result['scenario'], result['weighting'], result['starting_set'],
+                                str(result['number']), str(result['phylogenetic_diversity']),
+                                str(result['fraction'])] +
+                               [str(result['overlap'][scenario]) for scenario in scenarios] +
+                               [','.join(result['strains'])]))
+    if output_file is not None:
+        with open(output_file, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    else:
+        for line in lines:
+            print(line)
+    return results
+
+
 class CompletedStrainChoosr:
-    def __init__(self, representatives, image, name):
+    __slots__ = ('representatives', 'image', 'name', 'coverage_radii', 'assignments', 'selection_frequencies')
+
+    def __init__(self, representatives, image, name, coverage_radii=None, assignments=None,
+                 selection_frequencies=None):
         self.representatives = representatives
         self.image = image
         self.name = name
+        self.coverage_radii = coverage_radii
+        self.assignments = assignments
+        self.selection_frequencies = selection_frequencies
 
 
-def generate_html_report(completed_choosr_list, output_report):
+class StrainChoosrResult(CompletedStrainChoosr):
+    """
+
+    What choose gives back for one number of strains. Works anywhere a CompletedStrainChoosr does (like
+    generate_html_report), with a bit more detail about how the picks were made.
+
+    :param representatives: List of strain names, in the order they were picked.
+    :param gains: List with how much phylogenetic diversity each pick added.
+    :param pd_totals: List with the total phylogenetic diversity after each pick.
+    :param timings: Dictionary with the seconds each stage took (shared by every result from the same call).
+    :param name: Name for the result, used as its tab in the HTML report.
+    """
+    __slots__ = ('gains', 'pd_totals', 'timings')
+
+    def __init__(self, representatives, gains, pd_totals, timings, name, image=None, coverage_radii=None,
+                 assignments=None):
+        super().__init__(representatives=representatives, image=image, name=name, coverage_radii=coverage_radii,
+                         assignments=assignments)
+        self.gains = gains
+        self.pd_totals = pd_totals
+        self.timings = timings
+
+
+def generate_html_report(completed_choosr_list, output_report, assignment_rows=200):
     """
 
     Generates a nice(ish) looking HTML report detailing StrainChoosr output.
@@ -279,6 +3241,9 @@ def generate_html_report(completed_choosr_list, output_report):
     :param completed_choosr_list: List of CompletedChoosr objects - each of these has a list of leaf names, path to an
     image file, and a name
     :param output_report: filename to write HTML report. Will overwrite a report that already exists.
+    :param assignment_rows: Most strains to list in each closest chosen strain table - the ones farthest from a chosen
+    strain get listed, so the table doesn't grow with the size of the tree. 0 leaves the tables out, None lists every
+    strain.
     """
     # With tabs as shown in w3schools: https://www.w3schools.com/howto/howto_js_tabs.asp
     style = """
@@ -361,12 +3326,39 @@ def generate_html_report(completed_choosr_list, output_report):
     for completed_choosr in completed_choosr_list:
         html_content.append('<div id="{name}" class="tabcontent">'.format(name=completed_choosr.name))
         html_content.append('<h4>{}</h4><br>'.format(completed_choosr.name))
-        with open(completed_choosr.image, 'rb') as image_file:
-            base64_string = base64.b64encode(image_file.read()).decode('utf-8')
-        html_content.append('<img src="data:image/png;base64,{}">'.format(base64_string))
+        if completed_choosr.image is not None:
+            with open(completed_choosr.image, 'rb') as image_file:
+                base64_string = base64.b64encode(image_file.read()).decode('utf-8')
+            html_content.append('<img src="data:image/png;base64,{}">'.format(base64_string))
         html_content.append('<br><h4>Chosen Strains</h4>')
         for strain in completed_choosr.representatives:
             html_content.append('<p>{}</p>'.format(strain))
+        if completed_choosr.coverage_radii is not None:
+            html_content.append('<br><h4>Coverage Radius</h4>')
+            html_content.append('<table><tr><th>Strains Picked</th><th>Farthest Strain From A Pick</th></tr>')
+            for number_picked, radius in enumerate(completed_choosr.coverage_radii, start=1):
+                html_content.append('<tr><td>{}</td><td>{}</td></tr>'.format(number_picked, radius))
+            html_content.append('</table>')
+        if completed_choosr.selection_frequencies is not None:
+            html_content.append('<br><h4>Selection Frequency Across Replicate Trees</h4>')
+            html_content.append('<table><tr><th>Strain</th><th>Fraction Of Replicates</th></tr>')
+            for strain in sorted(completed_choosr.selection_frequencies,
+                                 key=lambda x: (-completed_choosr.selection_frequencies[x], x)):
+                html_content.append('<tr><td>{}</td><td>{:.3f}</td></tr>'
+                                    .format(strain, completed_choosr.selection_frequencies[strain]))
+            html_content.append('</table>')
+        if completed_choosr.assignments is not None and assignment_rows != 0:
+            assignments = completed_choosr.assignments
+            html_content.append('<br><h4>Closest Chosen Strain</h4>')
+            if assignment_rows is not None and len(assignments) > assignment_rows:
+                assignments = sorted(assignments, key=lambda row: row[2], reverse=True)[:assignment_rows]
+                html_content.append('<p>Showing the {} strains farthest from a chosen strain, out of {}.</p>'
+                                    .format(assignment_rows, len(completed_choosr.assignments)))
+            html_content.append('<table><tr><th>Strain</th><th>Chosen Strain</th><th>Distance</th></tr>')
+            for strain, representative, distance in assignments:
+                html_content.append('<tr><td>{}</td><td>{}</td><td>{}</td></tr>'
+                                    .format(strain, representative, distance))
+            html_content.append('</table>')
         html_content.append('</div>')
 
     html_content.append(javascript)
@@ -376,20 +3368,240 @@ def generate_html_report(completed_choosr_list, output_report):
         f.write(html_string)
 
 
+def choose(tree, numbers, starting_strains=None, weights=None, exclude=(), engine='fast', collapse_threshold=None,
+           coverage=False, cancel=None):
+    """
+
+    Picks strains for maximum phylogenetic diversity like run_strainchoosr, without any of the side effects - nothing
+    gets printed, no logging gets set up, and no files get written. Unlike run_strainchoosr, this uses the fast engine
+    unless asked for the reference one, so picks can differ from a run_strainchoosr call with its default engine where
+    strains tie to within rounding error. Strains are picked once for the biggest number wanted, and smaller numbers
+    get the first few picks. Images and reports are separate steps (see render_results and
+    generate_html_report), so this is cheap enough to call over and over from a long-running program.
+
+    :param tree: An ete3.Tree object, or a path to a newick treefile (or a newick string).
+    :param numbers: Number of strains wanted, or a list of them.
+    :param starting_strains: List of names of strains that must be picked.
+    :param weights: Dictionary of weights (see read_weights_file), or a path to a weights file.
+    :param exclude: Names of strains that can't be picked.
+    :param engine: reference or fast - see pd_greedy. Defaults to fast. Pass reference to get exactly what
+    run_strainchoosr picks by default.
+    :param collapse_threshold: If specified, collapse clusters of near-identical strains first (see
+    collapsed_pd_greedy).
+    :param coverage: If True, also work out coverage radii and which pick each strain is closest to.
+    :param cancel: If specified, a cancel event - see pd_greedy.
+    :return: List of StrainChoosrResult objects, one for each number in numbers, in the same order.
+    """
+    if isinstance(numbers, int):
+        numbers = [numbers]
+    timings = dict()
+    start = time.perf_counter()
+    if not isinstance(tree, ete3.TreeNode):
+        tree = load_tree(tree)
+    timings['parse'] = time.perf_counter() - start
+    if weights is not None:
+        start = time.perf_counter()
+        if not isinstance(weights, dict):
+            weights = read_weights_file(weights)
+        tree = modify_tree_with_weights(tree, weights)
+        timings['weighting'] = time.perf_counter() - start
+    start = time.perf_counter()
+    exclude = set(exclude)
+    leaf_count = len([name for name in tree.get_leaf_names() if name not in exclude])
+    if max(numbers) > leaf_count:
+        raise ValueError('You requested that {} strains be selected, but your tree only has {} leaves that can be '
+                         'picked.'.format(max(numbers), leaf_count))
+    starting_nodes = get_leaf_nodes_from_names(tree, starting_strains or list())
+    picks = [node for node in pd_greedy(tree, max(numbers), starting_nodes, engine=engine,
+                                        collapse_threshold=collapse_threshold, exclude=exclude, cancel=cancel)
+             if node is not None]
+    timings['selection'] = time.perf_counter() - start
+    compact = CompactTree(tree)
+    marked = np.zeros(len(compact.parent), dtype=bool)
+    common_ancestor = None
+    gains = list()
+    pd_totals = list()
+    for node in picks:
+        leaf = compact.index(node)
+        gains.append(compact.gain(marked, leaf, common_ancestor))
+        pd_totals.append(gains[-1] + (pd_totals[-1] if pd_totals else 0.0))
+        common_ancestor = compact.add_to_spanning_tree(marked, leaf, common_ancestor)
+    results = list()
+    for number in numbers:
+        # Like pd_greedy, starting strains are always kept even if there are more of them than number.
+        number_picked = max(number, len(starting_nodes))
+        result = StrainChoosrResult(representatives=get_leaf_names_from_nodes(picks[:number_picked]),
+                                    gains=gains[:number_picked],
+                                    pd_totals=pd_totals[:number_picked],
+                                    timings=timings,
+                                    name='{} Strains'.format(number))
+        if coverage:
+            start = time.perf_counter()
+            result.coverage_radii, result.assignments = coverage_by_prefix(tree, picks[:number_picked])
+            timings['coverage'] = timings.get('coverage', 0.0) + time.perf_counter() - start
+        results.append(result)
+    return results
+
+
+def render_results(tree, results, output_dir, mode='r', color='red', cache=None):
+    """
+
+    Draws an image for each result from choose, with picked strains highlighted, and sets each result's image to it.
+
+    :param tree: The ete3.Tree object (or path to a treefile) the results were picked from.
+    :param results: List of results from choose.
+    :param output_dir: Directory to put images in. Gets created if it doesn't exist.
+    :param mode: r for rectangular or c for circular.
+    :param color: Color to highlight picked strains with.
+    :param cache: If specified, an ImageCache to reuse images from - see create_colored_tree_tip_image.
+    :return: List of paths to the images.
+    """
+    if not isinstance(tree, ete3.TreeNode):
+        tree = load_tree(tree)
+    os.makedirs(output_dir, exist_ok=True)
+    images = list()
+    for result in results:
+        result.image = os.path.join(output_dir, 'strains_{}.png'.format(len(result.representatives)))
+        create_colored_tree_tip_image(tree_to_draw=tree,
+                                      output_file=result.image,
+                                      representatives=result.representatives,
+                                      mode=mode,
+                                      color=color,
+                                      cache=cache)
+        images.append(result.image)
+    return images
+
+
+class StageProfiler:
+    """
+
+    Records how long each stage of a StrainChoosr run takes, so slow runs can be tracked down and regressions between
+    versions spotted. For every stage, wall and CPU time, the peak memory python allocated while it ran (from
+    tracemalloc), the peak resident set size of the process so far and any counters (leaves evaluated, tree copies,
+    bytes of images and so on) get recorded. A stage that runs more than once (like selection, which runs once per
+    number of strains asked for) has its times and counters added up. When not enabled, stages cost next to nothing.
+
+    :param enabled: Whether to record anything at all.
+    :param cprofile_dir: If specified, a cProfile dump for every stage gets written to this directory as
+    <stage>.prof, which can be looked at with pstats or snakeviz.
+    """
+    def __init__(self, enabled=False, cprofile_dir=None):
+        self.enabled = enabled
+        self.cprofile_dir = cprofile_dir
+        self.stages = dict()
+        self.profiles = dict()
+        self.current_stage = None
+        self.start_time = time.perf_counter()
+
+    def _stage_record(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'calls': 0,
+                                 'wall_seconds': 0.0,
+                                 'cpu_seconds': 0.0,
+                                 'peak_traced_bytes': 0,
+                                 'max_rss_bytes': None,
+                                 'counters': dict()}
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+
+        Context manager that times everything run inside it as stage name.
+        """
+        if not self.enabled:
+            yield
+            return
+        record = self._stage_record(name)
+        self.current_stage = name
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        profile = None
+        if self.cprofile_dir is not None:
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+            profile.enable()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            record['wall_seconds'] += time.perf_counter() - wall_start
+            record['cpu_seconds'] += time.process_time() - cpu_start
+            if profile is not None:
+                profile.disable()
+            record['peak_traced_bytes'] = max(record['peak_traced_bytes'], tracemalloc.get_traced_memory()[1])
+            if started_tracing:
+                tracemalloc.stop()
+            if resource is not None:
+                # ru_maxrss is in kilobytes on Linux, but bytes on macOS.
+                max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                record['max_rss_bytes'] = max_rss if sys.platform == 'darwin' else max_rss * 1024
+            record['calls'] += 1
+            self.current_stage = None
+
+    def count(self, counter, amount=1):
+        """
+
+        Adds amount to a counter for the stage that's currently running.
+        """
+        if not self.enabled or self.current_stage is None:
+            return
+        counters = self._stage_record(self.current_stage)['counters']
+        counters[counter] = counters.get(counter, 0) + amount
+
+    def to_dict(self):
+        """
+
+        :return: Dictionary with the StrainChoosr version, total wall time, and a record for every stage.
+        """
+        return {'version': get_version(),
+                'total_wall_seconds': time.perf_counter() - self.start_time,
+                'stages': self.stages}
+
+    def write(self, output_file):
+        """
+
+        Writes everything recorded to output_file as JSON, and cProfile dumps if those were asked for.
+        """
+        with open(output_file, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        if self.cprofile_dir is not None:
+            os.makedirs(self.cprofile_dir, exist_ok=True)
+            for name, profile in self.profiles.items():
+                profile.dump_stats(os.path.join(self.cprofile_dir, '{}.prof'.format(name)))
+
+
 def argument_parsing(args):
     parser = argparse.ArgumentParser(description='StrainChoosr uses the greedy algorithm described in Pardi 2005/Steel '
                                                  '2005 to find the most diverse subset of strains from a phylogenetic '
-                                                 'tree.')
-    parser.add_argument('-t', '--treefile',
+                                                 'tree.',
+                                     epilog='To score strain sets you already have, use strainchoosr evaluate '
+                                            '(see strainchoosr evaluate -h).')
+    tree_input = parser.add_mutually_exclusive_group(required=True)
+    tree_input.add_argument('-t', '--treefile',
+                            type=str,
+                            help='Path to treefile - newick, NEXUS or PhyloXML, optionally gzip, bzip2 or xz '
+                                 'compressed.')
+    tree_input.add_argument('--distance_matrix',
+                            type=str,
+                            help='Path to a square distance matrix (from Mash, ANI tools, etc.) to use instead of a '
+                                 'tree. Can be PHYLIP, tab-separated with a header row of strain names, or a .npy '
+                                 'file. With --objective pd, a neighbor-joining tree gets built from the matrix. With '
+                                 'maxmin or kcenter, strains get picked straight from the matrix.')
+    parser.add_argument('--matrix_names',
                         type=str,
-                        required=True,
-                        help='Path to treefile, in newick format.')
+                        help='File with one strain name per line, in row order, for a .npy distance matrix. If not '
+                             'given, rows are named by number.')
     parser.add_argument('-n', '--number',
                         type=int,
                         nargs='+',
-                        required=True,
                         help='Number of representatives wanted. More than one can be specified, separated by '
-                             'spaces.')
+                             'spaces. Required unless --pd_fraction, --min_gain, --budget or --cut_distance is '
+                             'given. With --pd_fraction or --min_gain, it caps how many strains get picked. With '
+                             '--previous_selection, this is the number of new strains to add.')
     parser.add_argument('-o', '--output_name',
                         default='strainchoosr_output',
                         type=str,
@@ -403,12 +3615,157 @@ def argument_parsing(args):
                         required=False,
                         help='Path to file specifying weights for leaves in tree. File must be tab-separated, with '
                              'leaf names in the first column and weights in the second. Leaves not listed will be '
-                             'assigned a weight of 1.')
+                             'assigned a weight of 1. To weight a whole clade, give an internal node label or two '
+                             'leaf names separated by a comma (their common ancestor) instead of a leaf name.')
     parser.add_argument('--starting_strains',
                         default=list(),
                         nargs='+',
                         help='Names of strains that must be included in your set of diverse strains, separated by '
                              'spaces.')
+    parser.add_argument('--objective',
+                        default='pd',
+                        choices=['pd', 'maxmin', 'kcenter'],
+                        help='What picked strains should be diverse in terms of. pd (the default) maximizes total '
+                             'phylogenetic diversity using the greedy algorithm. maxmin tries to make the closest two '
+                             'picked strains as far apart as possible, and kcenter tries to make every strain as close '
+                             'as possible to a picked strain - both use farthest-point traversal.')
+    parser.add_argument('--engine',
+                        choices=['reference', 'fast'],
+                        help='Implementation of the greedy algorithm to use. reference (the default) is the original '
+                             'one, which prunes a copy of the tree for every leaf it tries. fast works out every '
+                             'leaf at once and is much quicker on big trees - it picks the same strains, except '
+                             'where strains tie to within rounding error. Defaults to fast with '
+                             '--previous_selection, or for trees more than {} levels deep.'.format(DEEP_TREE_LEVELS))
+    parser.add_argument('--collapse_threshold',
+                        type=float,
+                        help='If specified, clusters of strains that are all within this distance of their common '
+                             'ancestor get collapsed into a single strain before picking, which can make picking '
+                             'from big trees with lots of near-identical strains much faster. The strain farthest '
+                             'from the cluster\'s common ancestor is picked to stand for it. Only works with '
+                             '--objective pd, and always uses the fast engine.')
+    parser.add_argument('--checkpoint',
+                        type=str,
+                        help='If specified, strains picked so far get saved to this file as they are picked, so a '
+                             'long run can be picked up again with --resume if it gets interrupted. Only works with '
+                             '--objective pd.')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='Carry on from the file given with --checkpoint instead of starting over. Strains '
+                             'picked are exactly the same as they would have been without the interruption.')
+    parser.add_argument('--previous_selection',
+                        type=str,
+                        help='Path to a file with strains you picked before, one per line. These strains are kept '
+                             'and --number new strains are added to them, which is handy for growing a panel as new '
+                             'strains get added to your tree. Strains that are no longer in the tree are skipped.')
+    parser.add_argument('--exclude',
+                        type=str,
+                        nargs='+',
+                        help='Strains that can\'t be picked, like lost isolates or restricted material. Give strain '
+                             'names, paths to files with one strain name per line, or a mix of both, separated by '
+                             'spaces.')
+    parser.add_argument('--subtree_output',
+                        type=str,
+                        help='If specified, the subtree connecting the picked strains gets written to a newick file '
+                             'for each number of strains, named with this as a prefix, along with a tab-separated '
+                             'summary of the phylogenetic diversity of each subtree. Branch lengths are from the tree '
+                             'as given, before any weights.')
+    parser.add_argument('--costs',
+                        type=str,
+                        help='Path to a file with the cost of each strain (sequencing, shipping and so on), in the '
+                             'same format as --weight_file. With --budget, strains get picked to get the most '
+                             'phylogenetic diversity for the budget instead of picking a set number of strains. Only '
+                             'works with --objective pd.')
+    parser.add_argument('--budget',
+                        type=float,
+                        help='Most the strains picked can cost in total. Needs --costs.')
+    parser.add_argument('--budget_method',
+                        default='exact',
+                        choices=['exact', 'greedy'],
+                        help='How to pick strains for a budget. exact (the default) finds the best set with a dynamic '
+                             'program, with costs rounded up to units of budget / --cost_resolution. greedy keeps '
+                             'adding the strain with the most diversity per unit cost, which is much quicker on very '
+                             'big trees but not always best.')
+    parser.add_argument('--cost_resolution',
+                        type=int,
+                        default=1000,
+                        help='Number of units the budget gets split into for --budget_method exact. Higher is more '
+                             'precise but takes more time and memory. Defaults to 1000.')
+    parser.add_argument('--default_cost',
+                        type=float,
+                        help='Cost of strains not in the --costs file. If not given, every strain needs a cost.')
+    parser.add_argument('--clade_quotas',
+                        type=str,
+                        help='Path to a tab-separated file with a clade name, the fewest strains to pick from it and '
+                             'the most strains to pick from it on each line (leave either blank for no limit). '
+                             'Clades can be from --clade_metadata, or named internal nodes in the tree. Only works '
+                             'with --objective pd.')
+    parser.add_argument('--clade_metadata',
+                        type=str,
+                        help='Path to a tab-separated metadata file with a header row, strain names in the first '
+                             'column, and which clade (lineage, serotype and so on) each strain is in.')
+    parser.add_argument('--clade_column',
+                        type=str,
+                        help='Name of the column in --clade_metadata with clades in it. Defaults to the second '
+                             'column.')
+    parser.add_argument('--clade_min',
+                        type=int,
+                        help='Fewest strains to pick from every clade in --clade_metadata, unless --clade_quotas '
+                             'says otherwise.')
+    parser.add_argument('--clade_max',
+                        type=int,
+                        help='Most strains to pick from every clade in --clade_metadata, unless --clade_quotas '
+                             'says otherwise.')
+    parser.add_argument('--cut_distance',
+                        type=float,
+                        help='Instead of picking a set number of strains, split strains into as few clusters as '
+                             'possible where every strain in a cluster is within this distance of every other one, '
+                             'and pick the most central strain in each cluster. Clusters get written to '
+                             '<output_name>_clusters.tsv.')
+    parser.add_argument('--pd_fraction',
+                        type=float,
+                        help='Instead of picking a set number of strains, keep picking until the strains picked '
+                             'cover at least this fraction (between 0 and 1) of the total branch length of the tree. '
+                             'Only works with --objective pd.')
+    parser.add_argument('--min_gain',
+                        type=float,
+                        help='Instead of picking a set number of strains, stop picking once the next strain would add '
+                             'less than this much phylogenetic diversity. Starting strains are always kept. Only '
+                             'works with --objective pd.')
+    parser.add_argument('--replicate_trees',
+                        required=False,
+                        help='Path to a file with many trees over the same strains (bootstrap trees, or trees '
+                             'sampled from a posterior), one after another. If specified, strains get picked on every '
+                             'replicate, and the strains reported are the set with the highest average diversity '
+                             'across all replicates. How often each strain got picked is included in the report. '
+                             'Only works with --objective pd.')
+    parser.add_argument('--threads',
+                        type=int,
+                        default=1,
+                        help='Number of processes to use when working with replicate trees. Defaults to 1.')
+    parser.add_argument('--image_cache',
+                        type=str,
+                        help='If specified, directory to keep tree images in, so that drawing the same tree with '
+                             'the same strains, colors and tree mode on a later run reuses the image instead of '
+                             'drawing it again.')
+    parser.add_argument('--image_cache_size',
+                        type=float,
+                        default=512,
+                        help='Most space the image cache can take up, in megabytes. Images used least recently get '
+                             'deleted first. Defaults to 512.')
+    parser.add_argument('--assignment_rows',
+                        type=int,
+                        default=200,
+                        help='Most strains to list in the report\'s table of which chosen strain each strain is '
+                             'closest to. The strains farthest from a chosen strain get listed. Use 0 to leave the '
+                             'table out. Defaults to 200.')
+    parser.add_argument('--profile',
+                        type=str,
+                        help='If specified, write wall time, CPU time, peak memory and counters (leaves evaluated, '
+                             'tree copies made, bytes of images embedded) for every stage of the run to this file, '
+                             'as JSON.')
+    parser.add_argument('--cprofile_dir',
+                        type=str,
+                        help='If specified, write a cProfile dump for every stage of the run to this directory.')
     parser.add_argument('--color',
                         default='red',
                         help='Color you want to have selected strains shown as. List of available colors is available '
@@ -423,17 +3780,88 @@ def argument_parsing(args):
     parser.add_argument('-v', '--version',
                         action='version',
                         version=get_version())
+    arguments = parser.parse_args(args)
+    if arguments.number is None and arguments.pd_fraction is None and arguments.min_gain is None and \
+            arguments.budget is None and arguments.cut_distance is None:
+        parser.error('one of the arguments -n/--number, --pd_fraction, --min_gain, --budget or --cut_distance is '
+                     'required')
+    return arguments
+
+
+def evaluate_argument_parsing(args):
+    parser = argparse.ArgumentParser(prog='strainchoosr evaluate',
+                                     description='Scores sets of strains you already have (hand-picked, or from other '
+                                                 'tools) by the phylogenetic diversity they cover in a tree.')
+    parser.add_argument('-t', '--treefile',
+                        type=str,
+                        required=True,
+                        help='Path to treefile - newick, NEXUS or PhyloXML, optionally gzip, bzip2 or xz '
+                             'compressed.')
+    parser.add_argument('-s', '--strain_sets',
+                        type=str,
+                        required=True,
+                        help='Path to a tab-separated file with one strain set per line: a name for the set, '
+                             'then the names of the strains in it.')
+    parser.add_argument('-o', '--output',
+                        type=str,
+                        help='File to write results to, tab-separated. If not given, results are printed.')
+    parser.add_argument('--weight_file',
+                        required=False,
+                        help='Path to file specifying weights for leaves in tree, same as for choosing strains.')
+    return parser.parse_args(args)
+
+
+def sweep_argument_parsing(args):
+    parser = argparse.ArgumentParser(prog='strainchoosr sweep',
+                                     description='Picks strains for every combination of weights file, starting '
+                                                 'strain set and number of strains, and writes out one table '
+                                                 'comparing the phylogenetic diversity of each panel and how much '
+                                                 'the panels overlap.')
+    parser.add_argument('-t', '--treefile',
+                        type=str,
+                        required=True,
+                        help='Path to treefile - newick, NEXUS or PhyloXML, optionally gzip, bzip2 or xz '
+                             'compressed.')
+    parser.add_argument('-n', '--number',
+                        type=int,
+                        nargs='+',
+                        required=True,
+                        help='Numbers of strains to pick, separated by spaces.')
+    parser.add_argument('--weight_files',
+                        type=str,
+                        nargs='+',
+                        help='Paths to weights files to compare, separated by spaces. An unweighted tree is always '
+                             'included too.')
+    parser.add_argument('-s', '--starting_sets',
+                        type=str,
+                        help='Path to a tab-separated file with one starting strain set per line: a name for the '
+                             'set, then the names of the strains in it. Automatically chosen starting strains are '
+                             'always included too.')
+    parser.add_argument('-o', '--output',
+                        type=str,
+                        help='File to write the table to, tab-separated. If not given, it is printed.')
+    parser.add_argument('--threads',
+                        type=int,
+                        default=1,
+                        help='Number of processes to use for picking. Defaults to 1.')
     return parser.parse_args(args)
 
 
 def run_strainchoosr(treefile, number_representatives, starting_strains=None, output_name='strainchoosr_output',
-                     tree_mode='r', weight_file=None, verbosity='info', rep_strain_color='red'):
+                     tree_mode='r', weight_file=None, verbosity='info', rep_strain_color='red', objective='pd',
+                     replicate_treefile=None, threads=1, distance_matrix=None, matrix_names=None, pd_fraction=None,
+                     min_gain=None, profile_file=None, cprofile_dir=None, engine=None, collapse_threshold=None,
+                     checkpoint_file=None, resume=False, previous_selection=None, exclude=None,
+                     subtree_output=None, cost_file=None, budget=None, budget_method='exact', cost_resolution=1000,
+                     default_cost=None, quota_file=None, clade_metadata=None, clade_column=None, clade_min=None,
+                     clade_max=None, cut_distance=None, image_cache=None, image_cache_size=512, assignment_rows=200):
     """
 
     Runs the strainchoosr pipeline and prints strains picked as diverse to the terminal.
 
-    :param treefile: Path to a newick-formatted treefile.
-    :param number_representatives: List of numbers of representatives.
+    :param treefile: Path to a newick-formatted treefile. Can be None if distance_matrix is given instead.
+    :param number_representatives: List of numbers of representatives. Can be None if pd_fraction or min_gain is
+    given, in which case as many strains as it takes to hit the target get picked.
     :param starting_strains: List of leaf names that should make up starting strains. Defaults to nothing, so starting
     strains automatically get chosen
     :param output_name: Base name for output file - defaults to strainchoosr_output
@@ -444,10 +3872,114 @@ def run_strainchoosr(treefile, number_representatives, starting_strains=None, ou
     :param verbosity: verbosity level: options are debug for loads of information, info for regular amounts, or warning
     for almost none.
     :param rep_strain_color: Color for strains picked to be shown in html report. Defaults to red.
+    :param objective: pd to maximize phylogenetic diversity with pd_greedy, or maxmin/kcenter to pick strains with
+    farthest_point_greedy (kcenter then moves picks to the middle of the strains they cover). Defaults to pd.
+    :param replicate_treefile: If specified, path to a newick file with many replicate trees. Strains picked will be
+    the ones with the highest average phylogenetic diversity across all of them - see replicate_pd_greedy. Only works
+    with objective pd.
+    :param threads: Number of processes to use for replicate trees. Defaults to 1.
+    :param distance_matrix: If specified, path to a distance matrix to use instead of a tree (see
+    read_distance_matrix). With objective pd a neighbor-joining tree is built from it, otherwise strains are picked
+    straight from the matrix with matrix_farthest_point_greedy and the report has no tree images.
+    :param matrix_names: File with strain names for a .npy distance matrix, one per line.
+    :param pd_fraction: If specified, keep picking strains until they cover at least this fraction of the tree's total
+    branch length. Only works with objective pd.
+    :param min_gain: If specified, stop picking strains once the next one would add less than this much phylogenetic
+    diversity. Only works with objective pd.
+    :param profile_file: If specified, wall time, CPU time, peak memory and counters for every stage of the run get
+    written to this file as JSON - see StageProfiler.
+    :param cprofile_dir: If specified, a cProfile dump for every stage of the run gets written to this directory.
+    :param engine: reference or fast - which implementation of the greedy algorithm to use. See pd_greedy. Defaults
+    to reference, or fast when adding to a previous selection, since the reference engine goes through every strain
+    already picked for every strain it tries. Also defaults to fast for trees more than DEEP_TREE_LEVELS levels deep
+    (see tree_levels), which the reference engine is very slow on.
+    :param collapse_threshold: If specified, clusters of strains that are all within this distance of their common
+    ancestor get collapsed into one strain before picking, which is much faster on big trees. Only works with
+    objective pd. See collapsed_pd_greedy.
+    :param checkpoint_file: If specified, strains picked so far get saved to this file as they're picked, so a long
+    run can be picked up again if it gets interrupted. Only works with objective pd.
+    :param resume: If True, carry on from checkpoint_file instead of starting over.
+    :param previous_selection: If specified, path to a file with strains picked before (one per line) - see
+    read_previous_selection. These are kept, and number_representatives is the number of new strains to add to them.
+    Strains that aren't in the tree any more are skipped.
+    :param exclude: If specified, list of strains that can't be picked - each entry is either a strain name or a file
+    with one strain name per line (see read_exclusions).
+    :param subtree_output: If specified, the subtree connecting the picked strains gets written for each number of
+    strains, along with its phylogenetic diversity, using this as a prefix (see write_subtrees). Branch lengths are
+    from the tree as given, before any weighting. Needs a tree.
+    :param cost_file: If specified, path to a file with the cost of each strain, in the same format as a weights file
+    (see read_weights_file). Strains get picked to get the most phylogenetic diversity for budget instead of for a
+    set number of strains - see budget_pd. Only works with objective pd on a single tree.
+    :param budget: Most the strains picked can cost in total. Needed with cost_file.
+    :param budget_method: exact for the dynamic program, or greedy for the quicker heuristic.
+    :param cost_resolution: Number of units the budget gets split into for the exact method.
+    :param default_cost: Cost of strains not in cost_file. If None, every strain needs a cost.
+    :param quota_file: If specified, path to a file with the fewest and most strains to pick from each clade (see
+    read_clade_quotas). Clades are groups from clade_metadata, or named internal nodes of the tree. Only works with
+    objective pd on a single tree.
+    :param clade_metadata: If specified, path to a tab-separated metadata file saying which clade each strain is in -
+    see read_clade_metadata.
+    :param clade_column: Name of the column in clade_metadata with clades in it. Defaults to the second column.
+    :param clade_min: Fewest strains to pick from every clade in clade_metadata that isn't in quota_file.
+    :param clade_max: Most strains to pick from every clade in clade_metadata that isn't in quota_file.
+    :param cut_distance: If specified, strains get split into clusters that are all within this distance of each
+    other, and one strain gets picked per cluster (see cut_clusters) instead of picking a set number of strains. The
+    clusters get written to output_name_clusters.tsv. Needs a tree.
+    :param image_cache: If specified, directory to cache tree images in, so that drawing the same tree with the same
+    strains and style again just reuses the image - see ImageCache.
+    :param image_cache_size: Most space, in megabytes, the image cache can take up before the least recently used
+    images get deleted.
+    :param assignment_rows: Most strains to list in each closest chosen strain table in the report (see
+    generate_html_report). 0 leaves the tables out, None lists every strain.
     :return: dictionary where number of strains is the key and the value is a list of representatives
     """
     if starting_strains is None:
         starting_strains = []
+    chose_engine = engine is not None
+    if engine is None:
+        engine = 'fast' if previous_selection is not None else 'reference'
+    elif engine == 'reference' and previous_selection is not None:
+        logging.warning('The reference engine is slow to add to a big previous selection - --engine fast picks the '
+                        'same strains, except where strains tie to within rounding error.')
+    stop_early = pd_fraction is not None or min_gain is not None
+    if collapse_threshold is not None and (objective != 'pd' or replicate_treefile is not None or stop_early):
+        raise ValueError('Collapsing clades only works with --objective pd and a single tree, when picking a set '
+                         'number of strains.')
+    if checkpoint_file is not None and (objective != 'pd' or replicate_treefile is not None or stop_early or
+                                        collapse_threshold is not None or distance_matrix is not None):
+        raise ValueError('Checkpoints only work with --objective pd on a single tree, when picking a set number of '
+                         'strains without collapsing clades.')
+    if resume and checkpoint_file is None:
+        raise ValueError('You need to give a checkpoint file to resume from.')
+    if stop_early and (objective != 'pd' or replicate_treefile is not None):
+        raise ValueError('Stopping at a phylogenetic diversity target only works with --objective pd and a single '
+                         'tree.')
+    if replicate_treefile is not None and objective != 'pd':
+        raise ValueError('Replicate trees only work with --objective pd.')
+    if subtree_output is not None and distance_matrix is not None and objective != 'pd':
+        raise ValueError('Writing subtrees needs a tree. Use --objective pd to build a neighbor-joining tree from your '
+                         'distance matrix.')
+    if (cost_file is None) != (budget is None):
+        raise ValueError('Picking strains for a budget needs both a cost file and a budget.')
+    if budget is not None and (objective != 'pd' or replicate_treefile is not None or stop_early or
+                               collapse_threshold is not None or checkpoint_file is not None):
+        raise ValueError('Picking strains for a budget only works with --objective pd on a single tree, without '
+                         'collapsing clades, checkpoints or a phylogenetic diversity target.')
+    use_quotas = quota_file is not None or clade_min is not None or clade_max is not None
+    if (clade_min is not None or clade_max is not None) and clade_metadata is None:
+        raise ValueError('A minimum or maximum for every clade needs a metadata file saying which clade each strain '
+                         'is in.')
+    if use_quotas and (objective != 'pd' or replicate_treefile is not None or stop_early or budget is not None or
+                       collapse_threshold is not None or checkpoint_file is not None):
+        raise ValueError('Clade quotas only work with --objective pd on a single tree, when picking a set number of '
+                         'strains without collapsing clades or checkpoints.')
+    if cut_distance is not None and (replicate_treefile is not None or stop_early or budget is not None or
+                                     use_quotas or collapse_threshold is not None or checkpoint_file is not None or
+                                     exclude or (distance_matrix is not None and objective != 'pd')):
+        raise ValueError('Picking a strain per cluster only works on a single tree, without excluded strains, clade '
+                         'quotas, budgets, checkpoints, collapsing clades or a phylogenetic diversity target.')
+    if number_representatives is None and not stop_early and budget is None and cut_distance is None:
+        raise ValueError('You need to give a number of strains to pick, or a target to stop at.')
     output_dictionary = dict()
     if verbosity == 'info':
         logging.basicConfig(format='\033[92m \033[1m %(asctime)s \033[0m %(message)s ',
@@ -461,47 +3993,273 @@ def run_strainchoosr(treefile, number_representatives, starting_strains=None, ou
         logging.basicConfig(format='\033[92m \033[1m %(asctime)s \033[0m %(message)s ',
                             level=logging.WARNING,
                             datefmt='%Y-%m-%d %H:%M:%S')
-    try:
-        tree = ete3.Tree(newick=treefile)
-    except NewickError:
-        tree = ete3.Tree(newick=treefile,
-                         quoted_node_names=True, format=1)
-    if weight_file is not None:
-        weights = read_weights_file(weight_file)
-        original_tree = copy.deepcopy(tree)
-        tree = modify_tree_with_weights(original_tree, weights)
-    starting_strains = get_leaf_nodes_from_names(tree, starting_strains)
+    profiler = StageProfiler(enabled=profile_file is not None or cprofile_dir is not None, cprofile_dir=cprofile_dir)
+    cache = None
+    if image_cache is not None:
+        cache = ImageCache(image_cache, max_bytes=int(image_cache_size * 1024 * 1024))
     completed_choosrs = list()
     with tempfile.TemporaryDirectory() as tmpdir:
+        matrix_names_list, matrix = None, None
+        with profiler.stage('parse'):
+            if distance_matrix is not None:
+                matrix_names_list, matrix = read_distance_matrix(distance_matrix, tmpdir, names_file=matrix_names)
+                logging.info('Read distance matrix with {} strains.'.format(len(matrix_names_list)))
+            if matrix is not None and objective != 'pd':
+                tree = None
+                leaf_count = len(matrix_names_list)
+            else:
+                if matrix is not None:
+                    logging.info('Building neighbor-joining tree from distance matrix.')
+                    tree = neighbor_joining_tree(matrix_names_list, matrix, tmpdir)
+                else:
+                    tree = load_tree(treefile)
+                leaf_count = len(tree.get_leaves())
+            profiler.count('leaves', leaf_count)
+        if tree is not None and objective == 'pd' and engine == 'reference':
+            # The reference engine prunes a copy of the tree for every strain it tries, which on a ladder-like tree
+            # thousands of levels deep is cubic - it can take hours to pick a handful of strains.
+            levels = tree_levels(tree)
+            if levels > DEEP_TREE_LEVELS and not chose_engine:
+                logging.info('Tree is {} levels deep, which the reference engine is very slow on, so using --engine '
+                             'fast. Pass --engine reference to use the reference engine anyway.'.format(levels))
+                engine = 'fast'
+            elif levels > DEEP_TREE_LEVELS:
+                logging.warning('Tree is {} levels deep, which the reference engine is very slow on - --engine fast '
+                                'picks the same strains much faster, except where strains tie to within rounding '
+                                'error.'.format(levels))
+        excluded = set()
+        if exclude:
+            excluded = set(read_exclusions(exclude))
+            leaf_names = matrix_names_list if tree is None else tree.get_leaf_names()
+            missing = excluded.difference(leaf_names)
+            if missing:
+                logging.warning('{} excluded strains are not in the tree: {}'
+                                .format(len(missing), ', '.join(sorted(missing))))
+            if excluded.intersection(starting_strains):
+                raise ValueError('Starting strains can\'t be excluded: {}'
+                                 .format(', '.join(sorted(excluded.intersection(starting_strains)))))
+            leaf_count = len([name for name in leaf_names if name not in excluded])
+            logging.info('Excluding {} strains, leaving {} to pick from.'
+                         .format(len(excluded) - len(missing), leaf_count))
+        if previous_selection is not None:
+            # One name lookup for the whole panel, rather than a search through the tree for every strain.
+            available = set(matrix_names_list) if tree is None else set(tree.get_leaf_names())
+            previous_strains = read_previous_selection(previous_selection)
+            missing = [name for name in previous_strains if name not in available]
+            if missing:
+                logging.warning('{} strains from your previous selection are not in the tree and will be skipped: {}'
+                                .format(len(missing), ', '.join(missing)))
+            dropped = [name for name in previous_strains if name in excluded]
+            if dropped:
+                logging.warning('{} strains from your previous selection are excluded and will be dropped: {}'
+                                .format(len(dropped), ', '.join(dropped)))
+            kept = [name for name in dict.fromkeys(previous_strains) if name in available and
+                    name not in excluded and name not in starting_strains]
+            starting_strains = kept + list(starting_strains)
+            logging.info('Adding to a previous selection of {} strains.'.format(len(starting_strains)))
+            if number_representatives is not None:
+                number_representatives = [len(starting_strains) + number for number in number_representatives]
+        quotas = None
+        if use_quotas:
+            quotas = CladeQuotas(read_clade_quotas(quota_file) if quota_file is not None else None,
+                                 groups=read_clade_metadata(clade_metadata, column=clade_column)
+                                 if clade_metadata is not None else None,
+                                 minimum=clade_min,
+                                 maximum=clade_max)
+            logging.info('Picking with quotas for {} clades.'.format(len(quotas.quotas)))
+        unweighted_tree = tree
+        if tree is None:
+            if weight_file is not None:
+                raise ValueError('Weights change branch lengths, so they need a tree. Use --objective pd to build a '
+                                 'neighbor-joining tree from your distance matrix, or leave out the weights file.')
+            with profiler.stage('selection'):
+                if objective == 'kcenter':
+                    # Moving picks to the middle of their groups means picks for fewer strains aren't the first few
+                    # picks for more, so each number gets picked separately.
+                    matrix_picks = {number: matrix_farthest_point_greedy(matrix_names_list, matrix, number,
+                                                                         starting_strains, objective=objective,
+                                                                         exclude=excluded)
+                                    for number in number_representatives}
+                else:
+                    picks = matrix_farthest_point_greedy(matrix_names_list, matrix, max(number_representatives),
+                                                         starting_strains, exclude=excluded)
+                    matrix_picks = {number: picks[:number] for number in number_representatives}
+        elif weight_file is not None:
+            with profiler.stage('weighting'):
+                weights = read_weights_file(weight_file)
+                profiler.count('tree_copies')
+                tree = modify_tree_with_weights(tree, weights)
+        replicate_selection = None
+        if replicate_treefile is not None:
+            with profiler.stage('replicates'):
+                replicate_trees = read_trees(replicate_treefile)
+                profiler.count('replicate_trees', len(replicate_trees))
+                if weight_file is not None:
+                    replicate_trees = [modify_tree_with_weights(replicate_tree, weights)
+                                       for replicate_tree in replicate_trees]
+                replicate_selection = replicate_pd_greedy(replicate_trees,
+                                                          max(number_representatives),
+                                                          starting_strains=starting_strains,
+                                                          threads=threads,
+                                                          exclude=excluded)
+        if tree is not None:
+            starting_strains = get_leaf_nodes_from_names(tree, starting_strains)
+        stopped_picks = None
+        if stop_early:
+            with profiler.stage('selection'):
+                stopped_picks = pd_greedy_until(tree, starting_strains,
+                                                pd_fraction=pd_fraction,
+                                                min_gain=min_gain,
+                                                max_tips=max(number_representatives) if number_representatives
+                                                else None,
+                                                exclude=excluded,
+                                                engine=engine)
+            number_representatives = [len(stopped_picks)]
+        elif budget is not None:
+            with profiler.stage('selection'):
+                budget_selection = budget_pd(tree, read_weights_file(cost_file), budget,
+                                             method=budget_method,
+                                             resolution=cost_resolution,
+                                             starting_strains=starting_strains,
+                                             exclude=excluded,
+                                             default_cost=default_cost)
+                profiler.count('budget_peak_bytes', budget_selection.peak_bytes)
+            logging.info('Picked {} strains costing {} out of a budget of {}, with phylogenetic diversity {}. The {} '
+                         'method took {:.3f} seconds and at most {} bytes for its tables.'
+                         .format(len(budget_selection.strains), budget_selection.cost, budget,
+                                 budget_selection.phylogenetic_diversity, budget_method, budget_selection.seconds,
+                                 budget_selection.peak_bytes))
+            stopped_picks = budget_selection.strains
+            number_representatives = [len(stopped_picks)]
+        elif cut_distance is not None:
+            with profiler.stage('selection'):
+                stopped_picks, cluster_table = cut_clusters(tree, cut_distance, starting_strains=starting_strains)
+                write_clusters(cluster_table, output_name + '_clusters.tsv')
+            logging.info('Split strains into {} clusters at distance {}, wrote clusters to {}.'
+                         .format(len(stopped_picks), cut_distance, output_name + '_clusters.tsv'))
+            number_representatives = [len(stopped_picks)]
         for number in number_representatives:
             output_dictionary[number] = list()
-            if len(tree.get_leaves()) < number:
-                raise ValueError('You requested that {} strains be selected, but your tree only has {} leaves. '
+            if leaf_count < number:
+                raise ValueError('You requested that {} strains be selected, but your tree only has {} leaves{}. '
                                  'Please select an appropriate number of strains to be selected.'
                                  .format(number,
-                                         len(tree.get_leaves())))
-            starting_leaves = find_starting_leaves(tree, starting_strains)
-            logging.info('Found starting leaves {}'.format(starting_leaves))
-            strains = pd_greedy(tree, number, starting_leaves)
-            output_image = os.path.join(tmpdir, 'strains_{}.png'.format(number))
-            create_colored_tree_tip_image(tree_to_draw=tree,
-                                          output_file=output_image,
-                                          representatives=get_leaf_names_from_nodes(strains),
-                                          mode=tree_mode,
-                                          color=rep_strain_color)
-            completed_choosrs.append(CompletedStrainChoosr(representatives=get_leaf_names_from_nodes(strains),
+                                         leaf_count,
+                                         ' that aren\'t excluded' if excluded else ''))
+            selection_frequencies = None
+            if tree is None:
+                representatives = [matrix_names_list[row] for row in matrix_picks[number]]
+                with profiler.stage('coverage'):
+                    coverage_radii, assignments = matrix_coverage_by_prefix(matrix_names_list, matrix,
+                                                                            matrix_picks[number])
+                output_image = None
+            else:
+                if replicate_selection is not None:
+                    strains = get_leaf_nodes_from_names(tree, replicate_selection.consensus[:number])
+                    selection_frequencies = replicate_selection.frequencies(number)
+                    logging.info('Average phylogenetic diversity across replicate trees for {} strains: {}'
+                                 .format(number, replicate_selection.mean_pd[number - 1]))
+                else:
+                    with profiler.stage('starting_leaves'):
+                        # maxmin and kcenter work on a CompactTree anyway, so there's no point in the slow search.
+                        if engine == 'fast' or collapse_threshold is not None or objective != 'pd':
+                            compact = CompactTree(tree)
+                            starting_leaves = [compact.nodes[leaf] for leaf in
+                                               compact.find_starting_leaves([compact.index(node)
+                                                                             for node in starting_strains],
+                                                                            exclude=compact.leaf_mask(excluded))
+                                               if leaf is not None]
+                        else:
+                            # find_starting_leaves adds the automatic starting pair to the list it's given, and
+                            # quotas below still need just the starting strains asked for.
+                            starting_leaves = find_starting_leaves(tree, list(starting_strains), exclude=excluded)
+                    logging.info('Found starting leaves {}'.format(starting_leaves))
+                    if stopped_picks is not None:
+                        strains = stopped_picks
+                    else:
+                        with profiler.stage('selection'):
+                            if objective == 'pd':
+                                # Picks for every number after the first carry on from the checkpoint, since the
+                                # first few picks are always the same.
+                                # Quotas can rule out the automatic starting pair, so they only get given the
+                                # starting strains asked for.
+                                strains = pd_greedy(tree, number,
+                                                    starting_leaves if quotas is None else starting_strains,
+                                                    profiler=profiler, engine=engine,
+                                                    collapse_threshold=collapse_threshold,
+                                                    checkpoint_file=checkpoint_file,
+                                                    resume=resume or number != number_representatives[0],
+                                                    exclude=excluded,
+                                                    quotas=quotas)
+                            else:
+                                # Only the starting strains asked for get given, so kcenter is free to move the
+                                # automatic starting pair.
+                                strains = farthest_point_greedy(tree, number, starting_strains, objective=objective,
+                                                                exclude=excluded)
+                representatives = get_leaf_names_from_nodes(strains)
+                output_image = os.path.join(tmpdir, 'strains_{}.png'.format(number))
+                with profiler.stage('rendering'):
+                    create_colored_tree_tip_image(tree_to_draw=tree,
+                                                  output_file=output_image,
+                                                  representatives=representatives,
+                                                  mode=tree_mode,
+                                                  color=rep_strain_color,
+                                                  cache=cache)
+                    profiler.count('image_bytes', os.path.getsize(output_image))
+                with profiler.stage('coverage'):
+                    coverage_radii, assignments = coverage_by_prefix(tree, strains)
+                if cut_distance is not None:
+                    # Strains go with their own cluster's representative, even if another one is closer.
+                    assignments = [(strain, representative, distance)
+                                   for strain, _, representative, distance in cluster_table]
+            logging.info('Farthest any strain is from a chosen strain: {}'.format(coverage_radii[-1]))
+            completed_choosrs.append(CompletedStrainChoosr(representatives=representatives,
                                                            image=output_image,
-                                                           name='{} Strains'.format(number)))
+                                                           name='{} Strains'.format(number),
+                                                           coverage_radii=coverage_radii,
+                                                           assignments=assignments,
+                                                           selection_frequencies=selection_frequencies))
             logging.info('Strains selected for {} representatives:'.format(number))
-            for leaf_name in get_leaf_names_from_nodes(strains):
+            for leaf_name in representatives:
                 print(leaf_name)
                 output_dictionary[number].append(leaf_name)
-        generate_html_report(completed_choosrs,
-                             output_name + '.html')
+        if subtree_output is not None:
+            with profiler.stage('subtrees'):
+                for number, subtree_file, diversity, fraction in write_subtrees(unweighted_tree, output_dictionary,
+                                                                                subtree_output):
+                    logging.info('Wrote subtree for {} strains to {} - phylogenetic diversity {} ({} of total tree '
+                                 'length).'.format(number, subtree_file, diversity, fraction))
+        with profiler.stage('report'):
+            generate_html_report(completed_choosrs,
+                                 output_name + '.html',
+                                 assignment_rows=assignment_rows)
+            profiler.count('images_embedded_bytes', sum(os.path.getsize(completed_choosr.image)
+                                                        for completed_choosr in completed_choosrs
+                                                        if completed_choosr.image is not None))
+            profiler.count('report_bytes', os.path.getsize(output_name + '.html'))
+    if profile_file is not None:
+        profiler.write(profile_file)
+        logging.info('Wrote profile to {}'.format(profile_file))
     return output_dictionary
 
 
 def main():
+    if sys.argv[1:2] == ['evaluate']:
+        args = evaluate_argument_parsing(sys.argv[2:])
+        evaluate_strain_sets(treefile=args.treefile,
+                             sets_file=args.strain_sets,
+                             output_file=args.output,
+                             weight_file=args.weight_file)
+        return
+    if sys.argv[1:2] == ['sweep']:
+        args = sweep_argument_parsing(sys.argv[2:])
+        run_sweep(treefile=args.treefile,
+                  numbers=args.number,
+                  weight_files=args.weight_files,
+                  starting_sets_file=args.starting_sets,
+                  output_file=args.output,
+                  threads=args.threads)
+        return
     args = argument_parsing(sys.argv[1:])
     run_strainchoosr(treefile=args.treefile,
                      number_representatives=args.number,
@@ -510,7 +4268,37 @@ def main():
                      tree_mode=args.tree_mode,
                      weight_file=args.weight_file,
                      verbosity=args.verbosity,
-                     rep_strain_color=args.color)
+                     rep_strain_color=args.color,
+                     objective=args.objective,
+                     replicate_treefile=args.replicate_trees,
+                     threads=args.threads,
+                     distance_matrix=args.distance_matrix,
+                     matrix_names=args.matrix_names,
+                     pd_fraction=args.pd_fraction,
+                     min_gain=args.min_gain,
+                     profile_file=args.profile,
+                     cprofile_dir=args.cprofile_dir,
+                     engine=args.engine,
+                     collapse_threshold=args.collapse_threshold,
+                     checkpoint_file=args.checkpoint,
+                     resume=args.resume,
+                     previous_selection=args.previous_selection,
+                     exclude=args.exclude,
+                     subtree_output=args.subtree_output,
+                     cost_file=args.costs,
+                     budget=args.budget,
+                     budget_method=args.budget_method,
+                     cost_resolution=args.cost_resolution,
+                     default_cost=args.default_cost,
+                     quota_file=args.clade_quotas,
+                     clade_metadata=args.clade_metadata,
+                     clade_column=args.clade_column,
+                     clade_min=args.clade_min,
+                     clade_max=args.clade_max,
+                     cut_distance=args.cut_distance,
+                     image_cache=args.image_cache,
+                     image_cache_size=args.image_cache_size,
+                     assignment_rows=args.assignment_rows)
 
 
 if __name__ == '__main__':
@@ -1,11 +1,12 @@
 #!/usr/bin/env python
 
 from PyQt5.QtWidgets import QApplication, QFileDialog, QMainWindow, QPushButton, QErrorMessage, QLabel, QSpinBox, \
-    QColorDialog, QProgressBar, QRadioButton, QListWidget
+    QColorDialog, QProgressBar, QRadioButton, QListWidget, QCheckBox
 from PyQt5.QtGui import QPixmap, QPalette, QColor
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from strainchoosr import strainchoosr
 import subprocess
+import argparse
 import tempfile
 import shutil
 import ete3
@@ -21,7 +22,7 @@ class StrainChoosrThread(QThread):
     # All I know about QThreads comes from here: https://kushaldas.in/posts/pyqt5-thread-example.html
     signal = pyqtSignal('PyQt_PyObject')
 
-    def __init__(self, tree_file, num_strains, tmpdir, progress_bar, orientaion, color):
+    def __init__(self, tree_file, num_strains, tmpdir, progress_bar, orientaion, color, cache_dir=None):
         QThread.__init__(self)
         self.tree_file = tree_file
         self.num_strains = num_strains
@@ -29,6 +30,7 @@ class StrainChoosrThread(QThread):
         self.progress_bar = progress_bar
         self.orientation = orientaion
         self.color = color
+        self.cache_dir = cache_dir
 
     def run(self):
         tree = ete3.Tree(self.tree_file)
@@ -49,10 +51,28 @@ class StrainChoosrThread(QThread):
         # I couldn't find a way to kill the ete3 PyQt app via the code, so my hacky solution is to run tree rendering via a subprocess
         # so that my GUI doesn't know anything about the ete3 GUI and therefore whatever interaction was occurring
         # can no longer occur.
-        cmd = 'strainchoosr_drawimage {} {} {} "{}" {}'.format(self.tree_file, self.num_strains, self.tmpdir, self.color, self.orientation)
-        subprocess.call(cmd, shell=True, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
+        # The strains picked here get handed to the subprocess, so it only has to draw them. With the image cache
+        # turned on, drawing the same selection again (like going back to a number of strains already tried) just
+        # copies the image out of the cache, which skips the subprocess entirely.
+        representatives = strainchoosr.get_leaf_names_from_nodes(diverse_strains)
+        output_image = os.path.join(self.tmpdir, 'image.png')
+        if self.cache_dir is not None:
+            key = strainchoosr.ImageCache.key(tree, representatives, self.color, self.orientation, 0, '.png')
+            if strainchoosr.ImageCache(self.cache_dir).fetch(key, '.png', output_image):
+                self.progress_bar.setValue(100)
+                self.signal.emit(representatives)
+                return
+        strains_file = os.path.join(self.tmpdir, 'strains.txt')
+        with open(strains_file, 'w') as f:
+            for strain_name in representatives:
+                f.write('{strain_name}\n'.format(strain_name=strain_name))
+        cmd = ['strainchoosr_drawimage', self.tree_file, str(self.num_strains), self.tmpdir, self.color,
+               self.orientation, '--strains_file', strains_file]
+        if self.cache_dir is not None:
+            cmd.extend(['--cache_dir', self.cache_dir])
+        subprocess.call(cmd, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
         self.progress_bar.setValue(100)
-        self.signal.emit(strainchoosr.get_leaf_names_from_nodes(diverse_strains))
+        self.signal.emit(representatives)
 
 
 class StrainChoosrGUI(QMainWindow):
@@ -85,6 +105,7 @@ class StrainChoosrGUI(QMainWindow):
         self.tree_orientation_rect = None
         self.tree_orientation_circ = None
         self.tree_orient = 'r'
+        self.image_cache_box = None
         self.st_thread = StrainChoosrThread(tree_file=None,
                                             num_strains=None,
                                             tmpdir=self.tmpdir,
@@ -147,6 +168,13 @@ class StrainChoosrGUI(QMainWindow):
         self.tree_orientation_circ.move(0, 375)
         self.tree_orientation_rect.show()
         self.tree_orientation_circ.show()
+        # Off unless asked for, since it keeps images around after the GUI closes.
+        self.image_cache_box = QCheckBox('Cache images', self)
+        self.image_cache_box.setToolTip('Keep tree images in {} so drawing the same strains again is '
+                                        'instant.'.format(strainchoosr.ImageCache.default_dir()))
+        self.image_cache_box.move(0, 400)
+        self.image_cache_box.resize(200, 20)
+        self.image_cache_box.show()
 
     def save_image(self):
         options = QFileDialog.Options()
@@ -222,6 +250,8 @@ class StrainChoosrGUI(QMainWindow):
             self.st_thread.num_strains = self.strain_number_input.value()
             self.st_thread.color = self.color
             self.st_thread.orientation = self.tree_orient
+            self.st_thread.cache_dir = strainchoosr.ImageCache.default_dir() if self.image_cache_box.isChecked() \
+                else None
             self.st_thread.start()
             self.strainchoosr_button.setEnabled(False)
 
@@ -243,18 +273,35 @@ class StrainChoosrGUI(QMainWindow):
 
 
 def draw_image_wrapper():
-    tree_file = sys.argv[1]
-    num_strains = int(sys.argv[2])
-    output_dir = sys.argv[3]
-    color = sys.argv[4]
-    orientation = sys.argv[5]
-    tree = ete3.Tree(tree_file)
-    diverse_strains = strainchoosr.pd_greedy(tree=tree, number_tips=num_strains, starting_strains=[])
+    # Usage: strainchoosr_drawimage tree_file num_strains output_dir color orientation [--strains_file strains_file]
+    # [--cache_dir cache_dir]
+    # The GUI passes the strains it already picked, one per line in strains_file, so they don't get picked again.
+    parser = argparse.ArgumentParser(prog='strainchoosr_drawimage',
+                                     description='Draws a tree with its most diverse strains highlighted.')
+    parser.add_argument('tree_file')
+    parser.add_argument('num_strains', type=int)
+    parser.add_argument('output_dir')
+    parser.add_argument('color')
+    parser.add_argument('orientation')
+    parser.add_argument('--strains_file',
+                        help='File with the strains to highlight, one per line, instead of picking num_strains.')
+    parser.add_argument('--cache_dir',
+                        help='If specified, directory to cache images in.')
+    args = parser.parse_args(sys.argv[1:])
+    tree = ete3.Tree(args.tree_file)
+    if args.strains_file is not None:
+        with open(args.strains_file) as f:
+            representatives = [line.rstrip('\n') for line in f if line.rstrip('\n')]
+    else:
+        diverse_strains = strainchoosr.pd_greedy(tree=tree, number_tips=args.num_strains, starting_strains=[])
+        representatives = strainchoosr.get_leaf_names_from_nodes(diverse_strains)
+    cache = strainchoosr.ImageCache(args.cache_dir) if args.cache_dir else None
     strainchoosr.create_colored_tree_tip_image(tree_to_draw=tree,
-                                               output_file=os.path.join(output_dir, 'image.png'),
-                                               representatives=strainchoosr.get_leaf_names_from_nodes(diverse_strains),
-                                               mode=orientation,
-                                               color=color)
+                                               output_file=os.path.join(args.output_dir, 'image.png'),
+                                               representatives=representatives,
+                                               mode=args.orientation,
+                                               color=args.color,
+                                               cache=cache)
 
 
 def main():
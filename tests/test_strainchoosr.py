@@ -1,11 +1,22 @@
 #!/usr/bin/env python
 
 import pytest
+import json
+import random
+import itertools
 import tempfile
+import asyncio
+import threading
+import time
 import ete3
 import os
+import logging
 from unittest.mock import patch
 from strainchoosr.strainchoosr import *
+from strainchoosr import benchmark
+from strainchoosr import differential
+from strainchoosr import aio
+from strainchoosr import batch
 
 
 def test_read_weights_file_good():
@@ -71,6 +82,34 @@ def test_tree_modification_multiple_branches_same_name():
         modify_tree_with_weights(tree, weights)
 
 
+def test_tree_modification_clades():
+    tree = ete3.Tree('((A:1,B:2)cladeX:1,(C:1,D:1):3,E:4);', format=1)
+    newtree = modify_tree_with_weights(tree, {'cladeX': 3, 'A,B': 2, 'C, D': 0.5, 'C': 10})
+    assert newtree.write(format=1) == '((A:6,B:12)cladeX:6,(C:5,D:0.5):1.5,E:4);'
+    # Original tree hasn't been modified.
+    assert tree.write(format=1) == '((A:1,B:2)cladeX:1,(C:1,D:1):3,E:4);'
+    # Common ancestor of more than two leaves covers everything between them.
+    newtree = modify_tree_with_weights(tree, {'A,C,D': 2})
+    assert newtree.write(format=1) == '((A:2,B:4)cladeX:2,(C:2,D:2):6,E:8);'
+    with pytest.raises(AttributeError):
+        modify_tree_with_weights(tree, {'A,fake_branch': 2})
+    with pytest.raises(AttributeError):
+        modify_tree_with_weights(tree, {'cladeY': 2})
+
+
+def test_scale_subtrees_matches_one_at_a_time():
+    rng = random.Random(3)
+    for _ in range(100):
+        compact = CompactTree(ete3.Tree(differential.random_tree(rng, rng.randint(2, 30), polytomy_fraction=0.2)))
+        nodes = [rng.randrange(len(compact.parent)) for _ in range(rng.randint(0, 12))]
+        factors = [rng.choice([0, 0.5, 1.5, 2, 3]) for _ in nodes]
+        expected = compact.dist.copy()
+        for node, factor in zip(nodes, factors):
+            expected[node:compact.end[node]] *= factor
+        expected[0] = compact.dist[0]
+        assert np.allclose(compact.scale_subtrees(nodes, factors), expected)
+
+
 def test_starting_leaves_empty_list():
     tree = ete3.Tree('tests/tree_files/tree.nwk')
     starting_leaf_list = list()
@@ -183,6 +222,748 @@ def test_pd_greedy():
     assert len(starting_leaves) == 2
 
 
+def test_compact_tree_distances():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    compact = CompactTree(tree)
+    leaf = tree.get_leaves_by_name('2018-SEQ-0100.fasta')[0]
+    distances = compact.distances_from(compact.index(leaf))
+    for other_leaf in tree.get_leaves():
+        assert distances[compact.index(other_leaf)] == pytest.approx(tree.get_distance(leaf, other_leaf))
+
+
+def test_compact_tree_starting_leaves_match():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    compact = CompactTree(tree)
+    starting_leaves = compact.find_starting_leaves([])
+    assert [compact.nodes[leaf] for leaf in starting_leaves] == find_starting_leaves(tree, [])
+
+
+def test_farthest_point_greedy():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    strains = farthest_point_greedy(tree, 4, [])
+    names = get_leaf_names_from_nodes(strains)
+    assert len(names) == 4
+    assert len(set(names)) == 4
+    assert names[:2] == ['2018-SEQ-0383.fasta', '2018-SEQ-0100.fasta']
+
+
+def test_farthest_point_greedy_all_leaves():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    strains = farthest_point_greedy(tree, len(tree.get_leaves()), [])
+    assert sorted(get_leaf_names_from_nodes(strains)) == sorted(tree.get_leaf_names())
+
+
+def test_farthest_point_greedy_kcenter():
+    # Farthest-point traversal picks the two ends of this path of strains, but picks nearer the middle cover it better.
+    tree = ete3.Tree('(A:0.01,(B:0.01,(C:0.01,(D:0.01,(E:0.01,(F:0.01,G:0.01):1):1):1):1):1);')
+    maxmin = farthest_point_greedy(tree, 2, [])
+    kcenter = farthest_point_greedy(tree, 2, [], objective='kcenter')
+    compact = CompactTree(tree)
+    maxmin_radius = RepresentativeAssignment(compact, [compact.index(leaf) for leaf in maxmin]).radius()
+    kcenter_radius = RepresentativeAssignment(compact, [compact.index(leaf) for leaf in kcenter]).radius()
+    assert kcenter_radius < maxmin_radius
+    rng = random.Random(4)
+    for _ in range(50):
+        tree = ete3.Tree(differential.random_tree(rng, rng.randint(3, 40)))
+        compact = CompactTree(tree)
+        number = rng.randint(2, len(compact.leaves))
+        starting = rng.sample(tree.get_leaves(), rng.choice([0, 1]))
+        maxmin = farthest_point_greedy(tree, number, starting)
+        kcenter = farthest_point_greedy(tree, number, starting, objective='kcenter')
+        assert len(set(get_leaf_names_from_nodes(kcenter))) == number
+        assert set(get_leaf_names_from_nodes(starting)) <= set(get_leaf_names_from_nodes(kcenter))
+        assert (RepresentativeAssignment(compact, [compact.index(leaf) for leaf in kcenter]).radius() <=
+                RepresentativeAssignment(compact, [compact.index(leaf) for leaf in maxmin]).radius())
+
+
+@pytest.mark.parametrize('objective', ['maxmin', 'kcenter'])
+def test_farthest_point_greedy_more_than_leaves(objective):
+    tree = ete3.Tree('((A:1,B:2):1,(C:1,D:0):1);')
+    picked = farthest_point_greedy(tree, 10, [], objective=objective)
+    assert sorted(get_leaf_names_from_nodes(picked)) == ['A', 'B', 'C', 'D']
+
+
+@pytest.mark.parametrize('objective', ['maxmin', 'kcenter'])
+def test_farthest_point_greedy_exclude(objective):
+    rng = random.Random(6)
+    for _ in range(30):
+        tree = ete3.Tree(differential.random_tree(rng, rng.randint(4, 40)))
+        names = tree.get_leaf_names()
+        excluded = set(rng.sample(names, rng.randint(1, len(names) - 2)))
+        picked = get_leaf_names_from_nodes(farthest_point_greedy(tree, len(names), [], objective=objective,
+                                                                 exclude=excluded))
+        assert sorted(picked) == sorted(set(names) - excluded)
+        number = rng.randint(2, len(names) - len(excluded))
+        picked = get_leaf_names_from_nodes(farthest_point_greedy(tree, number, [], objective=objective,
+                                                                 exclude=excluded))
+        assert len(set(picked)) == number
+        assert not excluded.intersection(picked)
+
+
+def test_matrix_farthest_point_greedy_kcenter():
+    names = ['A', 'B', 'C', 'D', 'E']
+    # Points on a line at 0, 1, 2, 3 and 4.
+    matrix = np.abs(np.subtract.outer(np.arange(5.0), np.arange(5.0)))
+    assert sorted(matrix_farthest_point_greedy(names, matrix, 2, [])) == [0, 4]
+    picks = matrix_farthest_point_greedy(names, matrix, 2, [], objective='kcenter')
+    assert matrix[:, picks].min(axis=1).max() < 4 / 2 + 1e-9
+    assert 'A' in [names[row] for row in matrix_farthest_point_greedy(names, matrix, 2, ['A'], objective='kcenter')]
+
+
+def test_representative_assignment_matches_incremental():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    compact = CompactTree(tree)
+    representatives = [compact.index(leaf) for leaf in pd_greedy(tree, 5, [])]
+    all_at_once = RepresentativeAssignment(compact, representatives)
+    one_at_a_time = RepresentativeAssignment(compact)
+    for leaf in representatives:
+        one_at_a_time.add(leaf)
+    assert list(all_at_once.nearest) == list(one_at_a_time.nearest)
+    assert all_at_once.distance == pytest.approx(one_at_a_time.distance)
+
+
+def test_coverage_by_prefix():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    strains = pd_greedy(tree, 4, [])
+    radii, assignments = coverage_by_prefix(tree, strains)
+    assert len(radii) == 4
+    assert radii == sorted(radii, reverse=True)
+    assert len(assignments) == len(tree.get_leaves())
+    for strain, representative, distance in assignments:
+        assert representative in get_leaf_names_from_nodes(strains)
+        leaf = tree.get_leaves_by_name(strain)[0]
+        closest = min(tree.get_distance(leaf, picked) for picked in strains)
+        assert distance == pytest.approx(closest)
+    assert max(distance for _, _, distance in assignments) == pytest.approx(radii[-1])
+
+
+def test_report_assignment_rows():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    strains = pd_greedy(tree, 4, [])
+    radii, assignments = coverage_by_prefix(tree, strains)
+    result = CompletedStrainChoosr(get_leaf_names_from_nodes(strains), image=None, name='4 Strains',
+                                   coverage_radii=radii, assignments=assignments)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        report = os.path.join(tmpdir, 'report.html')
+        generate_html_report([result], report, assignment_rows=5)
+        with open(report) as f:
+            html = f.read()
+        assert 'Showing the 5 strains farthest from a chosen strain, out of {}'.format(len(assignments)) in html
+        farthest = max(assignments, key=lambda row: row[2])
+        assert '<tr><td>{}</td>'.format(farthest[0]) in html
+        assert html.count('<tr><td>') - len(radii) == 5
+        generate_html_report([result], report, assignment_rows=0)
+        with open(report) as f:
+            assert 'Closest Chosen Strain' not in f.read()
+        generate_html_report([result], report, assignment_rows=None)
+        with open(report) as f:
+            assert f.read().count('<tr><td>') - len(radii) == len(assignments)
+
+
+def test_compact_pd_greedy_matches_pd_greedy():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    compact = CompactTree(tree)
+    picks = compact_pd_greedy(compact, 10, [])
+    assert [compact.nodes[leaf] for leaf in picks] == pd_greedy(tree, 10, [])
+
+
+def test_iter_pd_greedy():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    picks = list(iter_pd_greedy(tree, []))
+    assert [leaf for leaf, _, _ in picks[:6]] == pd_greedy(tree, 6, [])
+    assert len(picks) == len(tree.get_leaves())
+    assert picks[0][1] == 0
+    for number in range(2, 7):
+        names = [leaf.name for leaf, _, _ in picks[:number]]
+        assert picks[number - 1][2] == pytest.approx(phylogenetic_diversity(tree, [names])[0])
+    assert picks[-1][2] == pytest.approx(sum(branch.dist for branch in tree.get_descendants()))
+
+
+def test_iter_pd_greedy_reference_engine():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    starting = get_leaf_nodes_from_names(tree, ['2018-SEQ-0100.fasta'])
+    exclude = ['2018-SEQ-0383.fasta']
+    reference = list(itertools.islice(iter_pd_greedy(tree, starting, exclude=exclude, engine='reference'), 8))
+    fast = list(itertools.islice(iter_pd_greedy(tree, starting, exclude=exclude), 8))
+    assert [leaf for leaf, _, _ in reference] == pd_greedy(tree, 8, starting, exclude=exclude)
+    assert [total for _, _, total in reference] == pytest.approx([total for _, _, total in fast])
+    assert pd_greedy_until(tree, [], pd_fraction=0.5, engine='reference') == pd_greedy_until(tree, [], pd_fraction=0.5)
+    with pytest.raises(ValueError):
+        next(iter_pd_greedy(tree, [], engine='slow'))
+
+
+def test_pd_greedy_until_fraction():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    total_branch_length = sum(branch.dist for branch in tree.get_descendants())
+    strains = pd_greedy_until(tree, [], pd_fraction=0.9)
+    assert strains == pd_greedy(tree, len(strains), [])
+    names = get_leaf_names_from_nodes(strains)
+    assert phylogenetic_diversity(tree, [names])[0] >= 0.9 * total_branch_length
+    assert phylogenetic_diversity(tree, [names[:-1]])[0] < 0.9 * total_branch_length
+
+
+def test_pd_greedy_until_min_gain():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    picks = list(iter_pd_greedy(tree, []))
+    strains = pd_greedy_until(tree, [], min_gain=0.01)
+    assert all(gain >= 0.01 for _, gain, _ in picks[2:len(strains)])
+    assert picks[len(strains)][1] < 0.01
+    assert len(pd_greedy_until(tree, [], pd_fraction=1, max_tips=5)) == 5
+
+
+def test_pd_greedy_fast_engine():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    assert pd_greedy(tree, 10, [], engine='fast') == pd_greedy(tree, 10, [])
+
+
+def test_pd_greedy_fast_engine_keeps_starting_strains():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    starting_strains = get_leaf_nodes_from_names(tree, ['2018-SEQ-0100.fasta', '2018-SEQ-0559.fasta',
+                                                        '2017-MER-0763.fasta'])
+    strains = pd_greedy(tree, 2, starting_strains, engine='fast')
+    assert get_leaf_names_from_nodes(strains) == ['2018-SEQ-0100.fasta', '2018-SEQ-0559.fasta', '2017-MER-0763.fasta']
+
+
+def test_pd_greedy_bad_engine():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    with pytest.raises(ValueError):
+        pd_greedy(tree, 4, [], engine='turbo')
+
+
+def test_pd_greedy_exclude():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    excluded = ['2018-SEQ-0383.fasta', '2018-SEQ-0385.fasta']
+    strains = pd_greedy(tree, 6, [], exclude=excluded)
+    assert not set(excluded).intersection(get_leaf_names_from_nodes(strains))
+    assert pd_greedy(tree, 6, [], engine='fast', exclude=excluded) == strains
+    collapsed = pd_greedy(tree, 6, [], collapse_threshold=0.01, exclude=excluded)
+    assert not set(excluded).intersection(get_leaf_names_from_nodes(collapsed))
+    with pytest.raises(ValueError):
+        pd_greedy(tree, 6, get_leaf_nodes_from_names(tree, excluded[:1]), exclude=excluded)
+
+
+def test_budget_pd_exact_matches_brute_force():
+    rng = random.Random(0)
+    for _ in range(50):
+        tree = ete3.Tree(differential.random_tree(rng, rng.randint(2, 8)))
+        names = tree.get_leaf_names()
+        costs = {name: rng.randint(0, 4) for name in names}
+        budget = rng.randint(0, 10)
+        best = 0.0
+        for size in range(1, len(names) + 1):
+            for subset in itertools.combinations(names, size):
+                if sum(costs[name] for name in subset) <= budget:
+                    best = max(best, phylogenetic_diversity(tree, [list(subset)])[0])
+        selection = budget_pd(tree, costs, budget, resolution=max(budget, 1))
+        assert selection.phylogenetic_diversity == pytest.approx(best)
+        assert selection.cost <= budget
+        greedy = budget_pd(tree, costs, budget, method='greedy')
+        assert greedy.cost <= budget
+        assert greedy.phylogenetic_diversity <= best + 1e-9
+
+
+def test_budget_pd_starting_strains_and_exclude():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    costs = read_weights_file('tests/text_files/costs.txt')
+    starting = get_leaf_nodes_from_names(tree, ['2018-SEQ-0383.fasta'])
+    for method in ('exact', 'greedy'):
+        selection = budget_pd(tree, costs, 8, method=method, starting_strains=starting,
+                              exclude=['2018-SEQ-0385.fasta'], default_cost=1)
+        names = get_leaf_names_from_nodes(selection.strains)
+        assert names[0] == '2018-SEQ-0383.fasta'
+        assert '2018-SEQ-0385.fasta' not in names
+        assert selection.cost <= 8
+        assert selection.peak_bytes > 0
+    with pytest.raises(ValueError):
+        budget_pd(tree, costs, 4, starting_strains=starting, default_cost=1)
+    with pytest.raises(RuntimeError):
+        budget_pd(tree, costs, 8)
+
+
+def test_read_clade_quotas():
+    assert read_clade_quotas('tests/text_files/clade_quotas.txt') == {'MER': (2, None), 'SEQ': (None, 2)}
+
+
+def test_read_clade_metadata():
+    groups = read_clade_metadata('tests/text_files/clade_metadata.tsv', column='lineage')
+    assert groups['2017-MER-0763.fasta'] == 'MER'
+    assert groups['2018-STH-0005.fasta'] == 'OTHER'
+    assert read_clade_metadata('tests/text_files/clade_metadata.tsv')['2017-MER-0763.fasta'] == '2017'
+    with pytest.raises(RuntimeError):
+        read_clade_metadata('tests/text_files/clade_metadata.tsv', column='serotype')
+
+
+def test_pd_greedy_clade_quotas():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    groups = read_clade_metadata('tests/text_files/clade_metadata.tsv', column='lineage')
+    quotas = CladeQuotas(read_clade_quotas('tests/text_files/clade_quotas.txt'), groups=groups, minimum=1)
+    picks = get_leaf_names_from_nodes(pd_greedy(tree, 6, [], quotas=quotas))
+    lineages = [groups[name] for name in picks]
+    assert len(picks) == 6
+    assert lineages.count('MER') >= 2
+    assert lineages.count('SEQ') <= 2
+    assert lineages.count('OTHER') >= 1
+    assert get_leaf_names_from_nodes(pd_greedy(tree, 6, [], quotas=quotas)) == picks
+    # Quotas that never come into play pick the same strains as usual.
+    loose = CladeQuotas(groups=groups, maximum=36)
+    assert pd_greedy(tree, 6, [], quotas=loose) == pd_greedy(tree, 6, [], engine='fast')
+    with pytest.raises(ValueError):
+        pd_greedy(tree, 6, [], quotas=CladeQuotas(groups=groups, minimum=3))
+    with pytest.raises(ValueError):
+        pd_greedy(tree, 6, get_leaf_nodes_from_names(tree, ['2018-SEQ-0383.fasta', '2018-SEQ-0100.fasta',
+                                                            '2018-SEQ-0385.fasta']), quotas=quotas)
+
+
+def test_pd_greedy_clade_quotas_internal_nodes():
+    tree = ete3.Tree('((a:1,(b:2,c:3)inner:1)outer:1,(d:4,e:5)other:1);', format=1)
+    quotas = CladeQuotas({'outer': (None, 1), 'other': (None, 1)})
+    assert len(pd_greedy(tree, 3, [], quotas=quotas)) == 2
+    quotas = CladeQuotas({'inner': (2, None), 'other': (None, 1)})
+    assert sorted(get_leaf_names_from_nodes(pd_greedy(tree, 3, [], quotas=quotas))) == ['b', 'c', 'e']
+    with pytest.raises(RuntimeError):
+        pd_greedy(tree, 3, [], quotas=CladeQuotas({'nowhere': (1, None)}))
+
+
+def test_cut_clusters():
+    tree = ete3.Tree('((a:1,b:1):1,(c:0.5,(d:0.25,e:0.25):0.25):3);')
+    representatives, table = cut_clusters(tree, 2)
+    assert get_leaf_names_from_nodes(representatives) == ['d', 'a']
+    assert table == [('a', 2, 'a', 0.0), ('b', 2, 'a', 2.0), ('c', 1, 'd', 1.0), ('d', 1, 'd', 0.0),
+                     ('e', 1, 'd', 0.5)]
+    representatives, _ = cut_clusters(tree, 2, starting_strains=get_leaf_nodes_from_names(tree, ['c']))
+    assert get_leaf_names_from_nodes(representatives) == ['c', 'a']
+    assert len(cut_clusters(tree, 0)[0]) == 5
+    assert len(cut_clusters(tree, 100)[0]) == 1
+
+
+def test_cut_clusters_diameter():
+    rng = random.Random(0)
+    for _ in range(50):
+        tree = ete3.Tree(differential.random_tree(rng, rng.randint(2, 15)))
+        cut_distance = rng.choice([0, 0.5, 1, 2])
+        representatives, table = cut_clusters(tree, cut_distance)
+        clusters = dict()
+        for strain, cluster, _, _ in table:
+            clusters.setdefault(cluster, list()).append(strain)
+        assert len(clusters) == len(representatives)
+        for members in clusters.values():
+            for first, second in itertools.combinations(members, 2):
+                assert tree.get_distance(first, second) <= cut_distance + 1e-9
+
+
+def test_selection_scenarios():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    scenarios = SelectionScenarios(tree)
+    assert scenarios.panel(6) == get_leaf_names_from_nodes(pd_greedy(tree, 6, []))
+    assert scenarios.panel(3) == scenarios.panel(6)[:3]
+    excluded = ['2018-SEQ-0383.fasta', 'not-in-tree.fasta']
+    expected = pd_greedy(tree, 5, [], exclude=excluded)
+    assert scenarios.panel(5, excluded=excluded) == get_leaf_names_from_nodes(expected)
+    forced = ['2018-SEQ-0559.fasta']
+    assert scenarios.panel(5, forced=forced) == \
+        get_leaf_names_from_nodes(pd_greedy(tree, 5, get_leaf_nodes_from_names(tree, forced)))
+    panel = scenarios.panel(4)
+    assert scenarios.phylogenetic_diversity(panel) == pytest.approx(phylogenetic_diversity(tree, [panel])[0])
+    with pytest.raises(ValueError):
+        scenarios.panel(5, forced=forced, excluded=forced)
+    with pytest.raises(RuntimeError):
+        scenarios.panel(5, forced=['not-in-tree.fasta'])
+
+
+def test_compare_engines():
+    summary = differential.compare_engines(number_trees=40, seed=1, max_leaves=12)
+    assert summary['mismatches'] == []
+    assert summary['matches'] + summary['reference_errors'] == 40
+
+
+def test_compact_tree_collapse():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    compact = CompactTree(tree)
+    collapsed, representative, clade_size = compact.collapse(0.001)
+    assert len(collapsed.leaves) < len(compact.leaves)
+    assert clade_size[collapsed.leaves].sum() == len(compact.leaves)
+    for leaf in collapsed.leaves:
+        assert collapsed.depth[leaf] == pytest.approx(compact.depth[representative[leaf]])
+        assert collapsed.names[leaf] == compact.names[representative[leaf]]
+
+
+def test_compact_tree_collapse_keeps_starting_leaves():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    compact = CompactTree(tree)
+    keep = compact.name_index['2017-MER-0762.fasta']
+    collapsed, representative, clade_size = compact.collapse(0.001, keep=[keep])
+    assert keep in representative
+
+
+def test_collapsed_pd_greedy():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    compact = CompactTree(tree)
+    for number in [4, 10, 36]:
+        picks = collapsed_pd_greedy(compact, number, [], 0.01)
+        assert picks == compact_pd_greedy(compact, number, [])
+    strains = pd_greedy(tree, 10, [], collapse_threshold=0.01)
+    assert strains == pd_greedy(tree, 10, [])
+
+
+def test_collapsed_pd_greedy_is_approximate(caplog):
+    # X2 adds more than Z, but it's collapsed in with X1, so it has to wait until Z has been picked.
+    compact = CompactTree(ete3.Tree('((X1:0.009,X2:0.009):1,(Z:0.005,(A:1,B:1):1):1);'))
+    caplog.set_level(logging.INFO)
+    assert [compact.names[leaf] for leaf in compact_pd_greedy(compact, 4, [])] == ['X1', 'A', 'B', 'X2']
+    assert [compact.names[leaf] for leaf in collapsed_pd_greedy(compact, 4, [], 0.01)] == ['X1', 'A', 'B', 'Z']
+    assert 'stand for 5 of 5 strains' in caplog.text
+
+
+@pytest.mark.parametrize('engine', ['reference', 'fast'])
+def test_pd_greedy_resume_from_checkpoint(engine):
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    uninterrupted = pd_greedy(tree, 8, [], engine=engine)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        checkpoint_file = os.path.join(tmpdir, 'checkpoint.json')
+        # Picking 5 strains stands in for a run that got killed after its 5th pick.
+        pd_greedy(tree, 5, [], engine=engine, checkpoint_file=checkpoint_file, checkpoint_every=1)
+        with open(checkpoint_file) as f:
+            assert len(json.load(f)['chosen']) == 5
+        resumed = pd_greedy(tree, 8, [], engine=engine, checkpoint_file=checkpoint_file, resume=True)
+        assert resumed == uninterrupted
+        assert pd_greedy(tree, 3, [], engine=engine, checkpoint_file=checkpoint_file, resume=True) == uninterrupted[:3]
+
+
+def test_pd_greedy_checkpoint_different_tree():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        checkpoint_file = os.path.join(tmpdir, 'checkpoint.json')
+        pd_greedy(tree, 4, [], engine='fast', checkpoint_file=checkpoint_file)
+        tree.get_leaves()[0].dist += 0.001
+        with pytest.raises(ValueError):
+            pd_greedy(tree, 8, [], engine='fast', checkpoint_file=checkpoint_file, resume=True)
+
+
+def test_pd_greedy_checkpoint_different_engine():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        checkpoint_file = os.path.join(tmpdir, 'checkpoint.json')
+        pd_greedy(tree, 4, [], engine='fast', checkpoint_file=checkpoint_file)
+        with pytest.raises(ValueError):
+            pd_greedy(tree, 8, [], checkpoint_file=checkpoint_file, resume=True)
+
+
+def test_compact_phylogenetic_diversity():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    compact = CompactTree(tree)
+    names = ['2018-SEQ-0383.fasta', '2018-SEQ-0100.fasta', '2018-SEQ-0385.fasta', '2017-MER-0763.fasta']
+    pruned_tree = tree.copy()
+    pruned_tree.prune(names, preserve_branch_length=True)
+    total_branch_length = sum(branch.dist for branch in pruned_tree.get_descendants())
+    pd = compact.phylogenetic_diversity([compact.name_index[name] for name in names])
+    assert pd == pytest.approx(total_branch_length)
+
+
+def test_compact_induced_subtree():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    compact = CompactTree(tree)
+    names = ['2018-SEQ-0383.fasta', '2018-SEQ-0100.fasta', '2018-SEQ-0385.fasta', '2017-MER-0763.fasta',
+             '2018-SEQ-0559.fasta']
+    pruned_tree = tree.copy()
+    pruned_tree.prune(names, preserve_branch_length=True)
+    subtree = ete3.Tree(compact.induced_subtree([compact.name_index[name] for name in names]))
+    assert sorted(subtree.get_leaf_names()) == sorted(names)
+    assert sum(branch.dist for branch in subtree.get_descendants()) == \
+        pytest.approx(sum(branch.dist for branch in pruned_tree.get_descendants()))
+    for first in names:
+        for second in names:
+            if first != second:
+                assert subtree.get_distance(first, second) == pytest.approx(pruned_tree.get_distance(first, second))
+    assert compact.induced_subtree([compact.name_index[names[0]]]) == names[0] + ';'
+
+
+def test_compact_induced_subtree_quotes_names():
+    compact = CompactTree(ete3.Tree('((a:1,b:2):1,c:3);'))
+    compact.names[compact.name_index['a']] = 'strain (a)'
+    assert compact.induced_subtree(list(compact.leaves)) == "(('strain (a)':1.0,b:2.0):1.0,c:3.0);"
+
+
+def test_phylogenetic_diversity_many_sets():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    sets = [['2018-SEQ-0383.fasta', '2018-SEQ-0100.fasta', '2018-SEQ-0385.fasta', '2017-MER-0763.fasta'],
+            ['2018-SEQ-0525.fasta', '2018-SEQ-0554.fasta', '2018-STH-0005.fasta'],
+            ['2018-SEQ-0100.fasta']]
+    diversities = phylogenetic_diversity(tree, sets)
+    for strain_set, diversity in zip(sets[:2], diversities):
+        pruned_tree = tree.copy()
+        pruned_tree.prune(strain_set, preserve_branch_length=True)
+        assert diversity == pytest.approx(sum(branch.dist for branch in pruned_tree.get_descendants()))
+    assert diversities[2] == 0
+
+
+def test_phylogenetic_diversity_bad_name():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    with pytest.raises(RuntimeError):
+        phylogenetic_diversity(tree, [['2018-SEQ-0100.fasta', 'super_fake_leaf']])
+
+
+def test_lowest_common_ancestors():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    compact = CompactTree(tree)
+    first = np.arange(len(compact.nodes))
+    second = first[::-1]
+    ancestors = compact.lowest_common_ancestors(first, second)
+    for one, two, ancestor in zip(first, second, ancestors):
+        assert compact.nodes[ancestor] is compact.nodes[one].get_common_ancestor(compact.nodes[two])
+
+
+def test_read_strain_sets():
+    strain_sets = read_strain_sets('tests/text_files/strain_sets.txt')
+    assert len(strain_sets) == 3
+    assert strain_sets[1] == ('close', ['2017-MER-0763.fasta', '2018-SEQ-0559.fasta'])
+
+
+def test_read_strain_sets_bad_line():
+    with pytest.raises(RuntimeError):
+        read_strain_sets('tests/text_files/strain_sets_bad_line.txt')
+
+
+def test_evaluate_strain_sets():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_file = os.path.join(tmpdir, 'evaluation.tsv')
+        results = evaluate_strain_sets('tests/tree_files/tree.nwk', 'tests/text_files/strain_sets.txt',
+                                       output_file=output_file)
+        assert os.path.isfile(output_file)
+    assert [result[0] for result in results] == ['greedy', 'close', 'single']
+    assert results[0][1] == 4
+    assert 0 < results[0][3] < 1
+    assert results[1][2] == 0
+
+
+def test_main_evaluate():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_file = os.path.join(tmpdir, 'evaluation.tsv')
+        fake_args = ['strainchoosr', 'evaluate', '-t', 'tests/tree_files/tree.nwk', '-s',
+                     'tests/text_files/strain_sets.txt', '-o', output_file]
+        with patch('sys.argv', fake_args):
+            main()
+            assert os.path.isfile(output_file)
+
+
+def test_weighted_branch_lengths():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    weights = read_weights_file('tests/text_files/weights.txt')
+    weighted = CompactTree(modify_tree_with_weights(tree, weights))
+    assert np.allclose(weighted_branch_lengths(CompactTree(tree), weights), weighted.dist)
+    with pytest.raises(AttributeError):
+        weighted_branch_lengths(CompactTree(tree), {'not-in-tree.fasta': 2})
+
+
+@pytest.mark.parametrize('threads', [1, 2])
+def test_sweep_scenarios(threads):
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    weights = read_weights_file('tests/text_files/weights.txt')
+    starting_sets = [('automatic', []), ('single', ['2018-SEQ-0100.fasta'])]
+    results = sweep_scenarios(tree, [('unweighted', {}), ('weighted', weights)], starting_sets, [3, 5],
+                              threads=threads)
+    assert len(results) == 8
+    weighted_tree = modify_tree_with_weights(tree, weights)
+    for result in results:
+        starting_strains = get_leaf_nodes_from_names(tree, ['2018-SEQ-0100.fasta']) \
+            if result['starting_set'] == 'single' else []
+        if result['weighting'] == 'weighted':
+            starting_strains = get_leaf_nodes_from_names(weighted_tree, get_leaf_names_from_nodes(starting_strains))
+        expected = pd_greedy(weighted_tree if result['weighting'] == 'weighted' else tree, result['number'],
+                             starting_strains, engine='fast')
+        assert result['strains'] == get_leaf_names_from_nodes(expected)
+        assert result['overlap'][result['scenario']] == result['number']
+    assert results[0]['phylogenetic_diversity'] == pytest.approx(phylogenetic_diversity(tree,
+                                                                                        [results[0]['strains']])[0])
+
+
+def test_main_sweep():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_file = os.path.join(tmpdir, 'sweep.tsv')
+        fake_args = ['strainchoosr', 'sweep', '-t', 'tests/tree_files/tree.nwk', '-n', '3', '5', '--weight_files',
+                     'tests/text_files/weights.txt', '-s', 'tests/text_files/strain_sets.txt', '-o', output_file]
+        with patch('sys.argv', fake_args):
+            main()
+        with open(output_file) as f:
+            lines = f.read().splitlines()
+    assert len(lines) == 1 + 2 * 4 * 2
+    assert lines[0].split('\t')[:6] == ['Scenario', 'Weighting', 'StartingSet', 'Strains', 'PhylogeneticDiversity',
+                                        'FractionOfTreeLength']
+
+
+def test_read_trees():
+    trees = read_trees('tests/tree_files/replicate_trees.nwk')
+    assert len(trees) == 5
+    assert sorted(trees[0].get_leaf_names()) == sorted(ete3.Tree('tests/tree_files/tree.nwk').get_leaf_names())
+
+
+@pytest.mark.parametrize('treefile', ['tree.nwk.gz', 'tree.nwk.bz2', 'tree.nwk.xz', 'tree.nex', 'tree.xml'])
+def test_load_tree_formats(treefile):
+    expected = CompactTree(load_tree('tests/tree_files/tree.nwk'))
+    compact = CompactTree(load_tree(os.path.join('tests/tree_files', treefile)))
+    assert compact.leaf_names == expected.leaf_names
+    assert np.array_equal(compact.parent, expected.parent)
+    assert np.allclose(compact.dist, expected.dist)
+
+
+def test_read_trees_nexus():
+    trees = read_trees('tests/tree_files/tree.nex')
+    assert len(trees) == 2
+    assert trees[1].get_leaf_names() == ete3.Tree('tests/tree_files/tree.nwk').get_leaf_names()
+
+
+def test_parse_trees_no_trees():
+    with pytest.raises(RuntimeError):
+        parse_trees('#NEXUS\nbegin taxa;\nend;\n')
+
+
+def test_replicate_pd_greedy():
+    trees = read_trees('tests/tree_files/replicate_trees.nwk')
+    selection = replicate_pd_greedy(trees, 5)
+    assert len(selection.consensus) == 5
+    assert len(selection.mean_pd) == 5
+    assert selection.mean_pd == sorted(selection.mean_pd)
+    for replicate_tree, picks in zip(trees, selection.replicate_picks):
+        assert picks == get_leaf_names_from_nodes(pd_greedy(replicate_tree, 5, []))
+    frequencies = selection.frequencies(5)
+    assert all(0 < frequency <= 1 for frequency in frequencies.values())
+    mean_pd = 0
+    for replicate_tree in trees:
+        compact = CompactTree(replicate_tree)
+        mean_pd += compact.phylogenetic_diversity([compact.name_index[name] for name in selection.consensus])
+    assert selection.mean_pd[-1] == pytest.approx(mean_pd / len(trees))
+
+
+def test_replicate_pd_greedy_exclude():
+    trees = read_trees('tests/tree_files/replicate_trees.nwk')
+    excluded = replicate_pd_greedy(trees, 2).consensus
+    selection = replicate_pd_greedy(trees, 5, exclude=excluded)
+    assert len(selection.consensus) == 5
+    assert not set(excluded).intersection(selection.consensus)
+    for replicate_tree, picks in zip(trees, selection.replicate_picks):
+        assert picks == get_leaf_names_from_nodes(pd_greedy(replicate_tree, 5, [], exclude=excluded, engine='fast'))
+
+
+def test_replicate_pd_greedy_multiple_processes():
+    trees = read_trees('tests/tree_files/replicate_trees.nwk')
+    single_process = replicate_pd_greedy(trees, 5, starting_strains=['2018-SEQ-0525.fasta'])
+    multiple_processes = replicate_pd_greedy(trees, 5, starting_strains=['2018-SEQ-0525.fasta'], threads=2)
+    assert single_process.consensus[0] == '2018-SEQ-0525.fasta'
+    assert single_process.consensus == multiple_processes.consensus
+    assert single_process.replicate_picks == multiple_processes.replicate_picks
+
+
+def test_replicate_pd_greedy_different_leaves():
+    trees = [ete3.Tree('tests/tree_files/tree.nwk'), ete3.Tree('tests/tree_files/tree_multiple_same_name.nwk')]
+    with pytest.raises(RuntimeError):
+        replicate_pd_greedy(trees, 5)
+
+
+def test_read_distance_matrix_tsv():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        names, matrix = read_distance_matrix('tests/text_files/distance_matrix.tsv', tmpdir)
+        assert names == ['A', 'B', 'C', 'D', 'E', 'F']
+        assert matrix.shape == (6, 6)
+        assert matrix[1, 4] == 1.1
+
+
+def test_read_distance_matrix_phylip_matches_tsv():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tsv_names, tsv_matrix = read_distance_matrix('tests/text_files/distance_matrix.tsv', tmpdir)
+        tsv_matrix = np.array(tsv_matrix)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        phylip_names, phylip_matrix = read_distance_matrix('tests/text_files/distance_matrix.phy', tmpdir)
+        assert phylip_names == tsv_names
+        assert np.array_equal(phylip_matrix, tsv_matrix)
+
+
+def test_read_distance_matrix_npy():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        names, matrix = read_distance_matrix('tests/text_files/distance_matrix.tsv', tmpdir)
+        np.save(os.path.join(tmpdir, 'matrix.npy'), matrix)
+        with open(os.path.join(tmpdir, 'names.txt'), 'w') as f:
+            f.write('\n'.join(names) + '\n')
+        npy_names, npy_matrix = read_distance_matrix(os.path.join(tmpdir, 'matrix.npy'), tmpdir,
+                                                     names_file=os.path.join(tmpdir, 'names.txt'))
+        assert npy_names == names
+        assert isinstance(npy_matrix, np.memmap)
+        assert np.array_equal(npy_matrix, matrix)
+
+
+def test_read_distance_matrix_bad_row():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with pytest.raises(RuntimeError):
+            read_distance_matrix('tests/text_files/distance_matrix_bad_row.tsv', tmpdir)
+
+
+def test_neighbor_joining_tree():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        names, matrix = read_distance_matrix('tests/text_files/distance_matrix.tsv', tmpdir)
+        tree = neighbor_joining_tree(names, matrix, tmpdir)
+        # The matrix came from a tree, so neighbor joining should get the same distances back.
+        for i, name_one in enumerate(names):
+            for j, name_two in enumerate(names):
+                distance = tree.get_distance(tree.get_leaves_by_name(name_one)[0], tree.get_leaves_by_name(name_two)[0])
+                assert distance == pytest.approx(matrix[i, j])
+
+
+def test_matrix_farthest_point_greedy():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        names, matrix = read_distance_matrix('tests/text_files/distance_matrix.tsv', tmpdir)
+        picks = matrix_farthest_point_greedy(names, matrix, 3, [])
+        assert [names[row] for row in picks] == ['B', 'E', 'F']
+        picks = matrix_farthest_point_greedy(names, matrix, 3, ['C'])
+        assert [names[row] for row in picks] == ['C', 'B', 'F']
+        radii, assignments = matrix_coverage_by_prefix(names, matrix, picks)
+        assert radii == [0.8, 0.7, 0.4]
+        assert ('A', 'B', 0.3) in assignments
+
+
+def test_copy_tree():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    tree.get_leaves()[0].add_feature('color', 'red')
+    new_tree = copy_tree(tree)
+    assert new_tree.write(features=['color']) == tree.write(features=['color'])
+    assert not set(tree.traverse()) & set(new_tree.traverse())
+
+
+def test_ladderize_tree():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    new_tree = copy_tree(tree)
+    tree.ladderize()
+    ladderize_tree(new_tree)
+    assert new_tree.write() == tree.write()
+
+
+def test_deep_tree():
+    # Much deeper than python's default recursion limit.
+    tree = load_tree(benchmark.caterpillar_tree(5000))
+    new_tree = copy_tree(tree)
+    ladderize_tree(new_tree)
+    weighted_tree = modify_tree_with_weights(tree, {'strain_4999': 2})
+    assert weighted_tree.get_leaves_by_name('strain_4999')[0].dist == 2 * tree.get_leaves_by_name('strain_4999')[0].dist
+    strains = pd_greedy(weighted_tree, 10, [], engine='fast')
+    assert len(set(get_leaf_names_from_nodes(strains))) == 10
+    radii, assignments = coverage_by_prefix(weighted_tree, strains)
+    assert len(assignments) == 5000
+
+
+def test_run_strainchoosr_deep_tree():
+    # Deeper than python's default recursion limit, but small enough to draw quickly.
+    tree = load_tree(benchmark.caterpillar_tree(1100))
+    assert tree_levels(tree) == 1099
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tree_file = os.path.join(tmpdir, 'deep.nwk')
+        tree.write(outfile=tree_file, format=1, dist_formatter='%r')
+        # Left to pick an engine, run_strainchoosr uses the fast one, since the reference one would take hours.
+        with patch('strainchoosr.strainchoosr.find_next_leaf', side_effect=AssertionError('should use fast engine')):
+            output_dict = run_strainchoosr(treefile=tree_file,
+                                           number_representatives=[4],
+                                           output_name=os.path.join(tmpdir, 'st_report'))
+        with open(os.path.join(tmpdir, 'st_report.html')) as f:
+            assert 'data:image/png;base64,' in f.read()
+    assert output_dict[4] == get_leaf_names_from_nodes(pd_greedy(tree, 4, [], engine='fast'))
+
+
 def test_tree_draw():
     with tempfile.TemporaryDirectory() as tmpdir:
         tree = ete3.Tree('tests/tree_files/tree.nwk')
@@ -192,6 +973,38 @@ def test_tree_draw():
         assert os.path.isfile(output_file)
 
 
+def test_tree_draw_cached():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = ImageCache(os.path.join(tmpdir, 'cache'))
+        tree = ete3.Tree('tests/tree_files/tree.nwk')
+        representatives = ['2018-SEQ-0383.fasta', '2018-SEQ-0100.fasta', '2018-SEQ-0385.fasta', '2017-MER-0763.fasta']
+        create_colored_tree_tip_image(tree, representatives, os.path.join(tmpdir, 'first.png'), cache=cache)
+        with patch('ete3.TreeNode.render', side_effect=AssertionError('should come from the cache')):
+            create_colored_tree_tip_image(tree, representatives[::-1], os.path.join(tmpdir, 'second.png'), cache=cache)
+        with open(os.path.join(tmpdir, 'first.png'), 'rb') as first, open(os.path.join(tmpdir, 'second.png'), 'rb') \
+                as second:
+            assert first.read() == second.read()
+        assert ImageCache.key(tree, representatives, 'red', 'r', 0, '.png') != \
+            ImageCache.key(tree, representatives, 'blue', 'r', 0, '.png')
+        assert ImageCache.key(tree, representatives, 'red', 'r', 0, '.png') != \
+            ImageCache.key(tree, representatives[:3], 'red', 'r', 0, '.png')
+
+
+def test_image_cache_eviction():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = ImageCache(os.path.join(tmpdir, 'cache'), max_bytes=250)
+        image_file = os.path.join(tmpdir, 'image.png')
+        with open(image_file, 'wb') as f:
+            f.write(b'x' * 100)
+        for number, key in enumerate(['a', 'b', 'c']):
+            cache.store(key, '.png', image_file)
+            os.utime(os.path.join(cache.cache_dir, key + '.png'), (number, number))
+        cache.store('d', '.png', image_file)
+        assert sorted(os.listdir(cache.cache_dir)) == ['c.png', 'd.png']
+        assert not cache.fetch('a', '.png', os.path.join(tmpdir, 'out.png'))
+        assert cache.fetch('c', '.png', os.path.join(tmpdir, 'out.png'))
+
+
 def test_tree_draw_pdf():
     with tempfile.TemporaryDirectory() as tmpdir:
         tree = ete3.Tree('tests/tree_files/tree.nwk')
@@ -254,6 +1067,31 @@ def test_argument_parsing_mostly_defaults():
     assert args.weight_file is None
     assert args.starting_strains == []
     assert args.verbosity == 'info'
+    assert args.objective == 'pd'
+
+
+def test_argument_parsing_distance_matrix():
+    args = argument_parsing(['--distance_matrix', 'tests/text_files/distance_matrix.tsv', '-n', '3'])
+    assert args.treefile is None
+    assert args.distance_matrix == 'tests/text_files/distance_matrix.tsv'
+
+
+def test_argument_parsing_tree_and_distance_matrix():
+    with pytest.raises(SystemExit):
+        argument_parsing(['-t', 'tests/tree_files/tree.nwk', '--distance_matrix',
+                          'tests/text_files/distance_matrix.tsv', '-n', '3'])
+
+
+def test_argument_parsing_pd_fraction():
+    args = argument_parsing(['-t', 'tests/tree_files/tree.nwk', '--pd_fraction', '0.9'])
+    assert args.number is None
+    assert args.pd_fraction == 0.9
+    assert args.min_gain is None
+
+
+def test_argument_parsing_no_number():
+    with pytest.raises(SystemExit):
+        argument_parsing(['-t', 'tests/tree_files/tree.nwk'])
 
 
 def test_argument_parsing_starting_strains():
@@ -285,6 +1123,389 @@ def test_run_strainchoosr_output_dictionary():
     assert output_dict[4] == ['2018-SEQ-0383.fasta', '2018-SEQ-0100.fasta', '2018-SEQ-0385.fasta', '2017-MER-0763.fasta']
 
 
+def test_run_strainchoosr_pd_fraction():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=None,
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       pd_fraction=0.5)
+        assert os.path.isfile(os.path.join(tmpdir, 'st_report.html'))
+    assert len(output_dict) == 1
+    number = list(output_dict.keys())[0]
+    expected = pd_greedy(ete3.Tree('tests/tree_files/tree.nwk'), number, [])
+    assert output_dict[number] == get_leaf_names_from_nodes(expected)
+
+
+def test_run_strainchoosr_min_gain_wrong_objective():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with pytest.raises(ValueError):
+            run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                             number_representatives=None,
+                             output_name=os.path.join(tmpdir, 'st_report'),
+                             objective='kcenter',
+                             min_gain=0.01)
+
+
+def test_run_strainchoosr_profile():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                         number_representatives=[3, 4],
+                         output_name=os.path.join(tmpdir, 'st_report'),
+                         profile_file=os.path.join(tmpdir, 'profile.json'),
+                         cprofile_dir=os.path.join(tmpdir, 'cprofile'))
+        with open(os.path.join(tmpdir, 'profile.json')) as f:
+            profile = json.load(f)
+        for stage in ['parse', 'starting_leaves', 'selection', 'rendering', 'coverage', 'report']:
+            assert stage in profile['stages']
+            assert os.path.isfile(os.path.join(tmpdir, 'cprofile', '{}.prof'.format(stage)))
+        assert profile['stages']['selection']['calls'] == 2
+        # 34 candidates for strain 3, then 34 + 33 when picking 4 strains.
+        assert profile['stages']['selection']['counters']['leaves_evaluated'] == 34 + 34 + 33
+        assert profile['stages']['parse']['counters']['leaves'] == 36
+        assert profile['stages']['report']['counters']['images_embedded_bytes'] == \
+            profile['stages']['rendering']['counters']['image_bytes']
+
+
+def test_stage_profiler_disabled():
+    profiler = StageProfiler()
+    with profiler.stage('parse'):
+        profiler.count('leaves', 5)
+    assert profiler.stages == dict()
+
+
+def test_run_strainchoosr_fast_engine():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=[4],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       engine='fast')
+    assert output_dict[4] == ['2018-SEQ-0383.fasta', '2018-SEQ-0100.fasta', '2018-SEQ-0385.fasta',
+                              '2017-MER-0763.fasta']
+
+
+def test_run_strainchoosr_collapse_threshold():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=[4],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       collapse_threshold=0.001)
+    assert output_dict[4] == ['2018-SEQ-0383.fasta', '2018-SEQ-0100.fasta', '2018-SEQ-0385.fasta',
+                              '2017-MER-0763.fasta']
+
+
+def test_run_strainchoosr_checkpoint():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=[3, 4],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       checkpoint_file=os.path.join(tmpdir, 'checkpoint.json'))
+        assert os.path.isfile(os.path.join(tmpdir, 'checkpoint.json'))
+    assert output_dict[4] == ['2018-SEQ-0383.fasta', '2018-SEQ-0100.fasta', '2018-SEQ-0385.fasta',
+                              '2017-MER-0763.fasta']
+    assert output_dict[3] == output_dict[4][:3]
+
+
+def test_read_previous_selection():
+    assert read_previous_selection('tests/text_files/previous_selection.txt') == ['2018-SEQ-0383.fasta',
+                                                                                  '2018-SEQ-0100.fasta',
+                                                                                  'not-in-tree.fasta']
+
+
+def test_run_strainchoosr_previous_selection():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=[2],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       previous_selection='tests/text_files/previous_selection.txt',
+                                       engine='fast')
+    assert output_dict[4] == ['2018-SEQ-0383.fasta', '2018-SEQ-0100.fasta', '2018-SEQ-0385.fasta',
+                              '2017-MER-0763.fasta']
+
+
+def test_run_strainchoosr_previous_selection_default_engine():
+    # Adding to a previous selection uses the fast engine unless told otherwise.
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with patch('strainchoosr.strainchoosr.find_next_leaf', side_effect=AssertionError('reference engine used')):
+            output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                           number_representatives=[2],
+                                           output_name=os.path.join(tmpdir, 'st_report'),
+                                           previous_selection='tests/text_files/previous_selection.txt')
+    assert output_dict[4] == ['2018-SEQ-0383.fasta', '2018-SEQ-0100.fasta', '2018-SEQ-0385.fasta',
+                              '2017-MER-0763.fasta']
+    assert argument_parsing(['-t', 'tests/tree_files/tree.nwk', '-n', '5']).engine is None
+
+
+def test_read_exclusions():
+    assert read_exclusions(['tests/text_files/previous_selection.txt', 'strain_a']) == ['2018-SEQ-0383.fasta',
+                                                                                        '2018-SEQ-0100.fasta',
+                                                                                        'not-in-tree.fasta',
+                                                                                        'strain_a']
+
+
+def test_run_strainchoosr_exclude():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=[4],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       exclude=['2018-SEQ-0383.fasta'])
+    assert len(output_dict[4]) == 4
+    assert '2018-SEQ-0383.fasta' not in output_dict[4]
+
+
+@pytest.mark.parametrize('objective', ['maxmin', 'kcenter'])
+def test_run_strainchoosr_exclude_objectives(objective):
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=[4],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       objective=objective,
+                                       exclude=['2018-SEQ-0383.fasta'])
+    expected = farthest_point_greedy(tree, 4, [], objective=objective, exclude=['2018-SEQ-0383.fasta'])
+    assert output_dict[4] == get_leaf_names_from_nodes(expected)
+    assert '2018-SEQ-0383.fasta' not in output_dict[4]
+
+
+def test_run_strainchoosr_exclude_replicate_trees():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=[4],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       replicate_treefile='tests/tree_files/replicate_trees.nwk',
+                                       exclude=['2018-SEQ-0383.fasta'])
+    assert len(output_dict[4]) == 4
+    assert '2018-SEQ-0383.fasta' not in output_dict[4]
+
+
+def test_run_strainchoosr_exclude_starting_strain():
+    with pytest.raises(ValueError):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                             number_representatives=[4],
+                             output_name=os.path.join(tmpdir, 'st_report'),
+                             starting_strains=['2018-SEQ-0383.fasta'],
+                             exclude=['2018-SEQ-0383.fasta'])
+
+
+def test_run_strainchoosr_budget():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=None,
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       cost_file='tests/text_files/costs.txt',
+                                       budget=6,
+                                       default_cost=1)
+    assert len(output_dict) == 1
+    picked = list(output_dict.values())[0]
+    costs = read_weights_file('tests/text_files/costs.txt')
+    assert sum(costs.get(name, 1) for name in picked) <= 6
+    with pytest.raises(ValueError):
+        run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                         number_representatives=None,
+                         cost_file='tests/text_files/costs.txt')
+
+
+def test_run_strainchoosr_clade_quotas():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=[4, 6],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       quota_file='tests/text_files/clade_quotas.txt',
+                                       clade_metadata='tests/text_files/clade_metadata.tsv',
+                                       clade_column='lineage')
+    for number in (4, 6):
+        assert len(output_dict[number]) == number
+        assert len([name for name in output_dict[number] if '-MER-' in name]) >= 2
+        assert len([name for name in output_dict[number] if '-SEQ-' in name]) <= 2
+    with pytest.raises(ValueError):
+        run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                         number_representatives=[4],
+                         clade_min=1)
+
+
+@pytest.mark.parametrize('engine', ['reference', 'fast'])
+def test_run_strainchoosr_clade_quotas_automatic_pair(engine):
+    # The automatic starting pair (A and C) breaks the quota, so the quota has to pick the starting strains instead.
+    with tempfile.TemporaryDirectory() as tmpdir:
+        treefile = os.path.join(tmpdir, 'tree.nwk')
+        with open(treefile, 'w') as f:
+            f.write('((A:10,B:1):1,(C:10,D:1):1);')
+        metadata = os.path.join(tmpdir, 'metadata.tsv')
+        with open(metadata, 'w') as f:
+            f.write('strain\tlineage\nA\tX\nC\tX\nB\tY\nD\tY\n')
+        quotas = os.path.join(tmpdir, 'quotas.txt')
+        with open(quotas, 'w') as f:
+            f.write('X\t\t1\n')
+        output_dict = run_strainchoosr(treefile=treefile,
+                                       number_representatives=[2],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       engine=engine,
+                                       quota_file=quotas,
+                                       clade_metadata=metadata)
+    assert output_dict[2] == ['A', 'D']
+
+
+def test_run_strainchoosr_cut_distance():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=None,
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       cut_distance=0.001)
+        with open(os.path.join(tmpdir, 'st_report_clusters.tsv')) as f:
+            lines = f.read().splitlines()
+    picked = list(output_dict.values())[0]
+    assert len(lines) == 37
+    assert {line.split('\t')[2] for line in lines[1:]} == set(picked)
+
+
+def test_draw_image_wrapper():
+    from strainchoosr import strainchoosr_gui
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fake_args = ['strainchoosr_drawimage', 'tests/tree_files/tree.nwk', '4', tmpdir, 'red', 'r']
+        with patch('sys.argv', fake_args), patch('strainchoosr.strainchoosr.create_colored_tree_tip_image') as draw:
+            strainchoosr_gui.draw_image_wrapper()
+        tree = ete3.Tree('tests/tree_files/tree.nwk')
+        assert draw.call_args.kwargs['representatives'] == get_leaf_names_from_nodes(pd_greedy(tree, 4, []))
+        assert draw.call_args.kwargs['output_file'] == os.path.join(tmpdir, 'image.png')
+        assert draw.call_args.kwargs['cache'] is None
+
+
+def test_draw_image_wrapper_uses_given_strains():
+    from strainchoosr import strainchoosr_gui
+    with tempfile.TemporaryDirectory() as tmpdir:
+        strains_file = os.path.join(tmpdir, 'strains.txt')
+        with open(strains_file, 'w') as f:
+            f.write('2018-SEQ-0383.fasta\n2018-SEQ-0100.fasta\n')
+        cache_dir = os.path.join(tmpdir, 'cache')
+        fake_args = ['strainchoosr_drawimage', 'tests/tree_files/tree.nwk', '2', tmpdir, 'red', 'r',
+                     '--strains_file', strains_file, '--cache_dir', cache_dir]
+        with patch('sys.argv', fake_args), \
+                patch('strainchoosr.strainchoosr.pd_greedy', side_effect=AssertionError('strains picked again')):
+            strainchoosr_gui.draw_image_wrapper()
+        assert os.path.isfile(os.path.join(tmpdir, 'image.png'))
+        key = ImageCache.key(ete3.Tree('tests/tree_files/tree.nwk'), ['2018-SEQ-0100.fasta', '2018-SEQ-0383.fasta'],
+                             'red', 'r', 0, '.png')
+        assert os.listdir(cache_dir) == [key + '.png']
+        # Without a cache directory, nothing gets cached.
+        with patch('sys.argv', fake_args[:-2]), patch('strainchoosr.strainchoosr.ImageCache') as cache:
+            strainchoosr_gui.draw_image_wrapper()
+        cache.assert_not_called()
+
+
+def test_image_cache_default_dir():
+    with patch.dict(os.environ, {'XDG_CACHE_HOME': '/somewhere/cache'}):
+        assert ImageCache.default_dir() == os.path.join('/somewhere/cache', 'strainchoosr', 'images')
+    with patch.dict(os.environ, {'XDG_CACHE_HOME': ''}):
+        assert ImageCache.default_dir() == os.path.join(os.path.expanduser('~'), '.cache', 'strainchoosr', 'images')
+
+
+def test_run_strainchoosr_image_cache():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_dir = os.path.join(tmpdir, 'cache')
+        first = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                 number_representatives=[3, 4],
+                                 output_name=os.path.join(tmpdir, 'first'),
+                                 image_cache=cache_dir)
+        assert len(os.listdir(cache_dir)) == 2
+        with patch('ete3.TreeNode.render', side_effect=AssertionError('should come from the cache')):
+            second = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                      number_representatives=[3, 4],
+                                      output_name=os.path.join(tmpdir, 'second'),
+                                      image_cache=cache_dir)
+    assert first == second
+
+
+def test_run_strainchoosr_subtree_output():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=[3, 5],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       weight_file='tests/text_files/weights.txt',
+                                       subtree_output=os.path.join(tmpdir, 'picked'))
+        subtree = ete3.Tree(os.path.join(tmpdir, 'picked_5_strains.nwk'))
+        with open(os.path.join(tmpdir, 'picked_subtrees.tsv')) as f:
+            lines = f.read().splitlines()
+    assert sorted(subtree.get_leaf_names()) == sorted(output_dict[5])
+    assert len(lines) == 3
+    diversity = phylogenetic_diversity(ete3.Tree('tests/tree_files/tree.nwk'), [output_dict[5]])[0]
+    assert float(lines[2].split('\t')[2]) == pytest.approx(diversity)
+    assert sum(branch.dist for branch in subtree.get_descendants()) == pytest.approx(diversity)
+
+
+def test_run_strainchoosr_kcenter():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=[4],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       objective='kcenter')
+        assert os.path.isfile(os.path.join(tmpdir, 'st_report.html'))
+    assert len(output_dict[4]) == 4
+
+
+def test_run_strainchoosr_replicate_trees():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                                       number_representatives=[3, 5],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       replicate_treefile='tests/tree_files/replicate_trees.nwk')
+        assert os.path.isfile(os.path.join(tmpdir, 'st_report.html'))
+    assert output_dict[5][:3] == output_dict[3]
+
+
+def test_run_strainchoosr_distance_matrix():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile=None,
+                                       distance_matrix='tests/text_files/distance_matrix.tsv',
+                                       number_representatives=[3],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       objective='maxmin')
+        assert os.path.isfile(os.path.join(tmpdir, 'st_report.html'))
+    assert output_dict[3] == ['B', 'E', 'F']
+
+
+@pytest.mark.parametrize('objective', ['maxmin', 'kcenter'])
+def test_run_strainchoosr_distance_matrix_exclude(objective):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile=None,
+                                       distance_matrix='tests/text_files/distance_matrix.tsv',
+                                       number_representatives=[3, 5],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       objective=objective,
+                                       exclude=['E'])
+    assert sorted(output_dict[5]) == ['A', 'B', 'C', 'D', 'F']
+    assert 'E' not in output_dict[3]
+
+
+def test_run_strainchoosr_kcenter_moves_starting_pair():
+    tree = ete3.Tree('(A:0.01,(B:0.01,(C:0.01,(D:0.01,(E:0.01,(F:0.01,G:0.01):1):1):1):1):1);')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        treefile = os.path.join(tmpdir, 'tree.nwk')
+        tree.write(outfile=treefile)
+        output_dict = run_strainchoosr(treefile=treefile,
+                                       number_representatives=[2],
+                                       output_name=os.path.join(tmpdir, 'st_report'),
+                                       objective='kcenter')
+    assert output_dict[2] == get_leaf_names_from_nodes(farthest_point_greedy(tree, 2, [], objective='kcenter'))
+
+
+def test_run_strainchoosr_replicate_trees_needs_pd():
+    with pytest.raises(ValueError):
+        run_strainchoosr(treefile='tests/tree_files/tree.nwk',
+                         number_representatives=[3],
+                         objective='maxmin',
+                         replicate_treefile='tests/tree_files/replicate_trees.nwk')
+
+
+def test_run_strainchoosr_distance_matrix_neighbor_joining():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_dict = run_strainchoosr(treefile=None,
+                                       distance_matrix='tests/text_files/distance_matrix.tsv',
+                                       number_representatives=[3],
+                                       output_name=os.path.join(tmpdir, 'st_report'))
+        assert os.path.isfile(os.path.join(tmpdir, 'st_report.html'))
+    assert sorted(output_dict[3][:2]) == ['B', 'E']
+
+
 def test_run_strainchoosr_too_many_strains():
     with pytest.raises(ValueError):
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -330,10 +1551,329 @@ def test_completed_choosr_object():
     assert asdf.representatives == ['asdf', 'fdsa']
 
 
+def test_choose():
+    results = choose('tests/tree_files/tree.nwk', [5, 3])
+    assert [result.name for result in results] == ['5 Strains', '3 Strains']
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    assert results[0].representatives == get_leaf_names_from_nodes(pd_greedy(tree, 5, []))
+    assert results[1].representatives == results[0].representatives[:3]
+    assert results[0].gains[0] == 0
+    assert results[0].pd_totals[-1] == pytest.approx(phylogenetic_diversity(tree, [results[0].representatives])[0])
+    assert 'selection' in results[0].timings
+    assert results[0].image is None
+    assert results[0].coverage_radii is None
+    assert not hasattr(results[0], '__dict__')
+
+
+def test_choose_options():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    result = choose(tree, 4, starting_strains=['2018-SEQ-0559.fasta'], weights='tests/text_files/weights.txt',
+                    exclude=['2018-SEQ-0383.fasta'], engine='reference', coverage=True)[0]
+    weighted_tree = modify_tree_with_weights(tree, read_weights_file('tests/text_files/weights.txt'))
+    expected = pd_greedy(weighted_tree, 4, get_leaf_nodes_from_names(weighted_tree, ['2018-SEQ-0559.fasta']),
+                         exclude=['2018-SEQ-0383.fasta'])
+    assert result.representatives == get_leaf_names_from_nodes(expected)
+    assert len(result.coverage_radii) == 4
+    assert 'weighting' in result.timings
+    with pytest.raises(ValueError):
+        choose(tree, 36, exclude=['2018-SEQ-0383.fasta'])
+
+
+def test_render_results_and_report():
+    results = choose('tests/tree_files/tree.nwk', [3, 4])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        images = render_results('tests/tree_files/tree.nwk', results, os.path.join(tmpdir, 'images'))
+        assert all(os.path.isfile(image) for image in images)
+        assert results[0].image == images[0]
+        generate_html_report(results, os.path.join(tmpdir, 'report.html'))
+        assert os.path.isfile(os.path.join(tmpdir, 'report.html'))
+
+
+def test_pd_greedy_cancel():
+    tree = ete3.Tree('tests/tree_files/tree.nwk')
+    cancel = threading.Event()
+    cancel.set()
+    for engine in ['reference', 'fast']:
+        with pytest.raises(SelectionCancelled):
+            pd_greedy(tree, 10, [], engine=engine, cancel=cancel)
+
+
+def test_async_choose_shares_requests():
+    async def run():
+        async with aio.AsyncStrainChoosr() as choosr:
+            first, second = await asyncio.gather(choosr.choose('tests/tree_files/tree.nwk', [3, 5]),
+                                                 choosr.choose('tests/tree_files/tree.nwk', [3, 5]))
+            diversity = await choosr.evaluate('tests/tree_files/tree.nwk', [first[1].representatives])
+        return first, second, diversity
+    first, second, diversity = asyncio.run(run())
+    assert first is second
+    expected = choose('tests/tree_files/tree.nwk', [3, 5])
+    assert [result.representatives for result in first] == [result.representatives for result in expected]
+    assert diversity[0] == pytest.approx(first[1].pd_totals[-1])
+
+
+def test_async_choose_cancel():
+    newick = benchmark.coalescent_tree(150, seed=1)
+
+    async def run():
+        async with aio.AsyncStrainChoosr(max_workers=1) as choosr:
+            task = asyncio.ensure_future(choosr.choose(newick, 100, engine='reference'))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # With one worker, this only gets to run once the cancelled selection has actually stopped.
+            start = time.perf_counter()
+            await choosr.choose('tests/tree_files/tree.nwk', 3)
+            return time.perf_counter() - start
+    assert asyncio.run(run()) < 5
+
+
+def test_async_choose_process_executor():
+    async def run():
+        async with aio.AsyncStrainChoosr(kind='process', max_workers=1) as choosr:
+            return await choosr.choose(ete3.Tree('tests/tree_files/tree.nwk'), 4)
+    assert asyncio.run(run())[0].representatives == choose('tests/tree_files/tree.nwk', 4)[0].representatives
+
+
+def test_async_choose_matches_choose():
+    # Branch lengths that only differ past 6 significant digits still have to make it to the worker.
+    tree = ete3.Tree('((A:1.0000001,B:1):1,(C:1,D:1.0000002):1,E:0.1);')
+
+    async def run():
+        async with aio.AsyncStrainChoosr() as choosr:
+            return await choosr.choose(tree, 3)
+    assert asyncio.run(run())[0].representatives == choose(tree, 3)[0].representatives == ['A', 'D', 'B']
+
+
+@pytest.mark.parametrize('treefile', ['tests/tree_files/tree.nex', 'tests/tree_files/tree.xml',
+                                      'tests/tree_files/tree.nwk.gz'])
+def test_async_choose_tree_formats(treefile):
+    async def run():
+        async with aio.AsyncStrainChoosr() as choosr:
+            results = await choosr.choose(treefile, 4)
+            diversity = await choosr.evaluate(treefile, [results[0].representatives])
+        return results, diversity
+    results, diversity = asyncio.run(run())
+    assert results[0].representatives == choose(treefile, 4)[0].representatives
+    assert diversity[0] == pytest.approx(results[0].pd_totals[-1])
+
+
+@pytest.mark.parametrize('kind', ['thread', 'process'])
+def test_async_render(kind, capfd):
+    async def run(output_dir):
+        async with aio.AsyncStrainChoosr(kind=kind, max_workers=1) as choosr:
+            results = await choosr.choose('tests/tree_files/tree.nwk', [3, 5])
+            return results, await choosr.render('tests/tree_files/tree.nwk', results, output_dir)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results, images = asyncio.run(run(os.path.join(tmpdir, 'images')))
+        assert images == [os.path.join(tmpdir, 'images', 'strains_3.png'),
+                          os.path.join(tmpdir, 'images', 'strains_5.png')]
+        assert [result.image for result in results] == images
+        assert all(os.path.getsize(image) > 0 for image in images)
+    # Qt complains when it's used from a thread it didn't start.
+    assert 'QObject' not in capfd.readouterr().err
+
+
+def test_async_read_newick_hashes_contents():
+    # A compressed file gets sent (and shared between identical requests) as its tree, not its path.
+    assert aio._read_newick('tests/tree_files/tree.nwk.gz') == aio._read_newick('tests/tree_files/tree.nwk')
+
+
 def test_main():
     with tempfile.TemporaryDirectory() as tmpdir:
         output_stuff = os.path.join(tmpdir, 'st_output')
         fake_args = ['strainchoosr', '-t', 'tests/tree_files/tree.nwk', '-n', '5', '-o', output_stuff]
         with patch('sys.argv', fake_args):
             main()
-            assert os.path.isfile(output_stuff + '.html')
\ No newline at end of file
+            assert os.path.isfile(output_stuff + '.html')
+
+
+@pytest.mark.parametrize('shape', benchmark.SHAPES)
+def test_benchmark_tree_generators(shape):
+    tree = ete3.Tree(benchmark.TREE_GENERATORS[shape](50, seed=3))
+    assert len(tree.get_leaves()) == 50
+    assert len(set(tree.get_leaf_names())) == 50
+    assert benchmark.TREE_GENERATORS[shape](50, seed=3) == benchmark.TREE_GENERATORS[shape](50, seed=3)
+
+
+def test_benchmark_caterpillar_depth():
+    tree = ete3.Tree(benchmark.caterpillar_tree(30))
+    deepest = max(tree.get_leaves(), key=lambda leaf: len(leaf.get_ancestors()))
+    assert len(deepest.get_ancestors()) == 29
+
+
+def test_run_benchmarks_and_compare():
+    results = benchmark.run_benchmarks(sizes=[20], shapes=['balanced'], numbers_to_pick=[3], reference_leaf_limit=0,
+                                       render_leaf_limit=0)
+    operations = [case['operation'] for case in results]
+    assert operations == ['parse', 'compact_tree', 'starting_leaves_fast', 'selection_fast', 'weighting', 'report']
+    assert all(case['error'] is None for case in results)
+    assert benchmark.compare_to_baseline(results, results) == []
+    slower = [dict(case, wall_seconds=case['wall_seconds'] + 1) for case in results]
+    assert len(benchmark.compare_to_baseline(slower, results)) == len(results)
+
+
+def _write_manifest(directory, jobs):
+    manifest = os.path.join(directory, 'jobs.jsonl')
+    with open(manifest, 'w') as f:
+        for job in jobs:
+            f.write(json.dumps(job) + '\n')
+    return manifest
+
+
+def _pick_job(job, queue):
+    tree = load_tree(job['treefile'])
+    return {number: [leaf.name for leaf in pd_greedy(tree, number, [], engine='fast')]
+            for number in job['number_representatives']}
+
+
+def test_batch_read_manifest():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manifest = _write_manifest(tmpdir, [{'job_id': 'first', 'treefile': 'tests/tree_files/tree.nwk'},
+                                            {'treefile': 'tests/tree_files/tree.nwk'}])
+        jobs = batch.read_manifest(manifest)
+        assert [job['job_id'] for job in jobs] == ['first', 'job_2']
+        with open(manifest, 'a') as f:
+            f.write('{"job_id": "first"}\n')
+        with pytest.raises(ValueError):
+            batch.read_manifest(manifest)
+        manifest = _write_manifest(tmpdir, [{'job_id': '../escape'}])
+        with pytest.raises(ValueError):
+            batch.read_manifest(manifest)
+
+
+def test_batch_claims_and_stale_claims():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = batch.WorkQueue(tmpdir, stale_after=60)
+        other = batch.WorkQueue(tmpdir, stale_after=60)
+        assert queue.claim('job')
+        assert not other.claim('job')
+        assert other.is_claimed('job')
+        lock = os.path.join(tmpdir, 'claims', 'job.lock')
+        os.utime(lock, (time.time() - 120, time.time() - 120))
+        assert not other.is_claimed('job')
+        assert other.claim('job')
+        assert not queue.claim('job')
+        other.release('job')
+        assert queue.claim('job')
+
+
+def test_batch_racing_claims_on_stale_claim():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dead = batch.WorkQueue(tmpdir, stale_after=60)
+        first = batch.WorkQueue(tmpdir, stale_after=60)
+        second = batch.WorkQueue(tmpdir, stale_after=60)
+        assert dead.claim('job')
+        lock = os.path.join(tmpdir, 'claims', 'job.lock')
+        os.utime(lock, (time.time() - 120, time.time() - 120))
+        read_claim = batch.WorkQueue._read_claim
+        raced = list()
+
+        def slow_read_claim(queue, path):
+            seen = read_claim(queue, path)
+            # Right after second looks at the stale claim, first takes it over and makes a fresh one.
+            if queue is second and path == lock and not raced:
+                raced.append(seen)
+                assert first.claim('job')
+            return seen
+
+        with patch.object(batch.WorkQueue, '_read_claim', slow_read_claim):
+            assert not second.claim('job')
+        assert raced
+        assert first.heartbeat('job')
+        assert not second.heartbeat('job')
+        assert not dead.heartbeat('job')
+        with open(lock) as f:
+            assert json.load(f)['token'] == first._tokens['job']
+        assert os.listdir(os.path.join(tmpdir, 'claims')) == ['job.lock']
+        # Releasing a claim that's been taken over leaves the new one alone.
+        dead.release('job')
+        assert second.is_claimed('job')
+        first.release('job')
+        assert os.listdir(os.path.join(tmpdir, 'claims')) == []
+
+
+def test_batch_many_claims_on_stale_claim():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        assert batch.WorkQueue(tmpdir, stale_after=60).claim('job')
+        lock = os.path.join(tmpdir, 'claims', 'job.lock')
+        os.utime(lock, (time.time() - 120, time.time() - 120))
+        queues = [batch.WorkQueue(tmpdir, stale_after=60) for _ in range(8)]
+        start = threading.Barrier(len(queues))
+        won = list()
+
+        def claimer(queue):
+            start.wait()
+            if queue.claim('job'):
+                won.append(queue)
+
+        threads = [threading.Thread(target=claimer, args=(queue,)) for queue in queues]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(won) == 1
+        assert [queue.heartbeat('job') for queue in queues].count(True) == 1
+        assert os.listdir(os.path.join(tmpdir, 'claims')) == ['job.lock']
+
+
+def test_batch_workers_run_each_job_once():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        jobs = [{'job_id': 'job{}'.format(i), 'treefile': 'tests/tree_files/tree.nwk', 'number_representatives': [i]}
+                for i in range(1, 9)]
+        jobs.append({'job_id': 'broken', 'treefile': 'tests/tree_files/not_a_tree.nwk',
+                     'number_representatives': [2]})
+        manifest = _write_manifest(tmpdir, jobs)
+        queue_dir = os.path.join(tmpdir, 'queue')
+        ran = list()
+
+        def worker():
+            ran.extend(batch.work(manifest, queue_dir, poll_seconds=0.01, runner=_pick_job))
+
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(ran) == sorted(job['job_id'] for job in jobs)
+        assert os.listdir(os.path.join(queue_dir, 'claims')) == []
+        # Nothing left to do, so another worker doesn't run anything.
+        assert batch.work(manifest, queue_dir, poll_seconds=0.01, runner=_pick_job) == []
+        assert batch.work(manifest, queue_dir, poll_seconds=0.01, runner=_pick_job, retry_failed=True) == ['broken']
+        tree = load_tree('tests/tree_files/tree.nwk')
+        rows = batch.compile_summary(manifest, queue_dir, os.path.join(tmpdir, 'summary.tsv'))
+        assert len(rows) == 9
+        expected = pd_greedy(tree, 3, [], engine='fast')
+        assert rows[2][:4] == ('job3', 'done', '3', ','.join(leaf.name for leaf in expected))
+        assert rows[-1][1] == 'failed'
+        with open(os.path.join(tmpdir, 'summary.tsv')) as f:
+            assert len(f.readlines()) == 10
+
+
+def test_batch_takes_over_stale_job_and_summarizes_pending():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manifest = _write_manifest(tmpdir, [{'job_id': 'a', 'treefile': 'tests/tree_files/tree.nwk',
+                                             'number_representatives': [2]},
+                                            {'job_id': 'b', 'treefile': 'tests/tree_files/tree.nwk',
+                                             'number_representatives': [3]}])
+        queue_dir = os.path.join(tmpdir, 'queue')
+        dead = batch.WorkQueue(queue_dir, stale_after=0.2)
+        assert dead.claim('a')
+        assert [row[1] for row in batch.compile_summary(manifest, queue_dir)] == ['running', 'pending']
+        # The node that claimed job a never finishes it, so this worker runs b, waits, then takes a over.
+        ran = batch.work(manifest, queue_dir, stale_after=0.2, poll_seconds=0.05, runner=_pick_job)
+        assert ran == ['b', 'a']
+        assert [row[1] for row in batch.compile_summary(manifest, queue_dir)] == ['done', 'done']
+
+
+def test_batch_run_job():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manifest = _write_manifest(tmpdir, [{'job_id': 'real', 'treefile': 'tests/tree_files/tree.nwk',
+                                             'number_representatives': [2], 'engine': 'fast'}])
+        queue_dir = os.path.join(tmpdir, 'queue')
+        assert batch.work(manifest, queue_dir, runner=batch.run_job) == ['real']
+        assert os.path.isfile(os.path.join(queue_dir, 'reports', 'real.html'))
+        result = batch.WorkQueue(queue_dir).result('real')
+        assert result['status'] == 'done'
+        assert len(result['selections']['2']) == 2